@@ -0,0 +1,24 @@
+import threading
+
+import cv2
+
+FRONTAL_FACE = 'haarcascade_frontalface_default.xml'
+
+# OpenCV cascades keep per-call scratch state and are not safe to share
+# between threads, so each thread lazily loads its own copy.
+_local = threading.local()
+
+
+def get_face_cascade():
+    cascade = getattr(_local, 'face_cascade', None)
+    if cascade is None:
+        cascade = cv2.CascadeClassifier(cv2.data.haarcascades + FRONTAL_FACE)
+        if cascade.empty():
+            raise RuntimeError(f'Cannot load {FRONTAL_FACE}')
+        _local.face_cascade = cascade
+    return cascade
+
+
+def warmup():
+    """Load the cascade for the calling thread (e.g. from gunicorn post_fork)."""
+    get_face_cascade()
@@ -0,0 +1,9 @@
+from django.core.checks import Tags, register
+
+from securecloud.caches import shared_cache_errors
+
+
+@register(Tags.caches)
+def check_otp_cache(app_configs, **kwargs):
+    # an OTP issued by one worker has to verify on any other
+    return shared_cache_errors('OTP_CACHE', 'accounts.E001', 'One-time passwords')
@@ -0,0 +1,150 @@
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+
+logger = logging.getLogger(__name__)
+
+
+class MailQueue:
+    """In-process outbound mail queue drained by a background thread.
+
+    Views enqueue and return immediately. The sender keeps one backend
+    connection (one SMTP session and TLS handshake) open across messages,
+    sends whatever is queued in batches, retries failures with exponential
+    backoff and closes the connection after `idle_timeout` seconds without
+    mail. Queued mail lives in memory only; for OTPs, which expire within
+    minutes and can be resent, that is an acceptable trade-off.
+    """
+
+    def __init__(self, batch_size=20, max_retries=5, backoff=1.0, idle_timeout=30):
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.idle_timeout = idle_timeout
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._connection = None
+        self.sent = 0
+        self.failed = 0
+
+    def enqueue(self, message: EmailMessage):
+        self._ensure_thread()
+        self._queue.put(message)
+
+    def flush(self, timeout=None) -> bool:
+        """Wait until everything queued so far was sent or given up on."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
+        return True
+
+    def _ensure_thread(self):
+        # a forked worker inherits the queue object but not the thread
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            if self._pid != os.getpid():
+                self._queue = queue.Queue()
+                self._connection = None
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='mail-queue', daemon=True)
+            self._thread.start()
+
+    def _open(self):
+        if self._connection is None:
+            self._connection = get_connection(fail_silently=False)
+            self._connection.open()
+        return self._connection
+
+    def _close(self):
+        if self._connection is not None:
+            try:
+                self._connection.close()
+            except Exception:
+                pass
+            self._connection = None
+
+    def _next_batch(self):
+        try:
+            batch = [self._queue.get(timeout=self.idle_timeout)]
+        except queue.Empty:
+            return []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                self._close()
+                continue
+            try:
+                self._send(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _send(self, batch):
+        attempt = 0
+        pending = list(batch)
+        while pending:
+            try:
+                connection = self._open()
+                # one message at a time, so a failure never resends earlier ones
+                while pending:
+                    connection.send_messages([pending[0]])
+                    pending.pop(0)
+                    self.sent += 1
+            except Exception as e:
+                self._close()
+                attempt += 1
+                if attempt > self.max_retries:
+                    self.failed += len(pending)
+                    logger.error(f"Giving up on {len(pending)} email(s) after {attempt} attempts: {e}")
+                    return
+                delay = self.backoff * 2 ** (attempt - 1)
+                logger.warning(f"Email send failed ({e}); retrying in {delay:.1f}s")
+                time.sleep(delay)
+
+
+mail_queue = MailQueue(
+    batch_size=getattr(settings, 'EMAIL_QUEUE_BATCH_SIZE', 20),
+    max_retries=getattr(settings, 'EMAIL_QUEUE_MAX_RETRIES', 5),
+    backoff=getattr(settings, 'EMAIL_QUEUE_RETRY_BACKOFF', 1.0),
+    idle_timeout=getattr(settings, 'EMAIL_QUEUE_IDLE_TIMEOUT', 30),
+)
+
+
+@atexit.register
+def _drain_on_exit():
+    # give queued OTPs a moment to go out on a graceful worker shutdown
+    if mail_queue._pid == os.getpid():
+        mail_queue.flush(timeout=5)
+
+
+def send_queued_mail(subject, body, recipient_list, from_email=None):
+    """Queue a message for the background sender, or send it inline when
+    EMAIL_QUEUE_ASYNC is off."""
+    message = EmailMessage(subject, body, from_email or settings.DEFAULT_FROM_EMAIL, recipient_list)
+    if getattr(settings, 'EMAIL_QUEUE_ASYNC', True):
+        mail_queue.enqueue(message)
+    else:
+        message.send(fail_silently=False)
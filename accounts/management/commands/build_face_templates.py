@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from accounts.models import Profile
+from accounts.views import build_face_template
+
+
+class Command(BaseCommand):
+    help = 'Compute face templates for profiles that have a registered face image.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Rebuild templates that already exist.')
+
+    def handle(self, *args, **options):
+        profiles = Profile.objects.exclude(face_image='').exclude(face_image__isnull=True)
+        if not options['force']:
+            profiles = profiles.filter(face_template__isnull=True)
+        built = failed = 0
+        for profile in profiles.iterator():
+            try:
+                with profile.face_image.open('rb') as f:
+                    template = build_face_template(f.read())
+            except Exception as e:
+                self.stderr.write(f'{profile}: cannot read face image ({e})')
+                failed += 1
+                continue
+            if template is None:
+                failed += 1
+                continue
+            Profile.objects.filter(pk=profile.pk).update(face_template=template)
+            built += 1
+        self.stdout.write(f'Built {built} face templates ({failed} failed)')
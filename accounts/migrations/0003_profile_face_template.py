@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-18 17:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0002_profile_face_image'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='face_template',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+    ]
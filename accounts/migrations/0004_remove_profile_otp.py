@@ -0,0 +1,21 @@
+# Generated by Django 6.0 on 2026-10-18 20:30
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0003_profile_face_template'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='profile',
+            name='otp_code',
+        ),
+        migrations.RemoveField(
+            model_name='profile',
+            name='otp_created_at',
+        ),
+    ]
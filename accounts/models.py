@@ -5,9 +5,9 @@ from django.dispatch import receiver
 
 class Profile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
-    otp_code = models.CharField(max_length=6, blank=True, null=True)
-    otp_created_at = models.DateTimeField(blank=True, null=True)
     face_image = models.ImageField(upload_to='faces/', blank=True, null=True)
+    # normalized 100x100 grayscale face crop (uint8), see accounts.views.build_face_template
+    face_template = models.BinaryField(blank=True, null=True)
 
     def __str__(self):
         return self.user.username
@@ -18,5 +18,8 @@ def create_user_profile(sender, instance, created, **kwargs):
         Profile.objects.create(user=instance)
 
 @receiver(post_save, sender=User)
-def save_user_profile(sender, instance, **kwargs):
+def save_user_profile(sender, instance, update_fields=None, **kwargs):
+    # logging in only updates last_login; don't rewrite the profile for it
+    if update_fields is not None and set(update_fields) == {'last_login'}:
+        return
     instance.profile.save()
@@ -0,0 +1,73 @@
+import hashlib
+import hmac
+import secrets
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+class OTPStore:
+    """One-time passwords kept in Django's cache instead of on Profile.
+
+    Each user has at most one live code. It expires through the cache TTL,
+    allows `max_attempts` guesses, counted with cache.incr, and is
+    consumed by the first correct guess: the winning request is the one
+    whose cache.delete actually removed the key. Only an HMAC of the code
+    is stored. The attempt limit only holds if incr is atomic, which the
+    OTP_CACHE system check enforces (Redis or AtomicDatabaseCache).
+    """
+
+    def __init__(self, cache_alias='default', ttl=300, max_attempts=5, prefix='otp'):
+        self.cache_alias = cache_alias
+        self.ttl = ttl
+        self.max_attempts = max_attempts
+        self.prefix = prefix
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    def _keys(self, user_id):
+        return f'{self.prefix}:{user_id}:code', f'{self.prefix}:{user_id}:attempts'
+
+    def _digest(self, user_id, code: str) -> str:
+        return hmac.new(settings.SECRET_KEY.encode(), f'{user_id}:{code}'.encode(), hashlib.sha256).hexdigest()
+
+    def issue(self, user_id) -> str:
+        """Create a fresh code for user_id, replacing any previous one."""
+        code = f'{secrets.randbelow(10 ** 6):06d}'
+        code_key, attempts_key = self._keys(user_id)
+        self.cache.set_many({code_key: self._digest(user_id, code), attempts_key: 0}, timeout=self.ttl)
+        return code
+
+    def verify(self, user_id, code) -> bool:
+        """Check and consume a code; False once expired, used or out of attempts."""
+        code_key, attempts_key = self._keys(user_id)
+        try:
+            attempts = self.cache.incr(attempts_key)
+        except ValueError:
+            return False
+        if attempts > self.max_attempts:
+            self.cache.delete(code_key)
+            return False
+        digest = self.cache.get(code_key)
+        if digest is None or not hmac.compare_digest(digest, self._digest(user_id, code or '')):
+            return False
+        if not self.cache.delete(code_key):
+            return False
+        self.cache.delete(attempts_key)
+        return True
+
+    def attempts_left(self, user_id) -> int:
+        _, attempts_key = self._keys(user_id)
+        attempts = self.cache.get(attempts_key)
+        if attempts is None:
+            return 0
+        return max(0, self.max_attempts - attempts)
+
+
+otp_store = OTPStore(
+    cache_alias=getattr(settings, 'OTP_CACHE', 'default'),
+    ttl=getattr(settings, 'OTP_TTL', 300),
+    max_attempts=getattr(settings, 'OTP_MAX_ATTEMPTS', 5),
+)
@@ -1,3 +1,205 @@
-from django.test import TestCase
+import base64
+import io
+import tempfile
+import time
+from unittest import mock
 
-# Create your tests here.
+import cv2
+import numpy as np
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.files.base import ContentFile
+from django.core.mail import EmailMessage
+from django.core.mail.backends.base import BaseEmailBackend
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from .checks import check_otp_cache
+from .mailqueue import MailQueue
+from .models import Profile
+from .otp import OTPStore
+from .views import FACE_SIZE, _stored_face, build_face_template
+
+
+class FlakyBackend(BaseEmailBackend):
+    """Counts connections and fails the next `failures` sends."""
+    opened = 0
+    failures = 0
+
+    def open(self):
+        FlakyBackend.opened += 1
+        return True
+
+    def send_messages(self, messages):
+        if FlakyBackend.failures:
+            FlakyBackend.failures -= 1
+            raise ConnectionError('smtp unavailable')
+        mail.outbox.extend(messages)
+        return len(messages)
+
+
+@override_settings(EMAIL_BACKEND='accounts.tests.FlakyBackend')
+class MailQueueTests(SimpleTestCase):
+
+    def setUp(self):
+        FlakyBackend.opened = 0
+        FlakyBackend.failures = 0
+        self.queue = MailQueue(backoff=0.01, idle_timeout=60)
+
+    def enqueue(self, count):
+        for i in range(count):
+            self.queue.enqueue(EmailMessage(f'OTP {i}', 'body', 'from@example.com', ['to@example.com']))
+        self.assertTrue(self.queue.flush(timeout=5))
+
+    def test_reuses_one_connection(self):
+        self.enqueue(5)
+        self.enqueue(3)
+        self.assertEqual([m.subject for m in mail.outbox], [f'OTP {i}' for i in range(5)] + [f'OTP {i}' for i in range(3)])
+        self.assertEqual(FlakyBackend.opened, 1)
+
+    def test_retries_without_resending(self):
+        FlakyBackend.failures = 2
+        self.enqueue(3)
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(self.queue.sent, 3)
+        self.assertEqual(FlakyBackend.opened, 3)
+
+    def test_gives_up_after_max_retries(self):
+        self.queue.max_retries = 1
+        FlakyBackend.failures = 10
+        self.enqueue(1)
+        self.assertEqual(mail.outbox, [])
+        self.assertEqual(self.queue.failed, 1)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'otp-tests'}})
+class OTPStoreTests(SimpleTestCase):
+
+    def setUp(self):
+        self.store = OTPStore(max_attempts=3)
+        self.store.cache.clear()
+
+    def test_code_is_single_use(self):
+        code = self.store.issue(1)
+        self.assertTrue(self.store.verify(1, code))
+        self.assertFalse(self.store.verify(1, code))
+
+    def test_attempts_are_bounded(self):
+        code = self.store.issue(1)
+        for _ in range(3):
+            self.assertFalse(self.store.verify(1, 'nope'))
+        self.assertEqual(self.store.attempts_left(1), 0)
+        self.assertFalse(self.store.verify(1, code))
+
+    def test_reissue_replaces_code(self):
+        with mock.patch('secrets.randbelow', side_effect=[111111, 222222]):
+            old = self.store.issue(1)
+            new = self.store.issue(1)
+        self.assertFalse(self.store.verify(1, old))
+        self.assertTrue(self.store.verify(1, new))
+
+    def test_expires_with_ttl(self):
+        self.store.ttl = 1
+        code = self.store.issue(2)
+        with mock.patch('time.time', return_value=time.time() + 2):
+            self.assertFalse(self.store.verify(2, code))
+
+
+@override_settings(OTP_CACHE='default')
+class OTPCacheCheckTests(SimpleTestCase):
+    LOCMEM = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+    @override_settings(DEBUG=False, CACHES=LOCMEM)
+    def test_process_local_cache_is_refused(self):
+        self.assertEqual([e.id for e in check_otp_cache(None)], ['accounts.E001'])
+
+    @override_settings(DEBUG=True, CACHES=LOCMEM)
+    def test_process_local_cache_allowed_in_debug(self):
+        self.assertEqual(check_otp_cache(None), [])
+
+    @override_settings(DEBUG=False, CACHES={'default': {'BACKEND': 'django.core.cache.backends.db.DatabaseCache', 'LOCATION': 't'}})
+    def test_non_atomic_incr_is_refused(self):
+        self.assertEqual([e.id for e in check_otp_cache(None)], ['accounts.E001'])
+
+    @override_settings(DEBUG=False, CACHES={'default': {'BACKEND': 'securecloud.caches.AtomicDatabaseCache', 'LOCATION': 't'}})
+    def test_shared_cache_passes(self):
+        self.assertEqual(check_otp_cache(None), [])
+
+    @override_settings(DEBUG=False, OTP_CACHE='missing', CACHES=LOCMEM)
+    def test_unknown_alias_is_refused(self):
+        self.assertEqual([e.id for e in check_otp_cache(None)], ['accounts.E001'])
+
+
+def face_png(shade=0) -> bytes:
+    # a gradient with no detectable face, so the whole frame is the template
+    y, x = np.mgrid[0:120, 0:160]
+    image = np.stack([(x + shade) % 256, (y + shade) % 256, (x + y) % 256], axis=-1).astype(np.uint8)
+    return cv2.imencode('.png', image)[1].tobytes()
+
+
+class FaceTemplateTests(TestCase):
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        settings = override_settings(MEDIA_ROOT=media.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def profile(self, username, raw=None, template=None):
+        user = User.objects.create_user(username, f'{username}@example.com', 'pw')
+        profile = user.profile
+        if raw is not None:
+            profile.face_image.save(f'{username}.png', ContentFile(raw), save=False)
+        profile.face_template = template
+        profile.save()
+        return Profile.objects.get(pk=profile.pk)
+
+    def stored_template(self, profile):
+        value = Profile.objects.get(pk=profile.pk).face_template
+        return None if value is None else bytes(value)
+
+    def test_registration_stores_template(self):
+        raw = face_png()
+        data_url = 'data:image/png;base64,' + base64.b64encode(raw).decode()
+        response = self.client.post(reverse('register'), {
+            'username': 'newface', 'email': 'newface@example.com',
+            'password': 'pw-12345', 'confirm_password': 'pw-12345', 'face_image_data': data_url,
+        })
+        self.assertRedirects(response, reverse('login'), fetch_redirect_response=False)
+        profile = Profile.objects.get(user__username='newface')
+        self.assertEqual(bytes(profile.face_template), build_face_template(raw))
+        self.assertEqual(len(profile.face_template), FACE_SIZE[0] * FACE_SIZE[1])
+
+    def test_stored_face_backfills_missing_template(self):
+        raw = face_png()
+        profile = self.profile('legacy', raw)
+        face = _stored_face(profile)
+        self.assertEqual(face.shape, FACE_SIZE)
+        self.assertEqual(self.stored_template(profile), build_face_template(raw))
+        # later logins use the stored template without opening the image
+        profile = Profile.objects.get(pk=profile.pk)
+        with mock.patch('accounts.views.build_face_template') as build:
+            np.testing.assert_array_equal(_stored_face(profile), face)
+        build.assert_not_called()
+
+    def test_stored_face_without_image(self):
+        profile = self.profile('noface')
+        self.assertIsNone(_stored_face(profile))
+        self.assertIsNone(self.stored_template(profile))
+
+    def test_command_builds_missing_templates(self):
+        legacy = self.profile('legacy', face_png())
+        current = self.profile('current', face_png(40), template=b'old')
+        broken = self.profile('broken', face_png())
+        broken.face_image.storage.delete(broken.face_image.name)
+        self.profile('noface')
+        out, err = io.StringIO(), io.StringIO()
+        call_command('build_face_templates', stdout=out, stderr=err)
+        self.assertIn('Built 1 face templates (1 failed)', out.getvalue())
+        self.assertIn('broken: cannot read face image', err.getvalue())
+        self.assertEqual(self.stored_template(legacy), build_face_template(face_png()))
+        self.assertEqual(self.stored_template(current), b'old')
+        call_command('build_face_templates', '--force', stdout=out, stderr=io.StringIO())
+        self.assertEqual(self.stored_template(current), build_face_template(face_png(40)))
@@ -2,12 +2,13 @@ from django.shortcuts import render, redirect
 from django.contrib.auth import login, logout
 from django.contrib.auth.decorators import login_required
 from .forms import RegisterForm, LoginForm
-import random
-from django.core.mail import send_mail
+from .models import Profile
+from .cascades import get_face_cascade
+from .mailqueue import send_queued_mail
+from .otp import otp_store
 from django.contrib.auth.models import User
 from django.contrib import messages
-from django.conf import settings
-from storage.models import StoredFile
+from storage.models import file_type_counts
 import json
 from django.core.files.base import ContentFile
 import base64
@@ -26,39 +27,68 @@ def _decode_image_data_url(data_url):
         return None
 
 
-def _extract_face(image):
+FACE_SIZE = (100, 100)
+
+
+def _face_pixels(image):
     if image is None:
         return None
     gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-    faces = cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=4, minSize=(60, 60))
+    faces = get_face_cascade().detectMultiScale(gray, scaleFactor=1.1, minNeighbors=4, minSize=(60, 60))
     if len(faces) == 0:
         face = gray
     else:
         x, y, w, h = max(faces, key=lambda f: f[2] * f[3])
         face = gray[y:y + h, x:x + w]
-    face = cv2.resize(face, (100, 100))
+    return cv2.resize(face, FACE_SIZE)
+
+
+def _extract_face(image):
+    face = _face_pixels(image)
+    if face is None:
+        return None
     face = face.astype("float32") / 255.0
     return face
 
 
-def faces_match(stored_file, data_url, threshold=0.02):
+def build_face_template(raw):
+    """Return the stored template bytes for an encoded face image, or None."""
+    arr = np.frombuffer(raw, np.uint8)
+    face = _face_pixels(cv2.imdecode(arr, cv2.IMREAD_COLOR))
+    if face is None:
+        return None
+    return face.tobytes()
+
+
+def _stored_face(profile):
+    if profile.face_template:
+        face = np.frombuffer(bytes(profile.face_template), np.uint8).reshape(FACE_SIZE)
+        return face.astype("float32") / 255.0
+    # profiles registered before templates existed: build one now and keep it
     try:
-        stored_file.open()
-        raw = stored_file.read()
+        profile.face_image.open()
+        raw = profile.face_image.read()
     except Exception:
-        return False
+        return None
     finally:
         try:
-            stored_file.close()
+            profile.face_image.close()
         except Exception:
             pass
-    arr = np.frombuffer(raw, np.uint8)
-    stored = cv2.imdecode(arr, cv2.IMREAD_COLOR)
-    captured = _decode_image_data_url(data_url)
-    stored_face = _extract_face(stored)
-    captured_face = _extract_face(captured)
-    if stored_face is None or captured_face is None:
+    template = build_face_template(raw)
+    if template is None:
+        return None
+    profile.face_template = template
+    Profile.objects.filter(pk=profile.pk).update(face_template=template)
+    return np.frombuffer(template, np.uint8).reshape(FACE_SIZE).astype("float32") / 255.0
+
+
+def faces_match(profile, data_url, threshold=0.02):
+    stored_face = _stored_face(profile)
+    if stored_face is None:
+        return False
+    captured_face = _extract_face(_decode_image_data_url(data_url))
+    if captured_face is None:
         return False
     diff = np.mean((stored_face - captured_face) ** 2)
     return diff < threshold
@@ -77,6 +107,7 @@ def register_view(request):
                     header, data = face_data.split(',', 1)
                     raw = base64.b64decode(data)
                     filename = f"user_{user.id}_face.png"
+                    user.profile.face_template = build_face_template(raw)
                     user.profile.face_image.save(filename, ContentFile(raw), save=True)
                 except Exception:
                     pass
@@ -85,21 +116,7 @@ def register_view(request):
         form = RegisterForm()
     return render(request, 'accounts/register.html', {'form': form})
 
-def login_view(request):
-    mode = 'password'
-    if request.method == 'POST':
-        mode = request.POST.get('login_mode', 'password')
-        if mode == 'password':
-            form = LoginForm(request.POST)
-            if form.is_valid():
-                user = form.cleaned_data['user']
-                otp = str(random.randint(100000, 999999))
-                user.profile.otp_code = otp
-                user.profile.save()
-                try:
-                    print(f"DEBUG: EMAIL_HOST={settings.EMAIL_HOST}, PORT={settings.EMAIL_PORT}")
-                    print(f"Sending OTP to {user.email}...")
-                    email_message = f"""Hello {user.username},
+OTP_EMAIL = """Hello {username},
 
 Your One-Time Password (OTP) is: {otp}
 
@@ -108,18 +125,26 @@ Do not share this OTP with anyone.
 
 Regards,
 ECD Project Team."""
-                    send_mail(
-                        'Your OTP Code',
-                        email_message,
-                        settings.DEFAULT_FROM_EMAIL,
-                        [user.email],
-                        fail_silently=False,
-                    )
-                    print("Email sent successfully.")
-                    messages.success(request, f'OTP sent to {user.email}')
-                except Exception as e:
-                    print(f"Error sending email: {e}")
-                    messages.error(request, f"Error sending email: {e}")
+
+def _send_otp_email(request, user, otp, success_message):
+    # queued for the background sender (see accounts.mailqueue), so the
+    # request does not wait on the SMTP handshake
+    try:
+        send_queued_mail('Your OTP Code', OTP_EMAIL.format(username=user.username, otp=otp), [user.email])
+        messages.success(request, success_message)
+    except Exception as e:
+        messages.error(request, f"Error sending email: {e}")
+
+def login_view(request):
+    mode = 'password'
+    if request.method == 'POST':
+        mode = request.POST.get('login_mode', 'password')
+        if mode == 'password':
+            form = LoginForm(request.POST)
+            if form.is_valid():
+                user = form.cleaned_data['user']
+                otp = otp_store.issue(user.id)
+                _send_otp_email(request, user, otp, f'OTP sent to {user.email}')
                 request.session['pre_mfa_user_id'] = user.id
                 return redirect('otp_verify')
         else:
@@ -141,36 +166,11 @@ ECD Project Team."""
             if not user.profile.face_image:
                 messages.error(request, 'This account does not have a registered face. Use password login.')
                 return render(request, 'accounts/login.html', {'form': form, 'login_mode': 'face'})
-            if not faces_match(user.profile.face_image, face_login_data):
+            if not faces_match(user.profile, face_login_data):
                 messages.error(request, 'Face not recognized. Try again or use password login.')
                 return render(request, 'accounts/login.html', {'form': form, 'login_mode': 'face'})
-            otp = str(random.randint(100000, 999999))
-            user.profile.otp_code = otp
-            user.profile.save()
-            try:
-                print(f"DEBUG: EMAIL_HOST={settings.EMAIL_HOST}, PORT={settings.EMAIL_PORT}")
-                print(f"Sending OTP to {user.email}...")
-                email_message = f"""Hello {user.username},
-
-Your One-Time Password (OTP) is: {otp}
-
-This OTP is valid for 5 minutes.
-Do not share this OTP with anyone.
-
-Regards,
-ECD Project Team."""
-                send_mail(
-                    'Your OTP Code',
-                    email_message,
-                    settings.DEFAULT_FROM_EMAIL,
-                    [user.email],
-                    fail_silently=False,
-                )
-                print("Email sent successfully.")
-                messages.success(request, f'OTP sent to {user.email}')
-            except Exception as e:
-                print(f"Error sending email: {e}")
-                messages.error(request, f"Error sending email: {e}")
+            otp = otp_store.issue(user.id)
+            _send_otp_email(request, user, otp, f'OTP sent to {user.email}')
             request.session['pre_mfa_user_id'] = user.id
             return redirect('otp_verify')
     else:
@@ -183,20 +183,20 @@ def otp_verify_view(request):
         return redirect('login')
     
     if request.method == 'POST':
-        otp = request.POST.get('otp')
-        try:
-            user = User.objects.get(id=user_id)
-            if user.profile.otp_code == otp:
-                login(request, user)
-                if 'pre_mfa_user_id' in request.session:
-                    del request.session['pre_mfa_user_id']
-                user.profile.otp_code = None 
-                user.profile.save()
-                return redirect('dashboard')
-            else:
-                messages.error(request, 'Invalid OTP')
-        except User.DoesNotExist:
-            return redirect('login')
+        otp = (request.POST.get('otp') or '').strip()
+        if otp_store.verify(user_id, otp):
+            try:
+                user = User.objects.get(id=user_id)
+            except User.DoesNotExist:
+                return redirect('login')
+            login(request, user)
+            if 'pre_mfa_user_id' in request.session:
+                del request.session['pre_mfa_user_id']
+            return redirect('dashboard')
+        elif otp_store.attempts_left(user_id):
+            messages.error(request, 'Invalid OTP')
+        else:
+            messages.error(request, 'This OTP has expired or too many attempts were made. Request a new one.')
             
     return render(request, 'accounts/otp_verify.html')
 
@@ -209,34 +209,11 @@ def resend_otp_view(request):
         user = User.objects.get(id=user_id)
         
         # Generate new OTP
-        otp = str(random.randint(100000, 999999))
-        user.profile.otp_code = otp
-        user.profile.save()
+        otp = otp_store.issue(user.id)
         
         # Send Email
-        try:
-            print(f"DEBUG: EMAIL_HOST={settings.EMAIL_HOST}, PORT={settings.EMAIL_PORT}")
-            email_message = f"""Hello {user.username},
-
-Your One-Time Password (OTP) is: {otp}
+        _send_otp_email(request, user, otp, f'New OTP sent to {user.email}')
 
-This OTP is valid for 5 minutes.
-Do not share this OTP with anyone.
-
-Regards,
-ECD Project Team."""
-
-            send_mail(
-                'Your OTP Code',
-                email_message,
-                settings.DEFAULT_FROM_EMAIL,
-                [user.email],
-                fail_silently=False,
-            )
-            messages.success(request, f'New OTP sent to {user.email}')
-        except Exception as e:
-            messages.error(request, f"Error sending email: {e}")
-            
     except User.DoesNotExist:
         return redirect('login')
         
@@ -244,29 +221,8 @@ ECD Project Team."""
 
 @login_required
 def profile_view(request):
-    files = StoredFile.objects.filter(user=request.user)
-    labels = ["PDF","ZIP","PPTX","DOCX","XLSX","TXT","PNG","JPG","Other"]
-    counts_map = {k: 0 for k in labels}
-    for f in files:
-        name = (f.original_name or "").lower()
-        if ".pdf" in name:
-            counts_map["PDF"] += 1
-        elif ".zip" in name:
-            counts_map["ZIP"] += 1
-        elif ".pptx" in name:
-            counts_map["PPTX"] += 1
-        elif ".docx" in name:
-            counts_map["DOCX"] += 1
-        elif ".xlsx" in name:
-            counts_map["XLSX"] += 1
-        elif ".txt" in name:
-            counts_map["TXT"] += 1
-        elif ".png" in name:
-            counts_map["PNG"] += 1
-        elif ".jpg" in name or ".jpeg" in name:
-            counts_map["JPG"] += 1
-        else:
-            counts_map["Other"] += 1
+    counts_map = file_type_counts(request.user)
+    labels = list(counts_map)
     counts = [counts_map[l] for l in labels]
     return render(request, 'accounts/profile.html', {
         'chart_labels': labels,
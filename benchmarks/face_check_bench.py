@@ -0,0 +1,56 @@
+"""Face template matching with a fresh Haar cascade per call versus the
+per-thread pool in accounts.cascades.
+
+    python benchmarks/face_check_bench.py --iterations 50 --width 640 --height 480
+"""
+import argparse
+import base64
+import os
+import sys
+import time
+from pathlib import Path
+
+import cv2
+import django
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--width', type=int, default=640)
+    parser.add_argument('--height', type=int, default=480)
+    args = parser.parse_args()
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'securecloud.settings')
+    django.setup()
+    from accounts import views
+    from accounts.cascades import FRONTAL_FACE
+
+    rng = np.random.default_rng(0)
+    frame = rng.integers(0, 256, (args.height, args.width, 3), dtype=np.uint8)
+    ok, png = cv2.imencode('.png', frame)
+    data_url = 'data:image/png;base64,' + base64.b64encode(png.tobytes()).decode()
+    profile = type('BenchProfile', (), {'face_template': views.build_face_template(png.tobytes())})()
+
+    def fresh_cascade():
+        return cv2.CascadeClassifier(cv2.data.haarcascades + FRONTAL_FACE)
+
+    for label, factory in (('fresh cascade', fresh_cascade), ('pooled cascade', views.get_face_cascade)):
+        original = views.get_face_cascade
+        views.get_face_cascade = factory
+        try:
+            views.faces_match(profile, data_url)
+            start = time.perf_counter()
+            for _ in range(args.iterations):
+                views.faces_match(profile, data_url)
+            elapsed = time.perf_counter() - start
+        finally:
+            views.get_face_cascade = original
+        print(f"{label:>15}: {elapsed / args.iterations * 1000:.2f} ms per check")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""Encode time versus file size for the stego output codecs.
+
+Embeds random ciphertext into a cover, then writes the stego image with
+each PNG compress level / strategy and with lossless WebP, checking that
+the payload reads back intact from every container.
+
+    python benchmarks/stego_codec_bench.py --size 2000x1500 --fill 0.5
+    python benchmarks/stego_codec_bench.py --cover photo.jpg --repeat 5
+"""
+import argparse
+import io
+import os
+import sys
+import time
+from pathlib import Path
+
+import django
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+SETTINGS = [
+    ('PNGCodec', {'compress_level': 0}),
+    ('PNGCodec', {'compress_level': 1}),
+    ('PNGCodec', {'compress_level': 1, 'strategy': 'rle'}),
+    ('PNGCodec', {'compress_level': 3}),
+    ('PNGCodec', {'compress_level': 6}),
+    ('PNGCodec', {'compress_level': 6, 'strategy': 'filtered'}),
+    ('PNGCodec', {'compress_level': 1, 'strategy': 'huffman'}),
+    ('PNGCodec', {'compress_level': 6, 'strategy': 'huffman'}),
+    ('PNGCodec', {'compress_level': 9}),
+    ('WebPCodec', {'quality': 0, 'method': 0}),
+    ('WebPCodec', {'quality': 25, 'method': 0}),
+    ('WebPCodec', {'quality': 50, 'method': 2}),
+    ('WebPCodec', {'quality': 100, 'method': 4}),
+]
+
+
+def synthetic_cover(width, height):
+    # smooth gradients plus sensor-like noise, roughly how a photo compresses
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    base = np.stack([x / width * 255, y / height * 255, (x + y) / (width + height) * 255], axis=-1)
+    noise = np.random.default_rng(0).normal(0, 6, base.shape)
+    return np.clip(base + noise, 0, 255).astype(np.uint8)
+
+
+def best_of(repeat, fn):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cover', help='cover image to use instead of a synthetic one')
+    parser.add_argument('--size', default='2000x1500', help='synthetic cover WIDTHxHEIGHT')
+    parser.add_argument('--fill', type=float, default=0.5, help='fraction of the capacity carrying payload')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'securecloud.settings')
+    django.setup()
+    from storage import codecs
+    from storage.utils import embed_capacity, extract_data_from_image, hide_data_in_image, load_cover_pixels
+
+    if args.cover:
+        pixels = load_cover_pixels(args.cover)
+    else:
+        width, height = (int(v) for v in args.size.split('x'))
+        pixels = synthetic_cover(width, height)
+    height, width = pixels.shape[:2]
+    payload = os.urandom(int(embed_capacity(width, height) * args.fill))
+    stego = hide_data_in_image(pixels, payload)
+    print(f"{width}x{height} cover, {len(payload) / 1024:.0f} KiB payload, best of {args.repeat}")
+    print(f"{'codec':<44} {'encode ms':>10} {'decode ms':>10} {'size KiB':>10}")
+
+    for name, options in SETTINGS:
+        codec = getattr(codecs, name)(**options)
+        encode_time, (data, _) = best_of(args.repeat, lambda: codec.encode(stego))
+        decode_time, extracted = best_of(args.repeat, lambda: extract_data_from_image(io.BytesIO(data), len(payload)))
+        assert extracted == payload, f"{name} {options} lost the payload"
+        label = f"{name} " + ' '.join(f"{k}={v}" for k, v in options.items())
+        print(f"{label:<44} {encode_time * 1000:10.1f} {decode_time * 1000:10.1f} {len(data) / 1024:10.0f}")
+
+
+if __name__ == "__main__":
+    main()
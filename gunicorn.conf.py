@@ -0,0 +1,7 @@
+# Loaded automatically by gunicorn when started from the project root.
+
+
+def post_fork(server, worker):
+    # parse the Haar cascade once per worker instead of on the first face check
+    from accounts.cascades import warmup
+    warmup()
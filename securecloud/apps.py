@@ -0,0 +1,8 @@
+from django.apps import AppConfig
+
+
+class SecureCloudConfig(AppConfig):
+    name = 'securecloud'
+
+    def ready(self):
+        from . import checks  # noqa: F401 -- registers the firewall cache check
@@ -0,0 +1,120 @@
+import bisect
+import ipaddress
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def parse_ip(value):
+    """Parse an address, unwrapping IPv4-mapped IPv6; None if invalid."""
+    try:
+        addr = ipaddress.ip_address((value or '').strip())
+    except ValueError:
+        return None
+    if addr.version == 6 and addr.ipv4_mapped is not None:
+        return addr.ipv4_mapped
+    return addr
+
+
+class NetworkSet:
+    """IPv4/IPv6 networks compiled into sorted, merged integer intervals.
+
+    Lookups are a single bisect per address family, O(log n) in the number
+    of ranges, regardless of how many overlapping CIDRs were loaded.
+    """
+
+    def __init__(self, entries=()):
+        ranges = {4: [], 6: []}
+        self.invalid = []
+        for entry in entries:
+            entry = entry.split('#', 1)[0].strip()
+            if not entry:
+                continue
+            try:
+                network = ipaddress.ip_network(entry, strict=False)
+            except ValueError:
+                self.invalid.append(entry)
+                continue
+            ranges[network.version].append((int(network.network_address), int(network.broadcast_address)))
+        self._starts = {}
+        self._ends = {}
+        for version, spans in ranges.items():
+            merged = []
+            for start, end in sorted(spans):
+                if merged and start <= merged[-1][1] + 1:
+                    merged[-1][1] = max(merged[-1][1], end)
+                else:
+                    merged.append([start, end])
+            self._starts[version] = [start for start, _ in merged]
+            self._ends[version] = [end for _, end in merged]
+
+    def __len__(self):
+        return sum(len(starts) for starts in self._starts.values())
+
+    def __contains__(self, addr):
+        if not isinstance(addr, (ipaddress.IPv4Address, ipaddress.IPv6Address)):
+            addr = parse_ip(addr)
+            if addr is None:
+                return False
+        value = int(addr)
+        starts = self._starts[addr.version]
+        index = bisect.bisect_right(starts, value) - 1
+        return index >= 0 and value <= self._ends[addr.version][index]
+
+
+class Blocklist:
+    """Static entries plus an optional file that is re-read when it changes.
+
+    The file holds one address or CIDR per line ('#' starts a comment). Its
+    mtime is checked at most every `reload_interval` seconds, so workers
+    pick up edits without a restart.
+    """
+
+    def __init__(self, entries=(), path=None, reload_interval=30):
+        self.entries = list(entries)
+        self.path = path
+        self.reload_interval = reload_interval
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._checked = 0.0
+        self.networks = NetworkSet(self.entries)
+        self._maybe_reload(force=True)
+
+    def _maybe_reload(self, force=False):
+        if not self.path:
+            return
+        now = time.monotonic()
+        if not force and now - self._checked < self.reload_interval:
+            return
+        with self._lock:
+            if not force and now - self._checked < self.reload_interval:
+                return
+            self._checked = now
+            try:
+                mtime = os.stat(self.path).st_mtime
+            except OSError:
+                mtime = None
+            if mtime == self._mtime:
+                return
+            lines = []
+            if mtime is not None:
+                try:
+                    with open(self.path) as f:
+                        lines = f.readlines()
+                except (OSError, UnicodeDecodeError) as e:
+                    # keep the last good set and try again next interval
+                    logger.warning(f"Firewall blocklist could not read {self.path}: {e}")
+                    return
+            networks = NetworkSet(self.entries + lines)
+            if networks.invalid:
+                logger.warning(f"Firewall blocklist ignored invalid entries: {networks.invalid[:10]}")
+            self.networks = networks
+            self._mtime = mtime
+            logger.info(f"Firewall blocklist loaded {len(networks)} ranges from {self.path}")
+
+    def __contains__(self, ip):
+        self._maybe_reload()
+        return ip in self.networks
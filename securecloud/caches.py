@@ -0,0 +1,97 @@
+import base64
+import pickle
+
+from django.conf import settings
+from django.core.cache.backends.db import DatabaseCache
+from django.core.checks import Error
+from django.db import connections, router
+from django.utils.timezone import now as tz_now
+
+# Backends whose data lives in one process, so each gunicorn worker sees
+# its own copy
+PROCESS_LOCAL_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+# Backends whose incr is a get followed by a set, so concurrent increments
+# are lost; use AtomicDatabaseCache instead of the database backend
+NON_ATOMIC_INCR_BACKENDS = (
+    'django.core.cache.backends.db.DatabaseCache',
+    'django.core.cache.backends.filebased.FileBasedCache',
+)
+
+
+class AtomicDatabaseCache(DatabaseCache):
+    """DatabaseCache whose incr never loses an update.
+
+    The new value is written with an UPDATE that only matches while the row
+    still holds the value that was read; a request that loses the race
+    reads again and retries. The table is created the same way, with
+    `python manage.py createcachetable`.
+    """
+
+    def incr(self, key, delta=1, version=None):
+        cache_key = self.make_and_validate_key(key, version=version)
+        connection = connections[router.db_for_write(self.cache_model_class)]
+        quote_name = connection.ops.quote_name
+        table = quote_name(self._table)
+        value_col, key_col, expires_col = quote_name('value'), quote_name('cache_key'), quote_name('expires')
+        while True:
+            now = tz_now().replace(microsecond=0, tzinfo=None)
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f'SELECT {value_col} FROM {table} WHERE {key_col} = %s AND {expires_col} > %s',
+                    [cache_key, connection.ops.adapt_datetimefield_value(now)],
+                )
+                row = cursor.fetchone()
+                if row is None:
+                    raise ValueError(f"Key '{key}' not found")
+                value = pickle.loads(base64.b64decode(row[0].encode())) + delta
+                encoded = base64.b64encode(pickle.dumps(value, self.pickle_protocol)).decode('latin1')
+                cursor.execute(
+                    f'UPDATE {table} SET {value_col} = %s WHERE {key_col} = %s AND {value_col} = %s',
+                    [encoded, cache_key, row[0]],
+                )
+                if cursor.rowcount:
+                    return value
+
+
+def _backend(setting: str):
+    """(alias, backend path) named by `setting`; the path is None when the
+    alias is not in CACHES."""
+    alias = getattr(settings, setting, 'default')
+    if alias not in settings.CACHES:
+        return alias, None
+    return alias, settings.CACHES[alias].get('BACKEND', '')
+
+
+def atomic_cache_errors(setting: str, check_id: str, purpose: str) -> list[Error]:
+    """System check errors if the cache alias named by `setting` is missing
+    or its incr is not atomic."""
+    alias, backend = _backend(setting)
+    if backend is None:
+        return [Error(f"{setting} names the cache '{alias}', which is not in CACHES.", id=check_id)]
+    if backend not in NON_ATOMIC_INCR_BACKENDS:
+        return []
+    return [Error(
+        f"{setting} uses the cache '{alias}' ({backend}), whose incr is not atomic.",
+        hint=f"{purpose} count with cache.incr; use Redis or securecloud.caches.AtomicDatabaseCache.",
+        id=check_id,
+    )]
+
+
+def shared_cache_errors(setting: str, check_id: str, purpose: str) -> list[Error]:
+    """System check errors if the cache alias named by `setting` is missing,
+    has a non-atomic incr, or is process-local outside DEBUG."""
+    errors = atomic_cache_errors(setting, check_id, purpose)
+    if errors:
+        return errors
+    alias, backend = _backend(setting)
+    if settings.DEBUG or backend not in PROCESS_LOCAL_BACKENDS:
+        return []
+    return [Error(
+        f"{setting} uses the process-local cache '{alias}' ({backend}).",
+        hint=f"{purpose} must be visible to every worker; point {setting} at a shared cache (Redis or the database).",
+        id=check_id,
+    )]
@@ -0,0 +1,10 @@
+from django.core.checks import Tags, register
+
+from .caches import atomic_cache_errors
+
+
+@register(Tags.caches)
+def check_firewall_cache(app_configs, **kwargs):
+    # a non-atomic incr loses counts under load, letting clients past the
+    # limit; a process-local cache is fine, it just counts per worker
+    return atomic_cache_errors('FIREWALL_CACHE', 'securecloud.E001', 'Rate limits')
@@ -0,0 +1,48 @@
+import re
+from typing import NamedTuple
+
+from django.conf import settings
+
+DEFAULT_RULES = [
+    ('single_quote', r"(\%27)|(\')"),
+    ('sql_comment', r"(\-\-)"),
+    ('hash_comment', r"(\%23)|(#)"),
+    ('xp_cmd', r"(xp_)"),
+    ('semicolon', r"(;)"),
+    ('script_tag', r"(<script)"),
+    ('javascript_uri', r"(javascript:)"),
+    ('union_select', r"(UNION\s+SELECT)"),  # SQLi (with space check)
+]
+
+# Path and query are scanned as one string; none of the rules can match
+# across a NUL, so the separator never produces a false positive.
+SEPARATOR = '\x00'
+
+
+class Detection(NamedTuple):
+    rule: str
+    target: str  # 'path' or 'query'
+
+
+class RequestInspector:
+    """All rules compiled into one alternation with a named group per rule."""
+
+    def __init__(self, rules):
+        self.rules = list(rules)
+        parts = []
+        for index, (_, pattern) in enumerate(self.rules):
+            # the outer named group closes last, so match.lastgroup names the rule
+            parts.append(f'(?P<r{index}>{pattern})')
+        self.pattern = re.compile('|'.join(parts), re.IGNORECASE)
+
+    def inspect(self, path: str, query: str = '') -> Detection | None:
+        text = f'{path}{SEPARATOR}{query}' if query else path
+        match = self.pattern.search(text)
+        if match is None:
+            return None
+        name = self.rules[int(match.lastgroup[1:])][0]
+        return Detection(name, 'path' if match.start() < len(path) else 'query')
+
+
+def get_rules():
+    return getattr(settings, 'FIREWALL_INSPECTION_RULES', DEFAULT_RULES)
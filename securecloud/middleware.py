@@ -1,69 +1,95 @@
-import re
-import time
 import urllib.parse
 from django.conf import settings
-from django.http import HttpResponseForbidden
-from django.core.cache import cache
+from django.http import HttpResponse, HttpResponseForbidden
 from django.utils.deprecation import MiddlewareMixin
 import logging
 
+from .blocklist import Blocklist, NetworkSet, parse_ip
+from .inspection import RequestInspector, get_rules
+from .ratelimit import SlidingWindowLimiter, default_rule, route_rules, user_rule
+
 logger = logging.getLogger(__name__)
 
 class FirewallMiddleware(MiddlewareMixin):
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        self.limiter = SlidingWindowLimiter(getattr(settings, 'FIREWALL_CACHE', 'default'))
+        self.inspector = RequestInspector(get_rules())
+        self.blocklist = Blocklist(
+            getattr(settings, 'FIREWALL_BLOCKED_IPS', []),
+            path=getattr(settings, 'FIREWALL_BLOCKLIST_FILE', None),
+            reload_interval=getattr(settings, 'FIREWALL_BLOCKLIST_RELOAD_INTERVAL', 30),
+        )
+        self.trusted_proxies = NetworkSet(getattr(settings, 'FIREWALL_TRUSTED_PROXIES', []))
+
     def process_request(self, request):
         # 1. IP Blocking
         ip = self.get_client_ip(request)
-        blocked_ips = getattr(settings, 'FIREWALL_BLOCKED_IPS', [])
-        if ip in blocked_ips:
+        if ip in self.blocklist:
             logger.warning(f"Firewall blocked IP: {ip}")
             return HttpResponseForbidden("Access Denied by Firewall (IP Blocked)")
 
-        # 2. Rate Limiting (Simple Token Bucket or Counter)
-        # Limit: 100 requests per minute by default
-        rate_limit = getattr(settings, 'FIREWALL_RATE_LIMIT', 100)
-        if rate_limit > 0:
-            cache_key = f"firewall_rate_limit_{ip}"
-            request_count = cache.get(cache_key, 0)
-            if request_count >= rate_limit:
+        # 2. Rate Limiting (sliding window per IP)
+        rule = default_rule()
+        if rule.limit > 0:
+            retry_after = self.limiter.hit('ip', ip, rule)
+            if retry_after is not None:
                 logger.warning(f"Firewall rate limit exceeded for IP: {ip}")
-                return HttpResponseForbidden("Too Many Requests (Rate Limit Exceeded)")
-            cache.set(cache_key, request_count + 1, timeout=60)
+                return self.too_many_requests(retry_after)
 
         # 3. Basic SQL Injection / XSS Detection
-        # Check query parameters and path
-        suspicious_patterns = [
-            r"(\%27)|(\')",  # Single quote
-            r"(\-\-)",       # Comment
-            r"(\%23)|(#)",   # Comment
-            r"(xp_)",        # XP_ cmds
-            r"(;)",          # Semicolon
-            r"(<script)",    # XSS
-            r"(javascript:)", # XSS
-            r"(UNION\s+SELECT)", # SQLi (with space check)
-        ]
-        
-        # Check Path (Unquoted)
+        # Check path and query params (unquoted) in a single scan
         path = urllib.parse.unquote(request.path)
-        for pattern in suspicious_patterns:
-            if re.search(pattern, path, re.IGNORECASE):
-                logger.warning(f"Firewall blocked suspicious path: {request.path} from IP: {ip}")
-                return HttpResponseForbidden("Malicious Request Detected")
-
-        # Check Query Params (Unquoted)
         query_string = request.META.get('QUERY_STRING', '')
-        if query_string:
-            decoded_query = urllib.parse.unquote(query_string)
-            for pattern in suspicious_patterns:
-                if re.search(pattern, decoded_query, re.IGNORECASE):
-                    logger.warning(f"Firewall blocked suspicious query: {query_string} from IP: {ip}")
-                    return HttpResponseForbidden("Malicious Request Detected")
+        detection = self.inspector.inspect(path, urllib.parse.unquote(query_string))
+        if detection is not None:
+            source = request.path if detection.target == 'path' else query_string
+            logger.warning(f"Firewall blocked suspicious {detection.target} ({detection.rule}): {source} from IP: {ip}")
+            return HttpResponseForbidden("Malicious Request Detected")
 
         return None
 
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        # Per-route and per-user limits need the resolved URL and the session
+        # user, which are only available once the request phase has finished.
+        ip = self.get_client_ip(request)
+        user = getattr(request, 'user', None)
+        identity = f"user:{user.pk}" if user is not None and user.is_authenticated else f"ip:{ip}"
+        match = request.resolver_match
+        rule = route_rules().get(match.url_name) if match else None
+        if rule is not None:
+            retry_after = self.limiter.hit(f"route:{match.url_name}", identity, rule)
+            if retry_after is not None:
+                logger.warning(f"Firewall route limit exceeded for {identity} on {match.url_name}")
+                return self.too_many_requests(retry_after)
+        rule = user_rule()
+        if rule is not None and identity.startswith('user:'):
+            retry_after = self.limiter.hit('user', identity, rule)
+            if retry_after is not None:
+                logger.warning(f"Firewall rate limit exceeded for {identity}")
+                return self.too_many_requests(retry_after)
+        return None
+
+    def too_many_requests(self, retry_after):
+        response = HttpResponse("Too Many Requests (Rate Limit Exceeded)", status=429)
+        response['Retry-After'] = str(retry_after)
+        return response
+
     def get_client_ip(self, request):
+        # X-Forwarded-For is only trusted when it was appended by one of our
+        # proxies; walk it right to left and stop at the first untrusted hop.
+        remote = parse_ip(request.META.get('REMOTE_ADDR'))
+        if remote is None:
+            return request.META.get('REMOTE_ADDR') or ''
         x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
-        if x_forwarded_for:
-            ip = x_forwarded_for.split(',')[0]
-        else:
-            ip = request.META.get('REMOTE_ADDR')
-        return ip
+        if x_forwarded_for and remote in self.trusted_proxies:
+            client = remote
+            for hop in reversed(x_forwarded_for.split(',')):
+                addr = parse_ip(hop)
+                if addr is None:
+                    break
+                client = addr
+                if addr not in self.trusted_proxies:
+                    break
+            return str(client)
+        return str(remote)
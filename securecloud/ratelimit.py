@@ -0,0 +1,96 @@
+import math
+import time
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+@dataclass(frozen=True)
+class Rule:
+    limit: int
+    window: int = 60
+    burst: int = 0
+
+    @property
+    def threshold(self) -> int:
+        return self.limit + self.burst
+
+
+class SlidingWindowLimiter:
+    """Sliding-window counter on top of Django's cache.
+
+    Each identity gets one counter per fixed window; the previous window's
+    count is weighted by how much of it still overlaps the sliding window.
+    Increments use cache.incr, and a key's TTL is set once when the window
+    starts rather than on every hit. Counts are only exact on backends whose
+    incr is atomic (LocMem, Redis, Memcached, AtomicDatabaseCache); the
+    FIREWALL_CACHE system check refuses the others.
+    """
+
+    def __init__(self, cache_alias='default', prefix='firewall_rl'):
+        self.cache_alias = cache_alias
+        self.prefix = prefix
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    def _incr(self, key, timeout):
+        cache = self.cache
+        try:
+            return cache.incr(key)
+        except ValueError:
+            if cache.add(key, 1, timeout=timeout):
+                return 1
+            return cache.incr(key)
+
+    def hit(self, scope: str, identity: str, rule: Rule, now=None):
+        """Record one request; return None if allowed, else seconds to wait."""
+        now = time.time() if now is None else now
+        window = rule.window
+        current = int(now // window)
+        elapsed = now - current * window
+        key = f'{self.prefix}:{scope}:{identity}:{window}:'
+        count = self._incr(f'{key}{current}', timeout=window * 2)
+        if count > rule.threshold:
+            # the current window alone is over budget: wait for it to roll over
+            return max(1, math.ceil(window - elapsed))
+        previous = self.cache.get(f'{key}{current - 1}', 0)
+        weight = 1 - elapsed / window
+        if previous * weight + count <= rule.threshold:
+            return None
+        # time until the previous window's weight decays enough
+        wait = window * (1 - (rule.threshold - count) / previous) - elapsed
+        return max(1, math.ceil(wait))
+
+
+def default_rule() -> Rule:
+    return Rule(
+        limit=getattr(settings, 'FIREWALL_RATE_LIMIT', 100),
+        window=getattr(settings, 'FIREWALL_RATE_LIMIT_WINDOW', 60),
+        burst=getattr(settings, 'FIREWALL_RATE_LIMIT_BURST', 0),
+    )
+
+
+def user_rule() -> Rule | None:
+    limit = getattr(settings, 'FIREWALL_USER_RATE_LIMIT', 0)
+    if limit <= 0:
+        return None
+    return Rule(
+        limit=limit,
+        window=getattr(settings, 'FIREWALL_RATE_LIMIT_WINDOW', 60),
+        burst=getattr(settings, 'FIREWALL_RATE_LIMIT_BURST', 0),
+    )
+
+
+def route_rules() -> dict:
+    """FIREWALL_ROUTE_RATE_LIMITS maps URL names to a limit or a dict of Rule fields."""
+    rules = {}
+    window = getattr(settings, 'FIREWALL_RATE_LIMIT_WINDOW', 60)
+    for name, spec in getattr(settings, 'FIREWALL_ROUTE_RATE_LIMITS', {}).items():
+        if isinstance(spec, int):
+            rules[name] = Rule(limit=spec, window=window)
+        else:
+            rules[name] = Rule(**{'window': window, **spec})
+    return rules
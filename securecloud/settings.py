@@ -47,6 +47,7 @@ INSTALLED_APPS = [
     'rest_framework_simplejwt',
     'cloudinary',
     'cloudinary_storage',
+    'securecloud',
     'accounts',
     'storage',
 ]
@@ -92,6 +93,30 @@ DATABASES = {
     }
 }
 
+# Cache
+# 'default' is local to each process. 'shared' holds what every worker must
+# see (OTPs, dashboard summaries); both count with cache.incr, so it has to
+# be atomic. Set REDIS_URL in production; otherwise the database cache table
+# is used, with atomic increments. Create that table once with
+# `python manage.py createcachetable` (the test runner does it itself).
+
+REDIS_URL = os.environ.get('REDIS_URL')
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+}
+if REDIS_URL:
+    CACHES['shared'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': REDIS_URL,
+    }
+else:
+    CACHES['shared'] = {
+        'BACKEND': 'securecloud.caches.AtomicDatabaseCache',
+        'LOCATION': 'securecloud_cache',
+    }
+
 
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
@@ -198,13 +223,132 @@ if not EMAIL_HOST_USER or not EMAIL_HOST_PASSWORD:
     print("Warning: Email credentials not found in .env, falling back to console backend.")
     EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 
+# Give up on an unresponsive SMTP server instead of blocking the sender
+EMAIL_TIMEOUT = 10
+
+# OTP emails go through accounts.mailqueue: a background thread that reuses
+# one SMTP connection and retries with exponential backoff. False sends
+# inline during the request.
+EMAIL_QUEUE_ASYNC = True
+EMAIL_QUEUE_BATCH_SIZE = 20
+EMAIL_QUEUE_MAX_RETRIES = 5
+EMAIL_QUEUE_RETRY_BACKOFF = 1.0
+# Close the idle SMTP connection after this many seconds without mail
+EMAIL_QUEUE_IDLE_TIMEOUT = 30
+
+# One-time passwords live in this cache alias (see accounts.otp). It must be
+# shared by all workers and have an atomic incr; other backends fail the
+# system checks (process-local ones are allowed while DEBUG is on).
+OTP_CACHE = 'shared'
+OTP_TTL = 300
+OTP_MAX_ATTEMPTS = 5
+
 # ------------------------------------------------------------------------------
 # FIREWALL SETTINGS
 # ------------------------------------------------------------------------------
+# Addresses or CIDR networks (IPv4 and IPv6)
 FIREWALL_BLOCKED_IPS = [
     # '127.0.0.1', # Example: Uncomment to block localhost
     # '192.168.1.100',
+    # '203.0.113.0/24',
+]
+# Optional file with one address/CIDR per line, re-read when it changes
+FIREWALL_BLOCKLIST_FILE = os.environ.get('FIREWALL_BLOCKLIST_FILE')
+FIREWALL_BLOCKLIST_RELOAD_INTERVAL = 30
+# Proxies whose X-Forwarded-For entries are trusted (the hosting load balancer)
+FIREWALL_TRUSTED_PROXIES = [
+    '127.0.0.0/8', '10.0.0.0/8', '172.16.0.0/12', '192.168.0.0/16',
+    '::1/128', 'fc00::/7',
 ]
 
-# Max requests per minute per IP
+# Max requests per window per IP (sliding window, see securecloud.ratelimit)
 FIREWALL_RATE_LIMIT = 300
+FIREWALL_RATE_LIMIT_WINDOW = 60
+# Extra requests tolerated above a limit before answering 429
+FIREWALL_RATE_LIMIT_BURST = 30
+# Max requests per window per logged-in user (0 disables)
+FIREWALL_USER_RATE_LIMIT = 600
+# Per-route limits keyed by URL name, counted per user (or per IP when anonymous)
+FIREWALL_ROUTE_RATE_LIMITS = {
+    'login': 20,
+    'otp_verify': 20,
+    'resend_otp': 5,
+}
+# Request inspection rules as (name, regex) pairs, matched case-insensitively
+# against the decoded path and query. Defaults to
+# securecloud.inspection.DEFAULT_RULES when unset.
+# FIREWALL_INSPECTION_RULES = [...]
+
+# Cache alias holding the counters. Its incr must be atomic. Without Redis
+# each worker counts on its own, which keeps the database out of every request.
+FIREWALL_CACHE = 'shared' if REDIS_URL else 'default'
+
+# ------------------------------------------------------------------------------
+# STORAGE SETTINGS
+# ------------------------------------------------------------------------------
+# Plaintext bytes per AES-GCM chunk for newly uploaded files
+STORAGE_CHUNK_SIZE = 64 * 1024
+
+# Files per page in listings and the API (clients may ask for up to the max)
+STORAGE_PAGE_SIZE = 25
+STORAGE_MAX_PAGE_SIZE = 100
+
+# Profile chart reads per-user FileTypeCount rows (False: GROUP BY on StoredFile)
+STORAGE_FILE_TYPE_COUNTERS = True
+
+# Cache alias and lifetime of the per-user dashboard summary (see storage.summary).
+# Signals invalidate it, so the alias must be shared by all workers. With the
+# database cache a warm dashboard would still make two queries (the summary's
+# get_many plus the recent rows) against three uncached, so the summary is
+# only cached with Redis; None computes it on every request.
+STORAGE_DASHBOARD_CACHE = 'shared' if REDIS_URL else None
+STORAGE_DASHBOARD_CACHE_TIMEOUT = 300
+
+# Process-local cache of per-user derived keys (see storage.keycache)
+STORAGE_KEY_CACHE_SIZE = 1024
+STORAGE_KEY_CACHE_TTL = 300
+
+# 'sync' encrypts and embeds inside the request; 'job' stages the upload and
+# leaves the work to `python manage.py run_upload_worker`
+STORAGE_UPLOAD_MODE = os.environ.get('STORAGE_UPLOAD_MODE', 'sync')
+STORAGE_STAGING_ROOT = BASE_DIR / 'staging'
+STORAGE_JOB_TIMEOUT = 600
+STORAGE_JOB_MAX_ATTEMPTS = 3
+
+# Payloads too big for one cover are split over up to STORAGE_MAX_SHARDS stego
+# images; shards are embedded/extracted on a pool of STORAGE_SHARD_WORKERS
+# processes (1 runs them in the request process)
+STORAGE_MAX_SHARDS = 16
+STORAGE_SHARD_WORKERS = 2
+
+# Container stego images are written in (see storage.codecs). PNG's
+# COMPRESS_LEVEL trades upload CPU for size; 'storage.codecs.WebPCodec' writes
+# lossless WebP instead (with 'FALLBACK': {PNG options} for covers WebP cannot
+# hold). Downloads detect the container, so this can change at any time.
+# Compare settings with benchmarks/stego_codec_bench.py.
+STORAGE_STEGO_CODEC = {
+    'BACKEND': 'storage.codecs.PNGCodec',
+    'COMPRESS_LEVEL': 1,
+    'STRATEGY': 'default',
+}
+
+# Decoded pixels of recently used covers, per process (see storage.covers)
+STORAGE_COVER_PIXEL_CACHE_BYTES = 64 * 1024 * 1024
+
+# Bulk upload API: files per request (Django's DATA_UPLOAD_MAX_NUMBER_FILES
+# also caps files plus covers) and threads encrypting them in parallel
+STORAGE_BULK_UPLOAD_MAX_FILES = 50
+STORAGE_BULK_UPLOAD_WORKERS = 4
+
+# Batch ZIP downloads: files per archive and members extracted ahead of the
+# one currently streaming
+STORAGE_ZIP_MAX_FILES = 100
+STORAGE_ZIP_PREFETCH = 2
+
+# Opt-in cache of ciphertext extracted from stego images (never plaintext).
+# Example:
+# STORAGE_CIPHERTEXT_CACHE = {
+#     'BACKEND': 'storage.ciphercache.DiskBackend',  # or MemoryBackend
+#     'MAX_BYTES': 512 * 1024 * 1024,
+# }
+STORAGE_CIPHERTEXT_CACHE = None
@@ -0,0 +1,343 @@
+import os
+import pickle
+import tempfile
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.urls import resolve, reverse
+
+from .blocklist import Blocklist, NetworkSet, parse_ip
+from .checks import check_firewall_cache
+from .inspection import DEFAULT_RULES, Detection, RequestInspector, get_rules
+from .middleware import FirewallMiddleware
+from .ratelimit import Rule, SlidingWindowLimiter
+
+LOCMEM = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'firewall-tests'}}
+
+
+class AtomicDatabaseCacheTests(TestCase):
+
+    def setUp(self):
+        self.cache = caches['shared']
+        self.cache.clear()
+
+    def test_incr(self):
+        self.cache.set('n', 1)
+        self.assertEqual(self.cache.incr('n'), 2)
+        self.assertEqual(self.cache.incr('n', 5), 7)
+        self.assertEqual(self.cache.get('n'), 7)
+
+    def test_incr_missing_or_expired_key(self):
+        with self.assertRaises(ValueError):
+            self.cache.incr('missing')
+        self.cache.set('old', 1, timeout=-1)
+        with self.assertRaises(ValueError):
+            self.cache.incr('old')
+
+    def test_incr_retries_after_losing_a_race(self):
+        self.cache.set('n', 1)
+        loads = pickle.loads
+        raced = []
+
+        def racing_loads(data):
+            if not raced:
+                # another worker increments between our read and our write
+                raced.append(True)
+                self.cache.set('n', 5)
+            return loads(data)
+
+        with mock.patch('securecloud.caches.pickle.loads', racing_loads):
+            self.assertEqual(self.cache.incr('n'), 6)
+        self.assertEqual(self.cache.get('n'), 6)
+
+
+@override_settings(CACHES=LOCMEM)
+class SlidingWindowLimiterTests(SimpleTestCase):
+    WINDOW_START = 1000 * 60
+
+    def setUp(self):
+        caches['default'].clear()
+        self.limiter = SlidingWindowLimiter('default')
+        self.rule = Rule(limit=5, window=60)
+
+    def hits(self, count, now):
+        return [self.limiter.hit('ip', '10.0.0.1', self.rule, now=now) for _ in range(count)]
+
+    def test_allows_up_to_the_limit_then_rejects(self):
+        self.assertEqual(self.hits(5, self.WINDOW_START + 10), [None] * 5)
+        self.assertEqual(self.hits(1, self.WINDOW_START + 10), [50])
+
+    def test_burst_raises_the_threshold(self):
+        self.rule = Rule(limit=5, window=60, burst=2)
+        self.assertEqual(self.hits(7, self.WINDOW_START), [None] * 7)
+        self.assertIsNotNone(self.hits(1, self.WINDOW_START)[0])
+
+    def test_retry_after_at_window_boundary(self):
+        self.hits(5, self.WINDOW_START + 59.5)
+        self.assertEqual(self.hits(1, self.WINDOW_START + 59.5), [1])
+
+    def test_previous_window_is_weighted_by_overlap(self):
+        # half of the previous window still overlaps: 4 * 0.5 + count <= 5
+        self.hits(4, self.WINDOW_START - 1)
+        self.assertEqual(self.hits(3, self.WINDOW_START + 30), [None] * 3)
+        # the fourth waits until 4 * weight + 4 <= 5, i.e. weight 1/4 at 45s
+        self.assertEqual(self.hits(1, self.WINDOW_START + 30), [15])
+
+    def test_previous_window_expires_after_one_window(self):
+        self.hits(6, self.WINDOW_START - 1)
+        self.assertEqual(self.hits(5, self.WINDOW_START + 60), [None] * 5)
+
+    def test_identities_and_scopes_are_separate(self):
+        self.hits(5, self.WINDOW_START)
+        self.assertIsNone(self.limiter.hit('ip', '10.0.0.2', self.rule, now=self.WINDOW_START))
+        self.assertIsNone(self.limiter.hit('user', '10.0.0.1', self.rule, now=self.WINDOW_START))
+
+
+class FirewallCacheCheckTests(SimpleTestCase):
+
+    @override_settings(FIREWALL_CACHE='default', CACHES={'default': {'BACKEND': 'django.core.cache.backends.db.DatabaseCache', 'LOCATION': 't'}})
+    def test_non_atomic_incr_is_refused(self):
+        self.assertEqual([e.id for e in check_firewall_cache(None)], ['securecloud.E001'])
+
+    @override_settings(DEBUG=False, FIREWALL_CACHE='default', CACHES=LOCMEM)
+    def test_process_local_cache_is_allowed(self):
+        self.assertEqual(check_firewall_cache(None), [])
+
+
+@override_settings(
+    CACHES=LOCMEM, FIREWALL_CACHE='default', FIREWALL_BLOCKED_IPS=[], FIREWALL_BLOCKLIST_FILE=None,
+    FIREWALL_RATE_LIMIT=0, FIREWALL_USER_RATE_LIMIT=0, FIREWALL_ROUTE_RATE_LIMITS={},
+    FIREWALL_RATE_LIMIT_WINDOW=60, FIREWALL_RATE_LIMIT_BURST=0,
+)
+class FirewallRateLimitTests(TestCase):
+
+    def setUp(self):
+        caches['default'].clear()
+        self.factory = RequestFactory()
+        # pin the clock mid-window so no test straddles a window boundary
+        patcher = mock.patch('securecloud.ratelimit.time.time', return_value=1000 * 60 + 30)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def view(self, name, user=None, ip='203.0.113.5'):
+        path = reverse(name)
+        request = self.factory.get(path, REMOTE_ADDR=ip)
+        request.resolver_match = resolve(path)
+        if user is not None:
+            request.user = user
+        return FirewallMiddleware(lambda r: None).process_view(request, None, (), {})
+
+    @override_settings(FIREWALL_ROUTE_RATE_LIMITS={'login': 2})
+    def test_route_limit_per_ip_for_anonymous_users(self):
+        self.assertIsNone(self.view('login'))
+        self.assertIsNone(self.view('login'))
+        self.assertEqual(self.view('login').status_code, 429)
+        self.assertIsNone(self.view('login', ip='203.0.113.6'))
+        self.assertIsNone(self.view('register'))
+
+    @override_settings(FIREWALL_ROUTE_RATE_LIMITS={'login': {'limit': 1, 'window': 10}})
+    def test_route_limit_per_user_across_ips(self):
+        user = User(pk=1, username='alice')
+        self.assertIsNone(self.view('login', user=user, ip='203.0.113.5'))
+        response = self.view('login', user=user, ip='203.0.113.6')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '10')
+
+    @override_settings(FIREWALL_USER_RATE_LIMIT=1)
+    def test_user_limit_only_applies_to_logged_in_users(self):
+        user = User(pk=1, username='alice')
+        self.assertIsNone(self.view('register', user=user))
+        self.assertEqual(self.view('profile', user=user).status_code, 429)
+        self.assertIsNone(self.view('profile'))
+        self.assertIsNone(self.view('profile'))
+
+    @override_settings(FIREWALL_RATE_LIMIT=1)
+    def test_ip_limit_returns_429_with_retry_after(self):
+        self.assertNotEqual(self.client.get(reverse('login')).status_code, 429)
+        response = self.client.get(reverse('login'))
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '30')
+        self.assertEqual(response.content, b'Too Many Requests (Rate Limit Exceeded)')
+
+
+class NetworkSetTests(SimpleTestCase):
+
+    def test_cidr_and_single_addresses(self):
+        networks = NetworkSet(['10.0.0.0/8', '192.168.1.5', '192.168.1.6/31  # office'])
+        for ip in ('10.0.0.0', '10.255.255.255', '192.168.1.5', '192.168.1.7'):
+            self.assertIn(ip, networks)
+        for ip in ('11.0.0.0', '9.255.255.255', '192.168.1.4', '192.168.1.8'):
+            self.assertNotIn(ip, networks)
+
+    def test_overlapping_ranges_are_merged(self):
+        networks = NetworkSet(['10.0.0.0/24', '10.0.0.128/25', '10.0.1.0/24', '10.0.3.0/24'])
+        self.assertEqual(len(networks), 2)
+        self.assertIn('10.0.1.200', networks)
+        self.assertNotIn('10.0.2.1', networks)
+
+    def test_ipv6(self):
+        networks = NetworkSet(['2001:db8::/32', '::1'])
+        self.assertIn('2001:db8:ffff::1', networks)
+        self.assertIn('::1', networks)
+        self.assertNotIn('2001:db9::1', networks)
+        # families never match each other
+        self.assertNotIn('0.0.0.1', networks)
+
+    def test_ipv4_mapped_addresses_are_unwrapped(self):
+        self.assertEqual(str(parse_ip('::ffff:203.0.113.9')), '203.0.113.9')
+        self.assertIn('::ffff:10.1.2.3', NetworkSet(['10.0.0.0/8']))
+
+    def test_invalid_entries_and_addresses(self):
+        networks = NetworkSet(['10.0.0.0/8', 'nonsense', '300.1.1.1', '', '# comment only'])
+        self.assertEqual(networks.invalid, ['nonsense', '300.1.1.1'])
+        self.assertEqual(len(networks), 1)
+        self.assertIsNone(parse_ip('not-an-ip'))
+        self.assertIsNone(parse_ip(None))
+        self.assertNotIn('not-an-ip', networks)
+
+
+class BlocklistReloadTests(SimpleTestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'blocklist.txt')
+        self.mtime = 1_000_000
+
+    def write(self, text):
+        with open(self.path, 'w') as f:
+            f.write(text)
+        # bump the mtime explicitly; writes within one tick can share it
+        self.mtime += 10
+        os.utime(self.path, (self.mtime, self.mtime))
+
+    def test_file_is_reloaded_when_it_changes(self):
+        self.write('198.51.100.0/24\n')
+        blocklist = Blocklist(['10.0.0.1'], path=self.path, reload_interval=0)
+        self.assertIn('198.51.100.7', blocklist)
+        self.assertIn('10.0.0.1', blocklist)
+        self.write('203.0.113.0/24\n')
+        self.assertNotIn('198.51.100.7', blocklist)
+        self.assertIn('203.0.113.7', blocklist)
+        self.assertIn('10.0.0.1', blocklist)
+
+    def test_reload_interval_limits_stat_calls(self):
+        self.write('198.51.100.0/24\n')
+        blocklist = Blocklist(path=self.path, reload_interval=3600)
+        self.write('203.0.113.0/24\n')
+        self.assertIn('198.51.100.7', blocklist)
+
+    def test_unreadable_file_keeps_the_last_good_set(self):
+        self.write('198.51.100.0/24\n')
+        blocklist = Blocklist(path=self.path, reload_interval=0)
+        self.write('203.0.113.0/24\n')
+        with mock.patch('builtins.open', side_effect=PermissionError('denied')), \
+                self.assertLogs('securecloud.blocklist', 'WARNING'):
+            self.assertIn('198.51.100.7', blocklist)
+        # retried once the file is readable again
+        self.assertIn('203.0.113.7', blocklist)
+
+    def test_deleted_file_leaves_static_entries(self):
+        self.write('198.51.100.0/24\n')
+        blocklist = Blocklist(['10.0.0.1'], path=self.path, reload_interval=0)
+        os.remove(self.path)
+        self.assertNotIn('198.51.100.7', blocklist)
+        self.assertIn('10.0.0.1', blocklist)
+
+
+@override_settings(
+    CACHES=LOCMEM, FIREWALL_CACHE='default', FIREWALL_RATE_LIMIT=0, FIREWALL_BLOCKLIST_FILE=None,
+    FIREWALL_BLOCKED_IPS=['198.51.100.0/24'], FIREWALL_TRUSTED_PROXIES=['10.0.0.0/8'],
+)
+class ClientIPTests(SimpleTestCase):
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.middleware = FirewallMiddleware(lambda request: None)
+
+    def client_ip(self, remote, forwarded=None):
+        headers = {'HTTP_X_FORWARDED_FOR': forwarded} if forwarded is not None else {}
+        return self.middleware.get_client_ip(self.factory.get('/', REMOTE_ADDR=remote, **headers))
+
+    def test_header_from_untrusted_peer_is_ignored(self):
+        self.assertEqual(self.client_ip('203.0.113.9', '198.51.100.7'), '203.0.113.9')
+
+    def test_walks_right_to_left_to_first_untrusted_hop(self):
+        # the client prepended a spoofed entry; our proxies appended the rest
+        self.assertEqual(self.client_ip('10.0.0.1', '1.2.3.4, 198.51.100.7, 10.0.0.2'), '198.51.100.7')
+
+    def test_all_hops_trusted(self):
+        self.assertEqual(self.client_ip('10.0.0.1', '10.0.0.3, 10.0.0.2'), '10.0.0.3')
+
+    def test_invalid_hop_stops_the_walk(self):
+        self.assertEqual(self.client_ip('10.0.0.1', '198.51.100.7, garbage'), '10.0.0.1')
+        self.assertEqual(self.client_ip('10.0.0.1', 'garbage, 198.51.100.7'), '198.51.100.7')
+
+    def test_ipv4_mapped_remote_addr(self):
+        self.assertEqual(self.client_ip('::ffff:203.0.113.9'), '203.0.113.9')
+        self.assertEqual(self.client_ip('::ffff:10.0.0.1', '198.51.100.7'), '198.51.100.7')
+
+    def test_blocked_client_behind_proxy(self):
+        request = self.factory.get('/', REMOTE_ADDR='10.0.0.1', HTTP_X_FORWARDED_FOR='198.51.100.7')
+        with self.assertLogs('securecloud.middleware', 'WARNING'):
+            self.assertEqual(self.middleware.process_request(request).status_code, 403)
+        # a blocked address in a header from an untrusted peer is just a string
+        request = self.factory.get('/', REMOTE_ADDR='203.0.113.9', HTTP_X_FORWARDED_FOR='198.51.100.7')
+        self.assertIsNone(self.middleware.process_request(request))
+
+
+class RequestInspectorTests(SimpleTestCase):
+    SAMPLES = {
+        'single_quote': "o'brien",
+        'sql_comment': 'admin--',
+        'hash_comment': 'a#b',
+        'xp_cmd': 'xp_cmdshell',
+        'semicolon': 'a;b',
+        'script_tag': '<SCRIPT src=x>',
+        'javascript_uri': 'JavaScript:alert(1)',
+        'union_select': '1 union  select 2',
+    }
+
+    def setUp(self):
+        self.inspector = RequestInspector(DEFAULT_RULES)
+
+    def test_every_default_rule_fires_in_path_and_query(self):
+        self.assertEqual(set(self.SAMPLES), {name for name, _ in DEFAULT_RULES})
+        for rule, sample in self.SAMPLES.items():
+            with self.subTest(rule):
+                self.assertEqual(self.inspector.inspect(f'/search/{sample}'), Detection(rule, 'path'))
+                self.assertEqual(self.inspector.inspect('/search/', f'q={sample}'), Detection(rule, 'query'))
+
+    def test_clean_requests_pass(self):
+        self.assertIsNone(self.inspector.inspect('/files/', 'page=2&q=holiday photos'))
+        self.assertIsNone(self.inspector.inspect('/'))
+
+    def test_first_match_names_the_rule(self):
+        self.assertEqual(self.inspector.inspect('/', "q=1' UNION SELECT 2"), Detection('single_quote', 'query'))
+        self.assertEqual(self.inspector.inspect("/o'brien/", 'q=a;b'), Detection('single_quote', 'path'))
+
+    def test_no_match_across_path_and_query(self):
+        # '-' ending the path and '-' starting the query are not a SQL comment
+        self.assertIsNone(self.inspector.inspect('/a-', '-b'))
+
+    @override_settings(FIREWALL_INSPECTION_RULES=[('traversal', r'\.\./'), ('ssi', r'<!--#')])
+    def test_configured_rules_replace_the_defaults(self):
+        inspector = RequestInspector(get_rules())
+        self.assertEqual(inspector.inspect('/files/../etc/passwd'), Detection('traversal', 'path'))
+        self.assertEqual(inspector.inspect('/', 'x=<!--#exec'), Detection('ssi', 'query'))
+        self.assertIsNone(inspector.inspect("/o'brien/", 'a;b'))
+
+    @override_settings(
+        CACHES=LOCMEM, FIREWALL_CACHE='default', FIREWALL_RATE_LIMIT=0, FIREWALL_BLOCKED_IPS=[],
+        FIREWALL_BLOCKLIST_FILE=None, FIREWALL_INSPECTION_RULES=[('traversal', r'\.\./')],
+    )
+    def test_middleware_uses_configured_rules(self):
+        middleware = FirewallMiddleware(lambda request: None)
+        factory = RequestFactory()
+        with self.assertLogs('securecloud.middleware', 'WARNING') as logs:
+            response = middleware.process_request(factory.get('/x/%2e%2e/y'))
+        self.assertEqual(response.status_code, 403)
+        self.assertIn('traversal', logs.output[0])
+        self.assertIsNone(middleware.process_request(factory.get('/x/', {'q': "o'brien"})))
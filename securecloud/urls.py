@@ -19,7 +19,7 @@ from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
-from storage.api import StoredFileList, StoredFileUpload
+from storage.api import StoredFileList, StoredFileUpload, StoredFileBulkUpload, StoredFileCapacity, StoredFileStatus
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -29,6 +29,9 @@ urlpatterns = [
     path('api/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
     path('api/storage/', StoredFileList.as_view(), name='api_storage_list'),
     path('api/storage/upload/', StoredFileUpload.as_view(), name='api_storage_upload'),
+    path('api/storage/bulk-upload/', StoredFileBulkUpload.as_view(), name='api_storage_bulk_upload'),
+    path('api/storage/capacity/', StoredFileCapacity.as_view(), name='api_storage_capacity'),
+    path('api/storage/<int:pk>/status/', StoredFileStatus.as_view(), name='api_storage_status'),
 ]
 
 if settings.DEBUG:
@@ -3,41 +3,109 @@ from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from rest_framework import status
 from .models import StoredFile
-from .serializers import StoredFileSerializer
-from .utils import aes_encrypt, hide_data_in_image
-from django.core.files.base import ContentFile
-import io
+from .capacity import CoverTooSmall, check_capacity, max_plaintext_size, max_shards, total_capacity
+from .serializers import CoverCapacitySerializer, StoredFileSerializer, StoredFileUploadSerializer
+from .pagination import StoredFileCursorPagination
+from .pipeline import bulk_upload, create_stored_file, enqueue_upload, use_upload_jobs
+from .utils import embed_capacity, encrypted_length
+from django.conf import settings
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
 
 class StoredFileList(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
-        qs = StoredFile.objects.filter(user=request.user).order_by('-created_at')
-        return Response(StoredFileSerializer(qs, many=True).data)
+        qs = StoredFile.objects.filter(user=request.user).only(*StoredFileSerializer.Meta.fields)
+        paginator = StoredFileCursorPagination()
+        page = paginator.paginate_queryset(qs, request, view=self)
+        return paginator.get_paginated_response(StoredFileSerializer(page, many=True).data)
 
 class StoredFileUpload(APIView):
     permission_classes = [IsAuthenticated]
 
     def post(self, request):
-        up_file = request.FILES.get('file')
-        cover = request.FILES.get('cover_image')
-        if not up_file or not cover:
-            return Response({'detail': 'file and cover_image are required'}, status=status.HTTP_400_BAD_REQUEST)
-        data = up_file.read()
-        ct, nonce = aes_encrypt(request.user.id, data)
-        cover.seek(0)
-        buf = io.BytesIO(cover.read())
-        stego_img = hide_data_in_image(buf, ct)
-        output = io.BytesIO()
-        stego_img.save(output, format='PNG')
-        output.seek(0)
-        stego_content = ContentFile(output.read(), name=f"{up_file.name}.png")
-        obj = StoredFile.objects.create(
-            user=request.user,
-            original_name=up_file.name,
-            cover_image=cover,
-            stego_image=stego_content,
-            nonce=nonce,
-            data_length=len(ct),
-        )
+        jobs = use_upload_jobs()
+        # queued uploads keep only the first cover
+        serializer = StoredFileUploadSerializer(data=request.data, context={'single_cover': jobs})
+        serializer.is_valid(raise_exception=True)
+        up_file = serializer.validated_data['file']
+        covers = serializer.validated_data['cover_image']
+        if jobs:
+            obj = enqueue_upload(request.user, up_file, covers[0])
+            return Response({
+                'id': obj.id,
+                'original_name': obj.original_name,
+                'status': obj.status,
+                'status_url': reverse('api_storage_status', args=[obj.id]),
+            }, status=status.HTTP_202_ACCEPTED)
+        # extra cover_image entries hold shards of payloads too big for one cover
+        obj = create_stored_file(request.user, up_file, covers)
         return Response({'id': obj.id, 'original_name': obj.original_name}, status=status.HTTP_201_CREATED)
+
+class StoredFileBulkUpload(APIView):
+    """Upload several files in one request.
+
+    Send repeated `files` fields with either one `cover_images` entry per
+    file or a single cover shared by all of them.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        files = request.FILES.getlist('files')
+        covers = request.FILES.getlist('cover_images')
+        if not files or not covers:
+            return Response({'detail': 'files and cover_images are required'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(covers) not in (1, len(files)):
+            return Response({'detail': 'send one cover_images entry per file, or a single shared one'}, status=status.HTTP_400_BAD_REQUEST)
+        max_files = getattr(settings, 'STORAGE_BULK_UPLOAD_MAX_FILES', 50)
+        if len(files) > max_files:
+            return Response({'detail': f'at most {max_files} files per request'}, status=status.HTTP_400_BAD_REQUEST)
+        results = bulk_upload(request.user, files, covers)
+        for result in results:
+            if 'id' in result and result['status'] == StoredFile.STATUS_PROCESSING:
+                result['status_url'] = reverse('api_storage_status', args=[result['id']])
+        if any('error' in result for result in results):
+            code = status.HTTP_207_MULTI_STATUS
+        elif use_upload_jobs():
+            code = status.HTTP_202_ACCEPTED
+        else:
+            code = status.HTTP_201_CREATED
+        return Response({'results': results}, status=code)
+
+class StoredFileCapacity(APIView):
+    """How much a candidate cover (or covers, used in turn for shards) can
+    hold. Pass `size` to check a specific upload before sending it."""
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        serializer = CoverCapacitySerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        covers = serializer.validated_data['cover_image']
+        capacities = [embed_capacity(width, height) for _, (width, height) in covers]
+        capacity = total_capacity(capacities)
+        data = {
+            'covers': [
+                {'name': cover.name, 'width': width, 'height': height, 'capacity': cap}
+                for (cover, (width, height)), cap in zip(covers, capacities)
+            ],
+            'max_shards': max_shards(),
+            'capacity': capacity,
+            'max_file_size': max_plaintext_size(capacity),
+        }
+        size = serializer.validated_data.get('size')
+        if size is not None:
+            data['needed'] = encrypted_length(size)
+            try:
+                data['shards'] = len(check_capacity(size, capacities))
+                data['fits'] = True
+            except CoverTooSmall:
+                data['fits'] = False
+        return Response(data)
+
+class StoredFileStatus(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, pk):
+        obj = get_object_or_404(StoredFile, pk=pk, user=request.user)
+        return Response({'id': obj.id, 'original_name': obj.original_name, 'status': obj.status})
@@ -0,0 +1,100 @@
+import io
+import os
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.utils import timezone
+
+from .ciphercache import cached_ciphertext
+from .shards import iter_shard_ciphertext
+from .utils import extract_data_from_image, get_chunk_size, open_decrypt_stream
+
+
+class _ZipBuffer(io.RawIOBase):
+    """Write-only, unseekable sink; zipfile falls back to data descriptors."""
+
+    def __init__(self):
+        self._pieces = []
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._pieces.append(bytes(b))
+        return len(b)
+
+    def drain(self) -> bytes:
+        data = b''.join(self._pieces)
+        self._pieces.clear()
+        return data
+
+
+def load_ciphertext(obj) -> bytes:
+    ct = cached_ciphertext(obj)
+    if ct is not None:
+        return ct
+    if obj.shard_count:
+        return b''.join(iter_shard_ciphertext(obj))
+    obj.stego_image.open('rb')
+    try:
+        return extract_data_from_image(obj.stego_image, obj.data_length)
+    finally:
+        obj.stego_image.close()
+
+
+def member_names(objs) -> list[str]:
+    """Archive names for objs, suffixing duplicates like 'report (2).pdf'."""
+    seen = {}
+    names = []
+    for obj in objs:
+        name = os.path.basename(obj.original_name) or f'file-{obj.pk}'
+        base, ext = os.path.splitext(name)
+        count = seen.get(name.lower(), 0)
+        while count:
+            candidate = f'{base} ({count + 1}){ext}'
+            if candidate.lower() not in seen:
+                name = candidate
+                break
+            count += 1
+        seen[name.lower()] = seen.get(name.lower(), 0) + 1
+        names.append(name)
+    return names
+
+
+def stream_zip(user_id: int, objs, prefetch: int | None = None):
+    """Yield a ZIP archive of the decrypted StoredFiles in objs.
+
+    Members are stored uncompressed (most uploads are already compressed)
+    and written as they are decrypted. Ciphertext for the next `prefetch`
+    members is extracted on a thread pool while the current one streams,
+    so memory holds at most prefetch + 1 ciphertexts at a time.
+    """
+    objs = list(objs)
+    prefetch = prefetch or getattr(settings, 'STORAGE_ZIP_PREFETCH', 2)
+    names = member_names(objs)
+    piece = get_chunk_size()
+    sink = _ZipBuffer()
+    pool = ThreadPoolExecutor(max_workers=prefetch)
+    try:
+        pending = [pool.submit(load_ciphertext, obj) for obj in objs[:prefetch]]
+        with zipfile.ZipFile(sink, 'w', zipfile.ZIP_STORED) as archive:
+            for index, (obj, name) in enumerate(zip(objs, names)):
+                ct = pending.pop(0).result()
+                if index + prefetch < len(objs):
+                    pending.append(pool.submit(load_ciphertext, objs[index + prefetch]))
+                ct_pieces = (ct[offset:offset + piece] for offset in range(0, len(ct), piece))
+                length, chunks = open_decrypt_stream(user_id, bytes(obj.nonce), ct_pieces, len(ct), obj.cipher_version)
+                info = zipfile.ZipInfo(name, date_time=timezone.localtime(obj.created_at).timetuple()[:6])
+                info.file_size = length
+                with archive.open(info, 'w') as member:
+                    for chunk in chunks:
+                        member.write(chunk)
+                        data = sink.drain()
+                        if data:
+                            yield data
+                # data descriptor after each member, central directory at the end
+                yield sink.drain()
+        yield sink.drain()
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
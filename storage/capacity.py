@@ -0,0 +1,84 @@
+import io
+import os
+
+from django.conf import settings
+from django.template.defaultfilters import filesizeformat
+from PIL import Image
+
+from .shards import shard_plan
+from .utils import embed_capacity, encrypted_length
+
+# Capacity checks that run before any encryption or embedding. Only the
+# image header is parsed (Pillow opens lazily), so a cover that is too
+# small is rejected without decoding its pixels or reading the upload.
+
+
+class CoverTooSmall(ValueError):
+    """The covers cannot hold the encrypted upload, even split into
+    STORAGE_MAX_SHARDS images."""
+
+    def __init__(self, needed: int, available: int):
+        self.needed = needed
+        self.available = available
+        super().__init__(f'Data too large for cover image ({needed} bytes needed, {available} available)')
+
+    def user_message(self, name: str) -> str:
+        return (
+            f'"{name}" needs {filesizeformat(self.needed)} of cover capacity but the cover image '
+            f'holds {filesizeformat(self.available)}. Use a larger cover image or a smaller file.'
+        )
+
+
+def cover_dimensions(cover) -> tuple[int, int]:
+    """(width, height) of a cover given as bytes, a path or a file.
+
+    Files are rewound afterwards. Raises OSError if it is not an image.
+    """
+    if isinstance(cover, (bytes, bytearray)):
+        cover = io.BytesIO(cover)
+    if isinstance(cover, (str, os.PathLike)):
+        with Image.open(cover) as img:
+            return img.size
+    cover.seek(0)
+    try:
+        with Image.open(cover) as img:
+            return img.size
+    finally:
+        cover.seek(0)
+
+
+def cover_capacity(cover) -> int:
+    """Payload bytes one stego image made from this cover can carry."""
+    return embed_capacity(*cover_dimensions(cover))
+
+
+def max_shards() -> int:
+    return getattr(settings, 'STORAGE_MAX_SHARDS', 16)
+
+
+def total_capacity(capacities: list[int]) -> int:
+    """Ciphertext bytes the covers can carry, used in turn for up to STORAGE_MAX_SHARDS shards."""
+    return sum(capacities[i % len(capacities)] for i in range(max_shards()))
+
+
+def max_plaintext_size(capacity: int) -> int:
+    """Largest upload whose ciphertext fits in `capacity` bytes."""
+    low, high = 0, capacity
+    if encrypted_length(0) > capacity:
+        return 0
+    while low < high:
+        mid = (low + high + 1) // 2
+        if encrypted_length(mid) <= capacity:
+            low = mid
+        else:
+            high = mid - 1
+    return low
+
+
+def check_capacity(size: int, capacities: list[int]) -> list[int]:
+    """Return the shard lengths for a `size` byte upload, or raise CoverTooSmall."""
+    needed = encrypted_length(size)
+    try:
+        return shard_plan(needed, capacities)
+    except ValueError:
+        raise CoverTooSmall(needed, total_capacity(capacities)) from None
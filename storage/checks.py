@@ -0,0 +1,12 @@
+from django.conf import settings
+from django.core.checks import Tags, register
+
+from securecloud.caches import shared_cache_errors
+
+
+@register(Tags.caches)
+def check_dashboard_cache(app_configs, **kwargs):
+    if getattr(settings, 'STORAGE_DASHBOARD_CACHE', 'default') is None:
+        return []
+    # signal handlers invalidate summaries only in the cache they can reach
+    return shared_cache_errors('STORAGE_DASHBOARD_CACHE', 'storage.E001', 'Dashboard summaries')
@@ -0,0 +1,148 @@
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from .shards import iter_shard_ciphertext
+from .utils import extract_data_from_image
+
+
+class MemoryBackend:
+    """Per-process LRU of ciphertext bytes bounded by a byte budget."""
+
+    def __init__(self, max_bytes, **options):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= len(old)
+            self._entries[key] = value
+            self._size += len(value)
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    def delete(self, key):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= len(old)
+
+
+class DiskBackend:
+    """Ciphertext files under MEDIA_ROOT shared by all workers on a host.
+
+    Recency is tracked through file mtimes, which are bumped on every hit.
+    """
+
+    def __init__(self, max_bytes, location=None, **options):
+        self.max_bytes = max_bytes
+        self.location = Path(location or Path(settings.MEDIA_ROOT) / 'ciphercache')
+
+    def _path(self, key):
+        return self.location / hashlib.sha256(key.encode()).hexdigest()
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            data = path.read_bytes()
+        except FileNotFoundError:
+            return None
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return data
+
+    def set(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+        self.location.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.location, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(value)
+        os.replace(tmp, self._path(key))
+        self._evict()
+
+    def delete(self, key):
+        try:
+            self._path(key).unlink()
+        except FileNotFoundError:
+            pass
+
+    def _evict(self):
+        entries = []
+        for path in self.location.iterdir():
+            if path.suffix == '.tmp':
+                continue
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+_backend = None
+_backend_config = None
+
+
+def get_ciphertext_cache():
+    """Return the configured backend, or None when the cache is disabled."""
+    global _backend, _backend_config
+    config = getattr(settings, 'STORAGE_CIPHERTEXT_CACHE', None)
+    if not config:
+        return None
+    if config is not _backend_config:
+        options = {k.lower(): v for k, v in config.items() if k != 'BACKEND'}
+        _backend = import_string(config['BACKEND'])(**options)
+        _backend_config = config
+    return _backend
+
+
+def cached_ciphertext(obj):
+    """Return the ciphertext of a StoredFile from the cache, extracting it from
+    the stego image on a miss. Returns None when the cache is disabled."""
+    cache = get_ciphertext_cache()
+    if cache is None:
+        return None
+    key = f'{obj.pk}:{obj.fingerprint}'
+    ct = cache.get(key)
+    if ct is None:
+        if obj.shard_count:
+            ct = b''.join(iter_shard_ciphertext(obj))
+        else:
+            obj.stego_image.open('rb')
+            try:
+                ct = extract_data_from_image(obj.stego_image, obj.data_length)
+            finally:
+                obj.stego_image.close()
+        cache.set(key, ct)
+    return ct
@@ -0,0 +1,83 @@
+import io
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+from PIL import Image
+
+# Containers a stego image may be stored in. Both are lossless, so the LSBs
+# survive; readers sniff the format, so changing the codec never affects
+# files that are already stored.
+STEGO_FORMATS = ('PNG', 'WEBP')
+
+# zlib strategies accepted by Pillow's PNG encoder as compress_type
+PNG_STRATEGIES = {'default': -1, 'filtered': 1, 'huffman': 2, 'rle': 3, 'fixed': 4}
+
+WEBP_MAX_SIZE = 16383
+
+
+class PNGCodec:
+    """PNG output. compress_level trades deflate CPU for size (Pillow's
+    default is 6); strategy picks the zlib strategy, and optimize adds an
+    extra, slow search for the smallest encoding."""
+    extension = '.png'
+
+    def __init__(self, compress_level=6, strategy='default', optimize=False):
+        if strategy not in PNG_STRATEGIES:
+            raise ValueError(f"Unknown PNG strategy {strategy!r}")
+        self.compress_level = compress_level
+        self.strategy = strategy
+        self.optimize = optimize
+
+    def encode(self, img: Image.Image) -> tuple[bytes, str]:
+        """Return the encoded image and its file extension."""
+        output = io.BytesIO()
+        img.save(
+            output, format='PNG',
+            compress_level=self.compress_level,
+            compress_type=PNG_STRATEGIES[self.strategy],
+            optimize=self.optimize,
+        )
+        return output.getvalue(), self.extension
+
+
+class WebPCodec:
+    """Lossless WebP output. In lossless mode quality is the compression
+    effort (0 fastest, 100 smallest) and method the encoder speed (0-6).
+    Covers too large for WebP are written as PNG with the `fallback`
+    PNGCodec options."""
+    extension = '.webp'
+
+    def __init__(self, quality=25, method=0, fallback=None):
+        self.quality = quality
+        self.method = method
+        fallback = fallback or {'COMPRESS_LEVEL': 1}
+        self.fallback = PNGCodec(**{k.lower(): v for k, v in fallback.items()})
+
+    def encode(self, img: Image.Image) -> tuple[bytes, str]:
+        if max(img.size) > WEBP_MAX_SIZE:
+            # WebP can't hold covers this large; readers detect the PNG
+            return self.fallback.encode(img)
+        output = io.BytesIO()
+        img.save(output, format='WEBP', lossless=True, exact=True, quality=self.quality, method=self.method)
+        return output.getvalue(), self.extension
+
+
+def open_stego_image(fp) -> Image.Image:
+    """Open a stored stego image, whichever container it was written in."""
+    return Image.open(fp, formats=STEGO_FORMATS)
+
+
+_codec = None
+_codec_config = None
+
+
+def get_stego_codec():
+    """Return the codec from STORAGE_STEGO_CODEC (PNG with Pillow's defaults
+    when unset)."""
+    global _codec, _codec_config
+    config = getattr(settings, 'STORAGE_STEGO_CODEC', None) or {'BACKEND': 'storage.codecs.PNGCodec'}
+    if config is not _codec_config:
+        options = {k.lower(): v for k, v in config.items() if k != 'BACKEND'}
+        _codec = import_string(config['BACKEND'])(**options)
+        _codec_config = config
+    return _codec
@@ -0,0 +1,126 @@
+import hashlib
+import io
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from django.conf import settings
+from PIL import Image
+
+from .utils import load_cover_pixels
+
+
+class PixelCache:
+    """Process-local LRU of decoded cover pixel arrays, bounded in bytes.
+
+    Covers are content-addressed, so the SHA-256 is a safe key: popular
+    covers skip the JPEG/PNG decode on every upload. Cached arrays are
+    read-only; hide_data_in_image works on a copy. Concurrent misses on
+    one key wait for a single load instead of each decoding the cover.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._loading = {}
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def _lookup(self, key):
+        pixels = self._entries.get(key)
+        if pixels is not None:
+            self._entries.move_to_end(key)
+        return pixels
+
+    def get(self, key, loader):
+        with self._lock:
+            pixels = self._lookup(key)
+            if pixels is not None:
+                return pixels
+            key_lock = self._loading.setdefault(key, threading.Lock())
+        with key_lock:
+            with self._lock:
+                pixels = self._lookup(key)
+            if pixels is not None:
+                return pixels
+            try:
+                pixels = loader()
+                pixels.flags.writeable = False
+                if pixels.nbytes <= self.max_bytes:
+                    with self._lock:
+                        self._entries[key] = pixels
+                        self._size += pixels.nbytes
+                        while self._size > self.max_bytes:
+                            _, evicted = self._entries.popitem(last=False)
+                            self._size -= evicted.nbytes
+            finally:
+                with self._lock:
+                    self._loading.pop(key, None)
+        return pixels
+
+
+pixel_cache = PixelCache(max_bytes=getattr(settings, 'STORAGE_COVER_PIXEL_CACHE_BYTES', 64 * 1024 * 1024))
+
+
+def read_cover(cover) -> bytes:
+    """Cover bytes from raw bytes, a path, or a file (rewound afterwards)."""
+    if isinstance(cover, (bytes, bytearray)):
+        return bytes(cover)
+    if isinstance(cover, (str, os.PathLike)):
+        with open(cover, 'rb') as f:
+            return f.read()
+    cover.seek(0)
+    data = cover.read()
+    cover.seek(0)
+    return data
+
+
+@dataclass(frozen=True)
+class CoverSource:
+    """A cover to embed into: its SHA-256, its encoded bytes when they are
+    already in memory, and the CoverImage it is stored as, if any.
+
+    Pixels are decoded through the process's pixel_cache, so a source sent
+    to a shard worker carries the encoded image rather than its pixels.
+    """
+    key: str
+    data: bytes | None = None
+    image: object = None
+
+    def size(self) -> tuple[int, int]:
+        if self.image is not None:
+            return self.image.width, self.image.height
+        with Image.open(io.BytesIO(self.data)) as img:
+            return img.size
+
+    def read(self) -> bytes:
+        if self.data is not None:
+            return self.data
+        # a handle of our own: the CoverImage may be shared between threads
+        with self.image.image.storage.open(self.image.image.name, 'rb') as f:
+            return f.read()
+
+    def pixels(self):
+        """Decoded RGB pixels, cached by content hash."""
+        return pixel_cache.get(self.key, lambda: load_cover_pixels(io.BytesIO(self.read())))
+
+    def portable(self) -> 'CoverSource':
+        """The same cover without its CoverImage, ready to pickle."""
+        return CoverSource(self.key, self.read())
+
+
+def cover_source(cover, data: bytes | None = None) -> CoverSource:
+    """Wrap a CoverImage, raw bytes, a path or a file as a CoverSource.
+
+    Pass a CoverImage's bytes when they are already in memory (a fresh
+    upload) so a cache miss decodes them instead of reading back the
+    stored copy.
+    """
+    if isinstance(cover, CoverSource):
+        return cover
+    if hasattr(cover, 'sha256'):
+        # a CoverImage; this module can't import models, it runs in shard workers
+        return CoverSource(cover.sha256, data, cover)
+    data = read_cover(cover)
+    return CoverSource(hashlib.sha256(data).hexdigest(), data)
@@ -1,5 +1,19 @@
 from django import forms
 
+from .capacity import CoverTooSmall, check_capacity, cover_capacity
+
 class UploadForm(forms.Form):
     file = forms.FileField()
     cover_image = forms.ImageField()
+
+    def clean(self):
+        cleaned_data = super().clean()
+        up_file = cleaned_data.get('file')
+        cover = cleaned_data.get('cover_image')
+        if up_file and cover:
+            # reject before the upload is encrypted or the cover decoded
+            try:
+                check_capacity(up_file.size, [cover_capacity(cover)])
+            except CoverTooSmall as e:
+                self.add_error('file', forms.ValidationError(e.user_message(up_file.name), code='cover_too_small'))
+        return cleaned_data
@@ -0,0 +1,84 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+
+class KeyCache:
+    """Process-local LRU cache of per-user AESGCM objects with a TTL.
+
+    Entries are keyed by (user_id, key_version) where the key version is a
+    fingerprint of SECRET_KEY, so a rotated secret never returns stale keys.
+    """
+
+    def __init__(self, maxsize=1024, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._secret = None
+        self._version = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def key_version(self) -> str:
+        secret = settings.SECRET_KEY
+        if secret is not self._secret:
+            self._version = hashlib.sha256(secret.encode()).hexdigest()[:16]
+            self._secret = secret
+        return self._version
+
+    def get(self, user_id, factory):
+        cache_key = (user_id, self.key_version())
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(cache_key)
+            if entry is not None and entry[1] > now:
+                self._entries.move_to_end(cache_key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+        value = factory(user_id)
+        with self._lock:
+            self._entries[cache_key] = (value, now + self.ttl)
+            self._entries.move_to_end(cache_key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return value
+
+    def invalidate(self, user_id=None):
+        with self._lock:
+            if user_id is None:
+                self._entries.clear()
+                self._secret = None
+                return
+            for cache_key in [k for k in self._entries if k[0] == user_id]:
+                del self._entries[cache_key]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+            }
+
+
+key_cache = KeyCache(
+    maxsize=getattr(settings, 'STORAGE_KEY_CACHE_SIZE', 1024),
+    ttl=getattr(settings, 'STORAGE_KEY_CACHE_TTL', 300),
+)
+
+
+@receiver(setting_changed)
+def _invalidate_on_secret_change(sender, setting, **kwargs):
+    if setting == 'SECRET_KEY':
+        key_cache.invalidate()
@@ -0,0 +1,22 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from storage.models import FileTypeCount
+
+
+class Command(BaseCommand):
+    help = 'Recount FileTypeCount rows from StoredFile, repairing counters that drifted.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', action='append', dest='users', metavar='USERNAME',
+                            help='Only rebuild this user (repeatable); all users by default.')
+
+    def handle(self, *args, **options):
+        users = User.objects.all()
+        if options['users']:
+            users = users.filter(username__in=options['users'])
+        rebuilt = 0
+        for user_id in users.values_list('pk', flat=True).iterator():
+            FileTypeCount.rebuild(user_id)
+            rebuilt += 1
+        self.stdout.write(f'Rebuilt file type counts for {rebuilt} users')
@@ -0,0 +1,78 @@
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from storage.pipeline import claim_jobs, requeue_jobs, run_upload_job
+
+
+def _init_worker():
+    # forked children must not reuse the parent's database connections
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'securecloud.settings')
+    django.setup()
+    connections.close_all()
+
+
+class Command(BaseCommand):
+    help = 'Process queued stego upload jobs on a pool of worker processes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+        parser.add_argument('--poll-interval', type=float, default=1.0)
+        parser.add_argument('--once', action='store_true', help='Exit when the queue is empty.')
+
+    def handle(self, *args, **options):
+        workers = max(1, options['workers'])
+        poll = options['poll_interval']
+        self.stdout.write(f'Upload worker started with {workers} processes')
+        running = {}
+        connections.close_all()
+        pool = self.start_pool(workers)
+        try:
+            while True:
+                free = workers - len(running)
+                if free > 0:
+                    claimed = claim_jobs(free)
+                    try:
+                        for job_id in claimed:
+                            running[pool.submit(run_upload_job, job_id)] = job_id
+                    except BrokenProcessPool:
+                        pool = self.restart_pool(pool, workers, [*running.values(), *claimed])
+                        running.clear()
+                        continue
+                if not running:
+                    if options['once']:
+                        break
+                    time.sleep(poll)
+                    continue
+                done, _ = wait(running, timeout=poll, return_when=FIRST_COMPLETED)
+                lost = []
+                for future in done:
+                    job_id = running.pop(future)
+                    try:
+                        self.stdout.write(f'Job {job_id}: {future.result()}')
+                    except BrokenProcessPool:
+                        lost.append(job_id)
+                    except Exception as e:
+                        self.stderr.write(f'Job {job_id} crashed: {e}')
+                if lost:
+                    pool = self.restart_pool(pool, workers, [*lost, *running.values()])
+                    running.clear()
+        finally:
+            pool.shutdown(cancel_futures=True)
+
+    def start_pool(self, workers):
+        return ProcessPoolExecutor(max_workers=workers, initializer=_init_worker)
+
+    def restart_pool(self, pool, workers, job_ids):
+        # a worker process died (OOM kill, segfault), which breaks the whole
+        # pool and every job still on it
+        self.stderr.write(f'Worker process died; requeueing jobs {sorted(set(job_ids))} and restarting the pool')
+        pool.shutdown(wait=False, cancel_futures=True)
+        requeue_jobs(job_ids, 'Worker process died')
+        connections.close_all()
+        return self.start_pool(workers)
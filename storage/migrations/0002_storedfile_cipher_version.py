@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-18 15:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('storage', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='storedfile',
+            name='cipher_version',
+            field=models.PositiveSmallIntegerField(default=1),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 6.0 on 2026-10-18 16:20
+
+import django.db.models.deletion
+import storage.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('storage', '0002_storedfile_cipher_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='storedfile',
+            name='status',
+            field=models.CharField(choices=[('processing', 'Processing'), ('ready', 'Ready'), ('failed', 'Failed')], default='ready', max_length=16),
+        ),
+        migrations.AlterField(
+            model_name='storedfile',
+            name='stego_image',
+            field=models.ImageField(blank=True, upload_to='stego/'),
+        ),
+        migrations.CreateModel(
+            name='UploadJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('staged_file', models.FileField(blank=True, storage=storage.models.get_staging_storage, upload_to='uploads/')),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], db_index=True, default='queued', max_length=16)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('stored_file', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='upload_job', to='storage.storedfile')),
+            ],
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 6.0 on 2026-10-18 18:10
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('storage', '0003_upload_jobs'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='storedfile',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='storedfile_user_created_idx'),
+        ),
+    ]
@@ -0,0 +1,73 @@
+# Generated by Django 6.0 on 2026-10-18 18:40
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+# frozen copy of storage.models.classify_file_type at the time of this migration
+FILE_TYPE_MARKERS = [
+    ("PDF", (".pdf",)),
+    ("ZIP", (".zip",)),
+    ("PPTX", (".pptx",)),
+    ("DOCX", (".docx",)),
+    ("XLSX", (".xlsx",)),
+    ("TXT", (".txt",)),
+    ("PNG", (".png",)),
+    ("JPG", (".jpg", ".jpeg")),
+]
+
+
+def classify_file_type(name):
+    name = (name or "").lower()
+    for label, markers in FILE_TYPE_MARKERS:
+        if any(marker in name for marker in markers):
+            return label
+    return "Other"
+
+
+def backfill_file_types(apps, schema_editor):
+    StoredFile = apps.get_model('storage', 'StoredFile')
+    FileTypeCount = apps.get_model('storage', 'FileTypeCount')
+    pending = []
+    for obj in StoredFile.objects.only('id', 'original_name').iterator():
+        obj.file_type = classify_file_type(obj.original_name)
+        pending.append(obj)
+        if len(pending) >= 1000:
+            StoredFile.objects.bulk_update(pending, ['file_type'])
+            pending = []
+    if pending:
+        StoredFile.objects.bulk_update(pending, ['file_type'])
+    rows = StoredFile.objects.values('user_id', 'file_type').annotate(n=Count('id'))
+    FileTypeCount.objects.bulk_create(
+        FileTypeCount(user_id=row['user_id'], file_type=row['file_type'], count=row['n']) for row in rows
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('storage', '0004_storedfile_user_created_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='storedfile',
+            name='file_type',
+            field=models.CharField(default='Other', max_length=8),
+        ),
+        migrations.CreateModel(
+            name='FileTypeCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('file_type', models.CharField(max_length=8)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='file_type_counts', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('user', 'file_type'), name='filetypecount_user_type_uniq')],
+            },
+        ),
+        migrations.RunPython(backfill_file_types, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 6.0 on 2026-10-18 19:55
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('storage', '0005_storedfile_file_type'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='storedfile',
+            name='shard_count',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='StoredFileShard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.PositiveSmallIntegerField()),
+                ('stego_image', models.ImageField(upload_to='stego/')),
+                ('length', models.IntegerField()),
+                ('stored_file', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shards', to='storage.storedfile')),
+            ],
+            options={
+                'ordering': ['index'],
+                'constraints': [models.UniqueConstraint(fields=('stored_file', 'index'), name='storedfileshard_file_index_uniq')],
+            },
+        ),
+    ]
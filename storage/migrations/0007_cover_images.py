@@ -0,0 +1,92 @@
+# Generated by Django 6.0 on 2026-10-18 21:05
+
+import hashlib
+
+import django.db.models.deletion
+from django.db import migrations, models, transaction
+from PIL import Image
+
+
+def dedupe_covers(apps, schema_editor):
+    """Point every StoredFile at one CoverImage per distinct cover content
+    and delete the now unreferenced duplicate files once the migration has
+    committed (a rollback leaves every file in place)."""
+    StoredFile = apps.get_model('storage', 'StoredFile')
+    CoverImage = apps.get_model('storage', 'CoverImage')
+    storage = StoredFile._meta.get_field('cover_image').storage
+    by_name = {}
+    for pk, name in StoredFile.objects.exclude(cover_image='').values_list('pk', 'cover_image').iterator():
+        by_name.setdefault(name, []).append(pk)
+    by_digest = {}
+    duplicates = []
+    for name in by_name:
+        try:
+            with storage.open(name, 'rb') as f:
+                digest = hashlib.sha256()
+                for chunk in f.chunks():
+                    digest.update(chunk)
+        except (FileNotFoundError, OSError):
+            # the row keeps no cover; uploads that already finished don't need it
+            continue
+        by_digest.setdefault(digest.hexdigest(), []).append(name)
+    for digest, names in by_digest.items():
+        keep = names[0]
+        try:
+            with storage.open(keep, 'rb') as f, Image.open(f) as img:
+                width, height = img.size
+        except OSError:
+            width = height = 0
+        pks = [pk for name in names for pk in by_name[name]]
+        cover = CoverImage.objects.create(sha256=digest, image=keep, width=width, height=height, ref_count=len(pks))
+        StoredFile.objects.filter(pk__in=pks).update(cover=cover)
+        duplicates.extend(names[1:])
+
+    def delete_duplicates():
+        for name in duplicates:
+            storage.delete(name)
+
+    transaction.on_commit(delete_duplicates, using=schema_editor.connection.alias)
+
+
+def restore_cover_names(apps, schema_editor):
+    StoredFile = apps.get_model('storage', 'StoredFile')
+    for obj in StoredFile.objects.exclude(cover=None).select_related('cover').iterator():
+        StoredFile.objects.filter(pk=obj.pk).update(cover_image=obj.cover.image.name)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('storage', '0006_storedfile_shards'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CoverImage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sha256', models.CharField(max_length=64, unique=True)),
+                ('image', models.ImageField(upload_to='covers/')),
+                ('width', models.PositiveIntegerField()),
+                ('height', models.PositiveIntegerField()),
+                ('ref_count', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='storedfile',
+            name='cover',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='stored_files', to='storage.coverimage'),
+        ),
+        migrations.RunPython(dedupe_covers, restore_cover_names),
+        # lets a reverse migration re-add the column before names are restored
+        migrations.AlterField(
+            model_name='storedfile',
+            name='cover_image',
+            field=models.ImageField(blank=True, default='', upload_to='covers/'),
+        ),
+        migrations.RemoveField(
+            model_name='storedfile',
+            name='cover_image',
+        ),
+    ]
@@ -1,16 +1,238 @@
-from django.db import models
+import hashlib
+import io
+import os
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.db import IntegrityError, models, transaction
+from django.db.models import Count, F, ProtectedError
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.contrib.auth.models import User
+from PIL import Image
+
+# chart order on the profile page; the first matching extension wins
+FILE_TYPE_LABELS = ["PDF", "ZIP", "PPTX", "DOCX", "XLSX", "TXT", "PNG", "JPG", "Other"]
+FILE_TYPE_MARKERS = [
+    ("PDF", (".pdf",)),
+    ("ZIP", (".zip",)),
+    ("PPTX", (".pptx",)),
+    ("DOCX", (".docx",)),
+    ("XLSX", (".xlsx",)),
+    ("TXT", (".txt",)),
+    ("PNG", (".png",)),
+    ("JPG", (".jpg", ".jpeg")),
+]
+
+def classify_file_type(name: str) -> str:
+    name = (name or "").lower()
+    for label, markers in FILE_TYPE_MARKERS:
+        if any(marker in name for marker in markers):
+            return label
+    return "Other"
+
+def get_staging_storage():
+    # plaintext uploads waiting for a worker never leave the local disk
+    return FileSystemStorage(location=getattr(settings, 'STORAGE_STAGING_ROOT', settings.BASE_DIR / 'staging'))
+
+class CoverImage(models.Model):
+    """A cover picture stored once per distinct content (SHA-256).
+
+    ref_count is the number of StoredFiles using it; acquire() and
+    release() change it with conditional UPDATEs, and the row and file
+    are removed when the last reference goes away.
+    """
+    sha256 = models.CharField(max_length=64, unique=True)
+    image = models.ImageField(upload_to='covers/')
+    width = models.PositiveIntegerField()
+    height = models.PositiveIntegerField()
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.image.name
+
+    @classmethod
+    def acquire(cls, content, name='', count=1):
+        """Return the CoverImage for content (bytes or a file), holding `count` references."""
+        if isinstance(content, (bytes, bytearray)):
+            data = bytes(content)
+        else:
+            name = name or getattr(content, 'name', '')
+            content.seek(0)
+            data = content.read()
+            content.seek(0)
+        digest = hashlib.sha256(data).hexdigest()
+        while True:
+            cover = cls.objects.filter(sha256=digest).first()
+            if cover is None:
+                with Image.open(io.BytesIO(data)) as img:
+                    width, height = img.size
+                ext = os.path.splitext(name)[1].lower() or '.png'
+                cover = cls(sha256=digest, width=width, height=height, ref_count=count)
+                cover.image.save(f'{digest}{ext}', ContentFile(data), save=False)
+                try:
+                    with transaction.atomic():
+                        cover.save()
+                except IntegrityError:
+                    # another upload stored the same content first
+                    cover.image.delete(save=False)
+                    continue
+                return cover
+            # fails if a concurrent release() deleted the row meanwhile
+            if cls.objects.filter(pk=cover.pk).update(ref_count=F('ref_count') + count):
+                return cover
+
+    @classmethod
+    def release(cls, cover_id, count=1):
+        cls.objects.filter(pk=cover_id, ref_count__gte=count).update(ref_count=F('ref_count') - count)
+        orphan = cls.objects.filter(pk=cover_id, ref_count=0).first()
+        if orphan is None:
+            return
+        try:
+            deleted, _ = cls.objects.filter(pk=cover_id, ref_count=0).delete()
+        except ProtectedError:
+            return
+        if deleted:
+            storage, name = orphan.image.storage, orphan.image.name
+            transaction.on_commit(lambda: storage.delete(name))
 
 class StoredFile(models.Model):
+    STATUS_PROCESSING = 'processing'
+    STATUS_READY = 'ready'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PROCESSING, 'Processing'),
+        (STATUS_READY, 'Ready'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='stored_files')
     original_name = models.CharField(max_length=255)
-    cover_image = models.ImageField(upload_to='covers/')
-    stego_image = models.ImageField(upload_to='stego/')
+    cover = models.ForeignKey(CoverImage, on_delete=models.PROTECT, related_name='stored_files', null=True, blank=True)
+    stego_image = models.ImageField(upload_to='stego/', blank=True)
     nonce = models.BinaryField()
     data_length = models.IntegerField()
+    cipher_version = models.PositiveSmallIntegerField(default=1)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_READY)
+    file_type = models.CharField(max_length=8, default='Other')
+    # 0: the payload is in stego_image; otherwise it spans this many StoredFileShards
+    shard_count = models.PositiveSmallIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # every listing filters by user and orders newest first
+            models.Index(fields=['user', '-created_at', '-id'], name='storedfile_user_created_idx'),
+        ]
+
     def __str__(self):
         return self.original_name
 
+    def save(self, *args, **kwargs):
+        if self._state.adding:
+            self.file_type = classify_file_type(self.original_name)
+        super().save(*args, **kwargs)
+
+    @property
+    def fingerprint(self) -> str:
+        # stego images are write-once, so name + nonce + length identify the bytes
+        raw = f'{self.pk}:{self.stego_image.name}:{bytes(self.nonce).hex()}:{self.data_length}'
+        return hashlib.sha256(raw.encode()).hexdigest()[:32]
+
+class StoredFileShard(models.Model):
+    """One stego image holding a consecutive slice of a StoredFile's ciphertext."""
+    stored_file = models.ForeignKey(StoredFile, on_delete=models.CASCADE, related_name='shards')
+    index = models.PositiveSmallIntegerField()
+    stego_image = models.ImageField(upload_to='stego/')
+    length = models.IntegerField()
+
+    class Meta:
+        ordering = ['index']
+        constraints = [
+            models.UniqueConstraint(fields=['stored_file', 'index'], name='storedfileshard_file_index_uniq'),
+        ]
+
+    def __str__(self):
+        return f'{self.stored_file} [{self.index}]'
+
+class UploadJob(models.Model):
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, 'Queued'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    stored_file = models.OneToOneField(StoredFile, on_delete=models.CASCADE, related_name='upload_job')
+    staged_file = models.FileField(upload_to='uploads/', storage=get_staging_storage, blank=True)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_QUEUED, db_index=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return f'{self.stored_file} ({self.status})'
+
+class FileTypeCount(models.Model):
+    """Per-user StoredFile count by file_type, maintained incrementally."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='file_type_counts')
+    file_type = models.CharField(max_length=8)
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'file_type'], name='filetypecount_user_type_uniq'),
+        ]
+
+    def __str__(self):
+        return f'{self.user} {self.file_type}: {self.count}'
+
+    @classmethod
+    def adjust(cls, user_id, file_type, delta):
+        rows = cls.objects.filter(user_id=user_id, file_type=file_type)
+        if delta < 0:
+            rows = rows.filter(count__gte=-delta)
+        updated = rows.update(count=F('count') + delta)
+        if not updated and delta > 0:
+            obj, created = cls.objects.get_or_create(user_id=user_id, file_type=file_type, defaults={'count': delta})
+            if not created:
+                cls.objects.filter(pk=obj.pk).update(count=F('count') + delta)
+
+    @classmethod
+    def rebuild(cls, user_id):
+        """Recount user_id's rows from StoredFile (see rebuild_file_type_counts)."""
+        with transaction.atomic():
+            rows = StoredFile.objects.filter(user_id=user_id).values('file_type').annotate(n=Count('id'))
+            cls.objects.filter(user_id=user_id).delete()
+            cls.objects.bulk_create(cls(user_id=user_id, file_type=row['file_type'], count=row['n']) for row in rows)
+
+def file_type_counts(user) -> dict:
+    """Return {label: count} for every label in FILE_TYPE_LABELS."""
+    counts = {label: 0 for label in FILE_TYPE_LABELS}
+    if getattr(settings, 'STORAGE_FILE_TYPE_COUNTERS', True):
+        rows = FileTypeCount.objects.filter(user=user).values_list('file_type', 'count')
+    else:
+        rows = StoredFile.objects.filter(user=user).values('file_type').annotate(n=Count('id')).values_list('file_type', 'n')
+    for file_type, count in rows:
+        counts[file_type if file_type in counts else 'Other'] += count
+    return counts
+
+@receiver(post_save, sender=StoredFile)
+def count_stored_file(sender, instance, created, **kwargs):
+    if created:
+        FileTypeCount.adjust(instance.user_id, instance.file_type, 1)
+
+@receiver(post_delete, sender=StoredFile)
+def uncount_stored_file(sender, instance, **kwargs):
+    FileTypeCount.adjust(instance.user_id, instance.file_type, -1)
+    if instance.cover_id:
+        CoverImage.release(instance.cover_id)
+
 # Create your models here.
@@ -0,0 +1,35 @@
+from django.conf import settings
+from django.core.paginator import Paginator
+from rest_framework.pagination import CursorPagination
+
+# columns the file list/history templates render
+LIST_FIELDS = ('id', 'original_name', 'file_type', 'data_length', 'status', 'created_at')
+
+
+def get_page_size(request) -> int:
+    default = getattr(settings, 'STORAGE_PAGE_SIZE', 25)
+    maximum = getattr(settings, 'STORAGE_MAX_PAGE_SIZE', 100)
+    try:
+        size = int(request.GET.get('page_size', default))
+    except ValueError:
+        size = default
+    return max(1, min(size, maximum))
+
+
+def paginate_files(request, queryset):
+    """Page-based pagination for the HTML listings."""
+    paginator = Paginator(queryset.only(*LIST_FIELDS), get_page_size(request))
+    return paginator.get_page(request.GET.get('page'))
+
+
+class StoredFileCursorPagination(CursorPagination):
+    """Keyset pagination over (created_at, id), newest first.
+
+    The cursor encodes the last created_at seen, so each page is an index
+    range scan no matter how deep the client pages.
+    """
+    ordering = ('-created_at', '-id')
+    page_size_query_param = 'page_size'
+
+    def get_page_size(self, request):
+        return get_page_size(request)
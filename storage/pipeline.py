@@ -0,0 +1,372 @@
+import logging
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .capacity import CoverTooSmall, check_capacity, cover_capacity
+from .codecs import get_stego_codec
+from .covers import cover_source, read_cover
+from .models import CoverImage, FileTypeCount, StoredFile, StoredFileShard, UploadJob, classify_file_type
+from .shards import embed_shard, get_shard_workers, ordered_map, split_payload
+from .summary import dashboard_summary
+from .utils import aes_encrypt_stream, embed_capacity, encrypted_length, hide_data_in_image, CIPHER_CHUNKED
+
+logger = logging.getLogger(__name__)
+
+
+def use_upload_jobs() -> bool:
+    return getattr(settings, 'STORAGE_UPLOAD_MODE', 'sync') == 'job'
+
+
+def build_stego_content(user_id: int, chunks, size: int, covers, name: str):
+    """Encrypt `chunks` and embed them into `covers` (one cover or a list of
+    CoverSources, CoverImages, files or bytes).
+
+    Returns (shards, nonce, ct_length), where shards lists (stego image as a
+    ContentFile in the STORAGE_STEGO_CODEC container, payload length). A payload that fits the first cover gives
+    a single image; larger ones are split over the covers in turn, up to
+    STORAGE_MAX_SHARDS images embedded on the shard process pool.
+    """
+    if not isinstance(covers, (list, tuple)):
+        covers = [covers]
+    covers = [cover_source(cover) for cover in covers]
+    ct_length = encrypted_length(size)
+    lengths = check_capacity(size, [embed_capacity(*cover.size()) for cover in covers])
+    ct_chunks, nonce = aes_encrypt_stream(user_id, chunks)
+    codec = get_stego_codec()
+    if len(lengths) == 1:
+        data, ext = codec.encode(hide_data_in_image(covers[0].pixels(), ct_chunks, ct_length))
+        return [(ContentFile(data, name=f"{name}{ext}"), ct_length)], nonce, ct_length
+    if get_shard_workers() > 1:
+        # pool workers get the encoded cover and decode it into their own
+        # pixel cache; pickling the decoded array per shard costs far more
+        covers = [cover.portable() for cover in covers]
+    payloads = split_payload(ct_chunks, lengths)
+    images = ordered_map(embed_shard, ((covers[i % len(covers)], payload, codec) for i, payload in enumerate(payloads)))
+    shards = [(ContentFile(data, name=f"{name}.{i}{ext}"), length) for i, ((data, ext), length) in enumerate(zip(images, lengths))]
+    return shards, nonce, ct_length
+
+
+def apply_stego(obj, shards):
+    """Point obj at its stego image, or record how many shards it spans."""
+    if len(shards) == 1:
+        obj.stego_image = shards[0][0]
+        obj.shard_count = 0
+    else:
+        obj.shard_count = len(shards)
+
+
+def create_shards(obj, shards):
+    """Insert the StoredFileShard rows for a saved obj (no-op for one image)."""
+    if len(shards) > 1:
+        StoredFileShard.objects.bulk_create(
+            StoredFileShard(stored_file=obj, index=index, stego_image=content, length=length)
+            for index, (content, length) in enumerate(shards)
+        )
+
+
+def create_stored_file(user, up_file, covers) -> StoredFile:
+    """Encrypt and embed an upload in the request and create its StoredFile.
+
+    The first cover is kept as a deduplicated CoverImage; any further covers
+    only hold shards and are not stored.
+    """
+    if not isinstance(covers, (list, tuple)):
+        covers = [covers]
+    data = read_cover(covers[0])
+    cover = CoverImage.acquire(data, getattr(covers[0], 'name', ''))
+    try:
+        shards, nonce, ct_length = build_stego_content(
+            user.id, up_file.chunks(), up_file.size, [cover_source(cover, data), *covers[1:]], up_file.name,
+        )
+        obj = StoredFile(
+            user=user,
+            original_name=up_file.name,
+            cover=cover,
+            nonce=nonce,
+            data_length=ct_length,
+            cipher_version=CIPHER_CHUNKED,
+        )
+        apply_stego(obj, shards)
+        with transaction.atomic():
+            obj.save()
+            create_shards(obj, shards)
+    except Exception:
+        CoverImage.release(cover.pk)
+        raise
+    return obj
+
+
+def enqueue_upload(user, up_file, cover) -> StoredFile:
+    """Stage the plaintext and create a StoredFile in the processing state."""
+    cover = CoverImage.acquire(cover)
+    try:
+        with transaction.atomic():
+            obj = StoredFile.objects.create(
+                user=user,
+                original_name=up_file.name,
+                cover=cover,
+                nonce=b'',
+                data_length=encrypted_length(up_file.size),
+                cipher_version=CIPHER_CHUNKED,
+                status=StoredFile.STATUS_PROCESSING,
+            )
+            UploadJob.objects.create(stored_file=obj, staged_file=up_file)
+    except Exception:
+        CoverImage.release(cover.pk)
+        raise
+    return obj
+
+
+def _save_field_file(model, field_name, name, content) -> str:
+    # store the file up front so bulk_create only has to insert the name
+    field = model._meta.get_field(field_name)
+    return field.storage.save(field.generate_filename(None, name), content)
+
+
+def _delete_field_files(saved):
+    for model, field_name, name in saved:
+        model._meta.get_field(field_name).storage.delete(name)
+
+
+def bulk_upload(user, files, covers) -> list[dict]:
+    """Store files[i] in covers[i], or every file in covers[0] if only one is given.
+
+    Returns one result per file, in order: the new row's id and status, or an
+    error. Covers are checked for capacity before any work starts; encryption
+    and storage writes run on a pool of STORAGE_BULK_UPLOAD_WORKERS threads,
+    and all rows are inserted with bulk_create in one transaction.
+    """
+    jobs = use_upload_jobs()
+    shared = len(covers) == 1
+    cover_info = []
+    for cover in covers:
+        cover.seek(0)
+        data = cover.read()
+        try:
+            capacity = cover_capacity(data)
+        except OSError:
+            capacity = None
+        cover_info.append((cover, data, capacity))
+
+    results = []
+    pending = []
+    for index, up_file in enumerate(files):
+        cover, data, capacity = cover_info[0 if shared else index]
+        result = {'index': index, 'original_name': up_file.name}
+        if capacity is None:
+            result['error'] = 'cover_image is not a valid image'
+        else:
+            try:
+                check_capacity(up_file.size, [capacity])
+            except CoverTooSmall as e:
+                result['error'] = str(e)
+            else:
+                pending.append(index)
+        results.append(result)
+    if not pending:
+        return results
+
+    # hold one cover reference per file up front; failed items give theirs back
+    saved = []
+    saved_lock = threading.Lock()
+    released = set()
+    acquired = {}
+    try:
+        if shared:
+            acquired[0] = CoverImage.acquire(cover_info[0][1], covers[0].name, count=len(pending))
+        else:
+            for index in pending:
+                acquired[index] = CoverImage.acquire(cover_info[index][1], covers[index].name)
+    except Exception:
+        for index, cover in acquired.items():
+            CoverImage.release(cover.pk, len(pending) if shared else 1)
+        raise
+
+    def process(index):
+        # an item that fails removes what it already wrote; the rest is
+        # recorded in `saved` for the batch-wide cleanup
+        written = []
+
+        def save(model, field_name, name, content):
+            written.append((model, field_name, _save_field_file(model, field_name, name, content)))
+            return written[-1][2]
+
+        try:
+            obj, staged, shards = build(index, save)
+        except Exception:
+            _delete_field_files(written)
+            raise
+        with saved_lock:
+            saved.extend(written)
+        return obj, staged, shards
+
+    def build(index, save):
+        up_file = files[index]
+        cover = acquired[0 if shared else index]
+        cover_data = cover_info[0 if shared else index][1]
+        obj = StoredFile(
+            user=user,
+            original_name=up_file.name,
+            cover=cover,
+            cipher_version=CIPHER_CHUNKED,
+            # bulk_create skips save(), which normally classifies the file
+            file_type=classify_file_type(up_file.name),
+        )
+        staged = None
+        shards = []
+        if jobs:
+            staged = save(UploadJob, 'staged_file', up_file.name, up_file)
+            obj.nonce = b''
+            obj.data_length = encrypted_length(up_file.size)
+            obj.status = StoredFile.STATUS_PROCESSING
+        else:
+            # decoded from the request's bytes, once per cover across threads
+            built_shards, nonce, ct_length = build_stego_content(
+                user.id, up_file.chunks(), up_file.size, cover_source(cover, cover_data), up_file.name,
+            )
+            if len(built_shards) == 1:
+                content = built_shards[0][0]
+                obj.stego_image = save(StoredFile, 'stego_image', content.name, content)
+            else:
+                obj.shard_count = len(built_shards)
+                shards = [
+                    (save(StoredFileShard, 'stego_image', content.name, content), length)
+                    for content, length in built_shards
+                ]
+            obj.nonce = nonce
+            obj.data_length = ct_length
+        return obj, staged, shards
+
+    built = []
+    workers = getattr(settings, 'STORAGE_BULK_UPLOAD_WORKERS', 4)
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(pending)))) as pool:
+            futures = [(index, pool.submit(process, index)) for index in pending]
+            for index, future in futures:
+                try:
+                    obj, staged, shards = future.result()
+                except (ValueError, OSError) as e:
+                    logger.warning(f"Bulk upload item {files[index].name} failed: {e}")
+                    results[index]['error'] = str(e)
+                    CoverImage.release(acquired[0 if shared else index].pk)
+                    released.add(index)
+                    continue
+                built.append((index, obj, staged, shards))
+
+        with transaction.atomic():
+            StoredFile.objects.bulk_create([obj for _, obj, _, _ in built])
+            if jobs:
+                UploadJob.objects.bulk_create([UploadJob(stored_file=obj, staged_file=staged) for _, obj, staged, _ in built])
+            StoredFileShard.objects.bulk_create([
+                StoredFileShard(stored_file=obj, index=i, stego_image=name, length=length)
+                for _, obj, _, shards in built
+                for i, (name, length) in enumerate(shards)
+            ])
+            for file_type, count in Counter(obj.file_type for _, obj, _, _ in built).items():
+                FileTypeCount.adjust(user.id, file_type, count)
+            # bulk_create sends no post_save, so the cached summary is refreshed here
+            transaction.on_commit(lambda: dashboard_summary.invalidate(user.id))
+    except Exception:
+        # the executor has waited for every item, so `saved` is complete
+        _delete_field_files(saved)
+        outstanding = [index for index in pending if index not in released]
+        if shared and outstanding:
+            CoverImage.release(acquired[0].pk, len(outstanding))
+        elif not shared:
+            for index in outstanding:
+                CoverImage.release(acquired[index].pk)
+        raise
+
+    for index, obj, _, _ in built:
+        results[index].update({'id': obj.pk, 'status': obj.status})
+    return results
+
+
+def requeue_jobs(job_ids, error: str):
+    """Put running jobs that were lost (timed out, or their worker died)
+    back on the queue, or fail them once STORAGE_JOB_MAX_ATTEMPTS is spent."""
+    max_attempts = getattr(settings, 'STORAGE_JOB_MAX_ATTEMPTS', 3)
+    running = UploadJob.objects.filter(pk__in=job_ids, status=UploadJob.STATUS_RUNNING)
+    running.filter(attempts__lt=max_attempts).update(status=UploadJob.STATUS_QUEUED, error=error)
+    for job in running.filter(attempts__gte=max_attempts).select_related('stored_file'):
+        # conditional, so only one of several polling workers fails the job
+        failed = UploadJob.objects.filter(pk=job.pk, status=UploadJob.STATUS_RUNNING).update(
+            status=UploadJob.STATUS_FAILED, error=error, finished_at=timezone.now(),
+        )
+        if failed:
+            logger.error(f"Upload job {job.pk} failed after {job.attempts} attempts: {error}")
+            job.stored_file.status = StoredFile.STATUS_FAILED
+            job.stored_file.save(update_fields=['status'])
+            job.staged_file.delete(save=False)
+
+
+def claim_jobs(limit: int) -> list[int]:
+    """Atomically move up to `limit` queued jobs to running and return their ids.
+
+    The conditional UPDATE makes this safe with several worker processes
+    polling the same database, and counts the attempt in the same statement
+    so a worker that dies mid-job still uses one up.
+    """
+    timeout = getattr(settings, 'STORAGE_JOB_TIMEOUT', 600)
+    stale = timezone.now() - timedelta(seconds=timeout)
+    stale_ids = UploadJob.objects.filter(status=UploadJob.STATUS_RUNNING, started_at__lt=stale).values_list('pk', flat=True)
+    requeue_jobs(list(stale_ids), 'Timed out')
+    claimed = []
+    candidates = UploadJob.objects.filter(status=UploadJob.STATUS_QUEUED).order_by('created_at').values_list('pk', flat=True)[:limit]
+    for pk in candidates:
+        updated = UploadJob.objects.filter(pk=pk, status=UploadJob.STATUS_QUEUED).update(
+            status=UploadJob.STATUS_RUNNING,
+            started_at=timezone.now(),
+            attempts=F('attempts') + 1,
+        )
+        if updated:
+            claimed.append(pk)
+    return claimed
+
+
+def run_upload_job(job_id: int) -> str:
+    """Encrypt and embed one staged upload. Runs inside a worker process."""
+    close_old_connections()
+    job = UploadJob.objects.select_related('stored_file__cover').get(pk=job_id)
+    obj = job.stored_file
+    max_attempts = getattr(settings, 'STORAGE_JOB_MAX_ATTEMPTS', 3)
+    try:
+        with job.staged_file.open('rb') as staged:
+            shards, nonce, ct_length = build_stego_content(
+                obj.user_id, staged.chunks(), staged.size, obj.cover, obj.original_name,
+            )
+        apply_stego(obj, shards)
+        obj.nonce = nonce
+        obj.data_length = ct_length
+        obj.status = StoredFile.STATUS_READY
+        with transaction.atomic():
+            obj.shards.all().delete()
+            create_shards(obj, shards)
+            obj.save(update_fields=['stego_image', 'shard_count', 'nonce', 'data_length', 'status'])
+    except Exception as e:
+        logger.exception(f"Upload job {job_id} failed")
+        job.error = str(e)
+        if job.attempts < max_attempts and not isinstance(e, ValueError):
+            job.status = UploadJob.STATUS_QUEUED
+        else:
+            job.status = UploadJob.STATUS_FAILED
+            job.finished_at = timezone.now()
+            obj.status = StoredFile.STATUS_FAILED
+            obj.save(update_fields=['status'])
+            job.staged_file.delete(save=False)
+        job.save()
+        return job.status
+    job.staged_file.delete(save=False)
+    job.status = UploadJob.STATUS_DONE
+    job.error = ''
+    job.finished_at = timezone.now()
+    job.save()
+    return job.status
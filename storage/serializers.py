@@ -1,7 +1,41 @@
-from rest_framework import serializers
+from rest_framework import serializers, status
+from rest_framework.exceptions import APIException
+
+from .capacity import CoverTooSmall, check_capacity, cover_capacity, cover_dimensions
 from .models import StoredFile
 
 class StoredFileSerializer(serializers.ModelSerializer):
     class Meta:
         model = StoredFile
         fields = ['id', 'original_name', 'created_at']
+
+class PayloadTooLarge(APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = 'The file does not fit in the cover image.'
+    default_code = 'cover_too_small'
+
+class StoredFileUploadSerializer(serializers.Serializer):
+    """A file and its cover(s); extra cover_image entries hold shards of
+    payloads too big for one cover unless the `single_cover` context is set."""
+    file = serializers.FileField(allow_empty_file=True)
+    cover_image = serializers.ListField(child=serializers.ImageField(), min_length=1)
+
+    def validate(self, attrs):
+        covers = attrs['cover_image'][:1] if self.context.get('single_cover') else attrs['cover_image']
+        try:
+            check_capacity(attrs['file'].size, [cover_capacity(cover) for cover in covers])
+        except CoverTooSmall as e:
+            raise PayloadTooLarge(e.user_message(attrs['file'].name))
+        attrs['cover_image'] = covers
+        return attrs
+
+class CoverCapacitySerializer(serializers.Serializer):
+    cover_image = serializers.ListField(child=serializers.FileField(), min_length=1)
+    size = serializers.IntegerField(min_value=0, required=False)
+
+    def validate_cover_image(self, covers):
+        # only the header is parsed; the pixels are never decoded
+        try:
+            return [(cover, cover_dimensions(cover)) for cover in covers]
+        except OSError:
+            raise serializers.ValidationError('cover_image is not a valid image')
@@ -0,0 +1,149 @@
+import io
+import multiprocessing
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+
+from .codecs import open_stego_image
+from .utils import HEADER_BITS, _read_lsb_bytes, extract_data_from_image, hide_data_in_image
+
+# Payloads larger than one cover are split into consecutive byte ranges of
+# the ciphertext, each embedded in its own stego image (a StoredFileShard).
+# Covers are used in turn, so a single cover is simply reused per shard.
+# This module must not import models: its functions run in pool workers.
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_shard_workers() -> int:
+    return getattr(settings, 'STORAGE_SHARD_WORKERS', 2)
+
+
+def _mp_context():
+    # forking a threaded web worker can hand the child a lock some other
+    # thread held at the time; start pool workers from a clean interpreter
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+
+
+def get_shard_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=get_shard_workers(), mp_context=_mp_context())
+        return _pool
+
+
+def _reset_pool():
+    global _pool
+    with _pool_lock:
+        _pool = None
+
+
+def ordered_map(fn, arg_tuples, workers: int | None = None):
+    """Yield fn(*args) for each args in order, running up to `workers` calls
+    at once on the shard pool. arg_tuples is consumed lazily, so at most
+    `workers` inputs and results are held in memory."""
+    workers = get_shard_workers() if workers is None else workers
+    if workers <= 1:
+        for args in arg_tuples:
+            yield fn(*args)
+        return
+    pool = get_shard_pool()
+    pending = deque()
+    try:
+        for args in arg_tuples:
+            pending.append(pool.submit(fn, *args))
+            if len(pending) >= workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    except BrokenProcessPool:
+        _reset_pool()
+        raise
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def shard_plan(ct_length: int, capacities: list[int], max_shards: int | None = None) -> list[int]:
+    """Split ct_length bytes over covers used in turn; return each shard's length."""
+    max_shards = max_shards or getattr(settings, 'STORAGE_MAX_SHARDS', 16)
+    lengths = []
+    remaining = ct_length
+    while remaining > 0 or not lengths:
+        if len(lengths) == max_shards:
+            raise ValueError('Data too large for cover image')
+        capacity = capacities[len(lengths) % len(capacities)]
+        lengths.append(min(capacity, remaining))
+        remaining -= lengths[-1]
+    return lengths
+
+
+def split_payload(ct_chunks, lengths):
+    """Regroup an iterable of ciphertext pieces into shards of the given lengths."""
+    buf = bytearray()
+    pieces = iter(ct_chunks)
+    for length in lengths:
+        while len(buf) < length:
+            piece = next(pieces, None)
+            if piece is None:
+                raise ValueError('Embedded data does not match declared length')
+            buf += piece
+        yield bytes(buf[:length])
+        del buf[:length]
+
+
+def embed_shard(cover, payload: bytes, codec) -> tuple[bytes, str]:
+    """Embed one shard into a CoverSource and encode it with codec."""
+    return codec.encode(hide_data_in_image(cover.pixels(), payload))
+
+
+def extract_shard(stego: bytes, length: int) -> bytes:
+    return extract_data_from_image(io.BytesIO(stego), length)
+
+
+def _read_field(field_file) -> bytes:
+    field_file.open('rb')
+    try:
+        return field_file.read()
+    finally:
+        field_file.close()
+
+
+def iter_shard_ciphertext(obj):
+    """Yield a sharded StoredFile's ciphertext shard by shard, extracting
+    upcoming shards in parallel."""
+    shards = list(obj.shards.all())
+    return ordered_map(extract_shard, ((_read_field(s.stego_image), s.length) for s in shards))
+
+
+def shard_reader(obj):
+    """read(offset, size) over a sharded StoredFile's ciphertext; shard
+    images are loaded on first use."""
+    shards = list(obj.shards.all())
+    starts = []
+    offset = 0
+    for shard in shards:
+        starts.append(offset)
+        offset += shard.length
+    images = {}
+
+    def read(offset: int, size: int) -> bytes:
+        out = bytearray()
+        for index, shard in enumerate(shards):
+            start = starts[index]
+            lo = max(offset, start)
+            hi = min(offset + size, start + shard.length)
+            if lo >= hi:
+                continue
+            if index not in images:
+                images[index] = open_stego_image(io.BytesIO(_read_field(shard.stego_image)))
+            out += _read_lsb_bytes(images[index], HEADER_BITS + (lo - start) * 8, hi - lo)
+        return bytes(out)
+
+    return read
@@ -0,0 +1,156 @@
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import StoredFile
+
+RECENT_FILES = 5
+
+
+class DashboardSummary:
+    """Per-user dashboard numbers kept in Django's cache.
+
+    The summary holds the number and encrypted size of the user's ready
+    files, the recent file ids and the last upload time. StoredFile saves and deletes patch it in place. Every
+    change also bumps a per-user generation counter with cache.incr. A
+    summary whose generation does not match the counter is stale and gets
+    rebuilt, so a rebuild racing with an upload can never stick. Only one
+    request rebuilds at a time; the others wait briefly for its result.
+    With cache_alias None nothing is cached and get() always computes.
+    """
+
+    def __init__(self, cache_alias='default', timeout=300, prefix='dashboard'):
+        self.cache_alias = cache_alias
+        self.timeout = timeout
+        self.prefix = prefix
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    def _keys(self, user_id):
+        base = f'{self.prefix}:{user_id}'
+        return f'{base}:summary', f'{base}:gen', f'{base}:lock'
+
+    def _fresh(self, user_id):
+        summary_key, gen_key, _ = self._keys(user_id)
+        values = self.cache.get_many([summary_key, gen_key])
+        summary = values.get(summary_key)
+        gen = values.get(gen_key)
+        if summary is not None and gen is not None and summary['generation'] == gen:
+            return summary
+        return None
+
+    def get(self, user_id) -> dict:
+        if self.cache_alias is None:
+            return self.compute(user_id)
+        summary = self._fresh(user_id)
+        if summary is not None:
+            return summary
+        _, _, lock_key = self._keys(user_id)
+        if self.cache.add(lock_key, 1, timeout=10):
+            try:
+                return self.rebuild(user_id)
+            finally:
+                self.cache.delete(lock_key)
+        deadline = time.monotonic() + 1
+        while time.monotonic() < deadline:
+            time.sleep(0.05)
+            summary = self._fresh(user_id)
+            if summary is not None:
+                return summary
+        return self.compute(user_id)
+
+    def compute(self, user_id) -> dict:
+        files = StoredFile.objects.filter(user_id=user_id)
+        # processing and failed uploads hold no stored data yet
+        ready = files.filter(status=StoredFile.STATUS_READY)
+        totals = ready.aggregate(total_files=Count('id'), total_bytes=Sum('data_length'))
+        recent = list(files.order_by('-created_at', '-id').values_list('id', 'created_at')[:RECENT_FILES])
+        return {
+            'total_files': totals['total_files'],
+            'total_bytes': totals['total_bytes'] or 0,
+            'recent_ids': [pk for pk, _ in recent],
+            'last_upload': recent[0][1] if recent else None,
+        }
+
+    def rebuild(self, user_id) -> dict:
+        summary_key, gen_key, _ = self._keys(user_id)
+        # seed from the clock so a counter lost to eviction never repeats an old value
+        self.cache.add(gen_key, time.time_ns(), timeout=None)
+        gen = self.cache.get(gen_key)
+        summary = {**self.compute(user_id), 'generation': gen}
+        self.cache.set(summary_key, summary, timeout=self.timeout)
+        return summary
+
+    def apply(self, user_id, update):
+        """Patch the cached summary with update(summary), or drop it.
+
+        update returns False when the change cannot be applied incrementally.
+        """
+        if self.cache_alias is None:
+            return
+        summary_key, gen_key, _ = self._keys(user_id)
+        try:
+            gen = self.cache.incr(gen_key)
+        except ValueError:
+            self.cache.delete(summary_key)
+            return
+        summary = self.cache.get(summary_key)
+        if summary is None:
+            return
+        if summary['generation'] != gen - 1 or update(summary) is False:
+            self.cache.delete(summary_key)
+            return
+        summary['generation'] = gen
+        self.cache.set(summary_key, summary, timeout=self.timeout)
+
+    def file_added(self, user_id, pk, data_length, created_at, ready=True):
+        def update(summary):
+            if ready:
+                summary['total_files'] += 1
+                summary['total_bytes'] += data_length
+            summary['recent_ids'] = [pk, *summary['recent_ids']][:RECENT_FILES]
+            summary['last_upload'] = created_at
+        self.apply(user_id, update)
+
+    def file_removed(self, user_id, pk, data_length, ready=True):
+        def update(summary):
+            if pk in summary['recent_ids']:
+                # the next most recent file is unknown, so rebuild
+                return False
+            if ready:
+                summary['total_files'] -= 1
+                summary['total_bytes'] -= data_length
+        self.apply(user_id, update)
+
+    def invalidate(self, user_id):
+        self.apply(user_id, lambda summary: False)
+
+
+dashboard_summary = DashboardSummary(
+    cache_alias=getattr(settings, 'STORAGE_DASHBOARD_CACHE', 'default'),
+    timeout=getattr(settings, 'STORAGE_DASHBOARD_CACHE_TIMEOUT', 300),
+)
+
+
+@receiver(post_save, sender=StoredFile)
+def _summary_file_saved(sender, instance, created, update_fields=None, **kwargs):
+    user_id = instance.user_id
+    if created:
+        args = (user_id, instance.pk, instance.data_length, instance.created_at, instance.status == StoredFile.STATUS_READY)
+        transaction.on_commit(lambda: dashboard_summary.file_added(*args))
+    elif update_fields is None or {'data_length', 'status'} & set(update_fields):
+        transaction.on_commit(lambda: dashboard_summary.invalidate(user_id))
+
+
+@receiver(post_delete, sender=StoredFile)
+def _summary_file_deleted(sender, instance, **kwargs):
+    # instance.pk is cleared once the delete finishes, so capture it now
+    args = (instance.user_id, instance.pk, instance.data_length, instance.status == StoredFile.STATUS_READY)
+    transaction.on_commit(lambda: dashboard_summary.file_removed(*args))
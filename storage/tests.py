@@ -1,3 +1,998 @@
-from django.test import TestCase
+import io
+import os
+import tempfile
+import threading
+import time
+import zipfile
+from datetime import timedelta
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from cryptography.exceptions import InvalidTag
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings, skipUnlessDBFeature
+from django.utils import timezone
+from PIL import Image
+
+from .archive import member_names, stream_zip
+from .capacity import CoverTooSmall, check_capacity, cover_capacity, max_plaintext_size
+from .checks import check_dashboard_cache
+from .ciphercache import DiskBackend, MemoryBackend, cached_ciphertext
+from .codecs import PNGCodec, WebPCodec
+from .covers import PixelCache
+from .forms import UploadForm
+from .keycache import KeyCache, key_cache
+from .models import CoverImage, FileTypeCount, StoredFile, UploadJob, classify_file_type, file_type_counts
+from .pagination import LIST_FIELDS
+from .pipeline import claim_jobs, create_stored_file, enqueue_upload, run_upload_job
+from .shards import iter_shard_ciphertext, shard_plan, shard_reader, split_payload
+from .summary import DashboardSummary
+from .utils import (
+    CIPHER_LEGACY, STREAM_HEADER_SIZE, aes_decrypt_stream, aes_encrypt, aes_encrypt_stream, encrypted_length,
+    embed_capacity, extract_data_from_image, hide_data_in_image, load_cover_pixels,
+)
+
+INDEX_NAME = 'storedfile_user_created_idx'
+
+
+def png_bytes(size=(64, 64), mode='RGB', color='white') -> bytes:
+    buf = io.BytesIO()
+    Image.new(mode, size, color).save(buf, format='PNG')
+    return buf.getvalue()
+
+
+class StoredFileListingPlanTests(TestCase):
+    """The per-user listings must be served by the (user, created_at) index
+    instead of scanning the user's rows and sorting them."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('planner', 'planner@example.com', 'pw')
+        other = User.objects.create_user('other', 'other@example.com', 'pw')
+        StoredFile.objects.bulk_create(
+            StoredFile(user=user, original_name=f'file{i}.txt', nonce=b'', data_length=i)
+            for user in (cls.user, other)
+            for i in range(50)
+        )
+
+    def listing_querysets(self):
+        files = StoredFile.objects.filter(user=self.user)
+        return {
+            'dashboard': files.order_by('-created_at')[:5],
+            'file_list': files.order_by('-created_at', '-id').only(*LIST_FIELDS)[:25],
+            'api': files.order_by('-created_at', '-id').only('id', 'original_name', 'created_at')[:26],
+        }
+
+    def assertUsesIndex(self, plans):
+        for name, plan in plans.items():
+            with self.subTest(listing=name):
+                self.assertIn(INDEX_NAME, plan)
+                self.assertNotIn('TEMP B-TREE', plan.upper())
+
+    def test_sqlite_listing_plans_use_index(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('SQLite only')
+        self.assertUsesIndex({name: qs.explain() for name, qs in self.listing_querysets().items()})
+
+    @skipUnlessDBFeature('supports_explaining_query_execution')
+    def test_postgresql_listing_plans_use_index(self):
+        if connection.vendor != 'postgresql':
+            self.skipTest('PostgreSQL only')
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE storage_storedfile')
+            # tiny test tables make a sequential scan look cheaper
+            cursor.execute('SET LOCAL enable_seqscan = off')
+        self.assertUsesIndex({name: qs.explain() for name, qs in self.listing_querysets().items()})
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class CoverImageTests(TestCase):
+
+    def png(self, color):
+        buf = io.BytesIO()
+        Image.new('RGB', (16, 16), color).save(buf, format='PNG')
+        return ContentFile(buf.getvalue(), name='cover.png')
+
+    def test_identical_covers_share_one_row(self):
+        first = CoverImage.acquire(self.png('red'))
+        second = CoverImage.acquire(self.png('red'))
+        other = CoverImage.acquire(self.png('blue'))
+        self.assertEqual(first.pk, second.pk)
+        self.assertNotEqual(first.pk, other.pk)
+        self.assertEqual(CoverImage.objects.get(pk=first.pk).ref_count, 2)
+        self.assertEqual((first.width, first.height), (16, 16))
+
+    def test_last_release_deletes_file(self):
+        cover = CoverImage.acquire(self.png('red'), count=2)
+        storage, name = cover.image.storage, cover.image.name
+        with self.captureOnCommitCallbacks(execute=True):
+            CoverImage.release(cover.pk)
+        self.assertTrue(storage.exists(name))
+        with self.captureOnCommitCallbacks(execute=True):
+            CoverImage.release(cover.pk)
+        self.assertFalse(CoverImage.objects.filter(pk=cover.pk).exists())
+        self.assertFalse(storage.exists(name))
+
+    def test_concurrent_misses_load_once(self):
+        cache = PixelCache()
+        loads = []
+
+        def loader():
+            loads.append(1)
+            time.sleep(0.05)
+            return np.zeros((4, 4, 3), dtype=np.uint8)
+
+        threads = [threading.Thread(target=cache.get, args=('cover', loader)) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(loads), 1)
+
+
+class StegoCodecTests(SimpleTestCase):
+
+    def test_payload_survives_every_container(self):
+        cover = Image.new('RGB', (64, 48), 'green')
+        payload = bytes(range(256)) * 4
+        stego = hide_data_in_image(np.array(cover), payload)
+        for codec in (PNGCodec(compress_level=1), PNGCodec(strategy='huffman'), WebPCodec()):
+            with self.subTest(codec=type(codec).__name__):
+                data, ext = codec.encode(stego)
+                self.assertEqual(ext, codec.extension)
+                self.assertEqual(extract_data_from_image(io.BytesIO(data)), payload)
+
+    def test_lossy_container_is_rejected(self):
+        buf = io.BytesIO()
+        Image.new('RGB', (8, 8)).save(buf, format='JPEG')
+        with self.assertRaises(OSError):
+            extract_data_from_image(buf)
+
+
+def reference_hide(cover_image_path, data: bytes) -> Image.Image:
+    # the original per-pixel loop, frozen; the vectorised embed must match it
+    img = Image.open(cover_image_path).convert('RGB')
+    pixels = img.load()
+    bitstream = []
+    payload = len(data).to_bytes(4, 'big') + data
+    for byte in payload:
+        for i in range(8):
+            bitstream.append((byte >> (7 - i)) & 1)
+    width, height = img.size
+    if len(bitstream) > width * height * 3:
+        raise ValueError('Data too large for cover image')
+    idx = 0
+    for y in range(height):
+        for x in range(width):
+            if idx >= len(bitstream):
+                return img
+            r, g, b = pixels[x, y]
+            if idx < len(bitstream):
+                r = (r & ~1) | bitstream[idx]; idx += 1
+            if idx < len(bitstream):
+                g = (g & ~1) | bitstream[idx]; idx += 1
+            if idx < len(bitstream):
+                b = (b & ~1) | bitstream[idx]; idx += 1
+            pixels[x, y] = (r, g, b)
+    return img
+
+
+class StegoEmbedCompatibilityTests(SimpleTestCase):
+
+    def cover(self, mode, size=(37, 23)):
+        noise = np.random.default_rng(1).integers(0, 256, (size[1], size[0], 4), dtype=np.uint8)
+        img = Image.fromarray(noise, 'RGBA')
+        if mode == 'P':
+            img = img.convert('RGB').quantize(64)
+        elif mode != 'RGBA':
+            img = img.convert(mode)
+        buf = io.BytesIO()
+        img.save(buf, format='PNG')
+        return buf.getvalue()
+
+    def assertSameImage(self, got, expected):
+        self.assertEqual((got.mode, got.size), (expected.mode, expected.size))
+        self.assertEqual(got.tobytes(), expected.tobytes())
+
+    def test_matches_the_original_loop(self):
+        # 0 bytes, a bit count that ends mid-pixel, and a completely full cover
+        for mode in ('RGB', 'RGBA', 'P', 'L'):
+            cover = self.cover(mode)
+            for length in (0, 5, 100, embed_capacity(37, 23)):
+                payload = os.urandom(length)
+                with self.subTest(mode=mode, length=length):
+                    expected = reference_hide(io.BytesIO(cover), payload)
+                    self.assertSameImage(hide_data_in_image(io.BytesIO(cover), payload), expected)
+                    pixels = load_cover_pixels(io.BytesIO(cover))
+                    self.assertSameImage(hide_data_in_image(pixels, payload), expected)
+
+    def test_streamed_pieces_match_the_original_loop(self):
+        cover = self.cover('RGBA')
+        payload = os.urandom(200)
+        pieces = [payload[:1], payload[1:77], payload[77:]]
+        self.assertSameImage(
+            hide_data_in_image(io.BytesIO(cover), pieces, len(payload)),
+            reference_hide(io.BytesIO(cover), payload),
+        )
+
+    def test_oversized_payload_is_rejected_like_the_original(self):
+        cover = self.cover('L', size=(4, 4))
+        payload = os.urandom(embed_capacity(4, 4) + 1)
+        with self.assertRaises(ValueError):
+            reference_hide(io.BytesIO(cover), payload)
+        with self.assertRaises(ValueError):
+            hide_data_in_image(io.BytesIO(cover), payload)
+
+
+@override_settings(STORAGE_MAX_SHARDS=2)
+class CapacityTests(SimpleTestCase):
+
+    def cover(self, size):
+        buf = io.BytesIO()
+        Image.new('RGB', size).save(buf, format='PNG')
+        return SimpleUploadedFile('cover.png', buf.getvalue(), content_type='image/png')
+
+    def test_max_plaintext_size_is_exact(self):
+        capacity = cover_capacity(self.cover((40, 40)))
+        self.assertEqual(capacity, 596)
+        largest = max_plaintext_size(2 * capacity)
+        self.assertEqual(check_capacity(largest, [capacity]), [596, 596])
+        with self.assertRaises(CoverTooSmall):
+            check_capacity(largest + 1, [capacity])
+
+    def test_upload_form_rejects_small_cover(self):
+        form = UploadForm(files={'file': SimpleUploadedFile('big.bin', b'x' * 5000), 'cover_image': self.cover((40, 40))})
+        self.assertFalse(form.is_valid())
+        self.assertTrue(form.has_error('file', 'cover_too_small'))
+        form = UploadForm(files={'file': SimpleUploadedFile('small.bin', b'x' * 500), 'cover_image': self.cover((40, 40))})
+        self.assertTrue(form.is_valid())
+
+
+class ChunkedCipherTests(SimpleTestCase):
+    CHUNK = 16
+    FRAME = 4 + CHUNK + 16
+
+    def encrypt(self, data, piece=7):
+        pieces = [data[i:i + piece] for i in range(0, len(data), piece)]
+        ct, nonce = aes_encrypt_stream(1, pieces, chunk_size=self.CHUNK)
+        return b''.join(ct), nonce
+
+    def decrypt(self, ct, nonce):
+        return b''.join(aes_decrypt_stream(1, nonce, ct))
+
+    def test_round_trip_at_chunk_boundaries(self):
+        for size in (0, self.CHUNK - 1, self.CHUNK, self.CHUNK + 1, 3 * self.CHUNK):
+            with self.subTest(size=size):
+                data = bytes(range(size))
+                ct, nonce = self.encrypt(data)
+                self.assertEqual(len(ct), encrypted_length(size, self.CHUNK))
+                self.assertEqual(self.decrypt(ct, nonce), data)
+                # the decryptor must not depend on how the ciphertext is split
+                self.assertEqual(b''.join(aes_decrypt_stream(1, nonce, (ct[i:i + 5] for i in range(0, len(ct), 5)))), data)
+
+    def test_tampering_is_rejected(self):
+        ct, nonce = self.encrypt(bytes(3 * self.CHUNK + 5))
+        header, frames = ct[:STREAM_HEADER_SIZE], ct[STREAM_HEADER_SIZE:]
+        f = [frames[i:i + self.FRAME] for i in range(0, len(frames), self.FRAME)]
+        cases = {
+            'truncated': ct[:-1],
+            'final frame dropped': header + b''.join(f[:-1]),
+            'middle frame dropped': header + f[0] + b''.join(f[2:]),
+            'frames reordered': header + f[1] + f[0] + b''.join(f[2:]),
+        }
+        for name, tampered in cases.items():
+            with self.subTest(name):
+                with self.assertRaises((InvalidTag, ValueError)):
+                    self.decrypt(tampered, nonce)
+
+    def test_legacy_records_still_decrypt(self):
+        ct, nonce = aes_encrypt(1, b'legacy payload')
+        self.assertEqual(b''.join(aes_decrypt_stream(1, nonce, ct, CIPHER_LEGACY)), b'legacy payload')
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), STORAGE_CHUNK_SIZE=64)
+class DownloadRangeTests(TestCase):
+    """Byte ranges and conditional requests on download_view."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('ranger', 'ranger@example.com', 'pw')
+        cls.data = bytes(range(256)) * 4
+        buf = io.BytesIO()
+        Image.new('RGB', (64, 64), 'white').save(buf, format='PNG')
+        cover = SimpleUploadedFile('cover.png', buf.getvalue(), content_type='image/png')
+        cls.obj = create_stored_file(cls.user, SimpleUploadedFile('data.bin', cls.data), cover)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+        self.url = f'/file/{self.obj.pk}/download/'
+
+    def get(self, **headers):
+        response = self.client.get(self.url, **headers)
+        body = b''.join(response.streaming_content) if response.streaming else response.content
+        return response, body
+
+    def test_full_download(self):
+        response, body = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(body, self.data)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+
+    def test_ranges(self):
+        cases = {
+            'bytes=0-0': (0, 0),
+            'bytes=60-130': (60, 130),
+            'bytes=990-': (990, 1023),
+            'bytes=-100': (924, 1023),
+            'bytes=1000-5000': (1000, 1023),
+        }
+        for header, (start, end) in cases.items():
+            with self.subTest(header):
+                response, body = self.get(HTTP_RANGE=header)
+                self.assertEqual(response.status_code, 206)
+                self.assertEqual(body, self.data[start:end + 1])
+                self.assertEqual(response['Content-Range'], f'bytes {start}-{end}/1024')
+                self.assertEqual(response['Content-Length'], str(end - start + 1))
+
+    def test_unsatisfiable_range(self):
+        response, _ = self.get(HTTP_RANGE='bytes=1024-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */1024')
+
+    def test_ignored_ranges_send_whole_file(self):
+        for header in ('bytes=0-1,5-6', 'items=0-1', 'bytes=9-3'):
+            with self.subTest(header):
+                response, body = self.get(HTTP_RANGE=header)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(body, self.data)
+
+    def test_if_range(self):
+        etag = self.get()[0]['ETag']
+        last_modified = self.get()[0]['Last-Modified']
+        response, _ = self.get(HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE=etag)
+        self.assertEqual(response.status_code, 206)
+        response, _ = self.get(HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE=last_modified)
+        self.assertEqual(response.status_code, 206)
+        response, body = self.get(HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(body, self.data)
+
+    def test_not_modified(self):
+        etag = self.get()[0]['ETag']
+        response, body = self.get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(body, b'')
+
+
+@override_settings(
+    MEDIA_ROOT=tempfile.mkdtemp(), STORAGE_STAGING_ROOT=tempfile.mkdtemp(),
+    STORAGE_CHUNK_SIZE=64, STORAGE_JOB_MAX_ATTEMPTS=2, STORAGE_JOB_TIMEOUT=600,
+)
+class UploadJobTests(TestCase):
+    """enqueue_upload, claim_jobs and run_upload_job, plus the status endpoints."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('queued', 'queued@example.com', 'pw')
+        cls.data = bytes(range(256)) * 3
+
+    def setUp(self):
+        cover = SimpleUploadedFile('cover.png', png_bytes())
+        self.obj = enqueue_upload(self.user, SimpleUploadedFile('data.bin', self.data), cover)
+        self.job = self.obj.upload_job
+        self.client.force_login(self.user)
+
+    def refresh(self):
+        self.obj.refresh_from_db()
+        self.job.refresh_from_db()
+
+    def test_enqueue_stages_the_upload(self):
+        self.assertEqual(self.obj.status, StoredFile.STATUS_PROCESSING)
+        self.assertEqual(self.job.status, UploadJob.STATUS_QUEUED)
+        self.assertEqual(self.job.attempts, 0)
+        with self.job.staged_file.open('rb') as f:
+            self.assertEqual(f.read(), self.data)
+        self.assertEqual(self.obj.cover.ref_count, 1)
+
+    def test_claim_counts_the_attempt(self):
+        self.assertEqual(claim_jobs(5), [self.job.pk])
+        self.assertEqual(claim_jobs(5), [])
+        self.refresh()
+        self.assertEqual(self.job.status, UploadJob.STATUS_RUNNING)
+        self.assertEqual(self.job.attempts, 1)
+
+    def test_stale_job_is_requeued_then_failed(self):
+        staged = self.job.staged_file.name
+        old = timezone.now() - timedelta(seconds=601)
+        for expected in ([self.job.pk], [self.job.pk], []):
+            self.assertEqual(claim_jobs(5), expected)
+            UploadJob.objects.filter(pk=self.job.pk).update(started_at=old)
+        self.refresh()
+        self.assertEqual(self.job.status, UploadJob.STATUS_FAILED)
+        self.assertEqual(self.job.error, 'Timed out')
+        self.assertEqual(self.obj.status, StoredFile.STATUS_FAILED)
+        self.assertFalse(self.job.staged_file.storage.exists(staged))
+
+    def test_run_job(self):
+        claim_jobs(1)
+        self.assertEqual(run_upload_job(self.job.pk), UploadJob.STATUS_DONE)
+        self.refresh()
+        self.assertEqual(self.obj.status, StoredFile.STATUS_READY)
+        self.assertFalse(self.job.staged_file)
+        response = self.client.get(f'/file/{self.obj.pk}/download/')
+        self.assertEqual(b''.join(response.streaming_content), self.data)
+
+    def test_transient_error_is_retried_until_attempts_run_out(self):
+        with mock.patch('storage.pipeline.build_stego_content', side_effect=OSError('disk full')), \
+                self.assertLogs('storage.pipeline', 'ERROR'):
+            claim_jobs(1)
+            self.assertEqual(run_upload_job(self.job.pk), UploadJob.STATUS_QUEUED)
+            self.refresh()
+            self.assertEqual(self.job.error, 'disk full')
+            self.assertTrue(self.job.staged_file.storage.exists(self.job.staged_file.name))
+            claim_jobs(1)
+            self.assertEqual(run_upload_job(self.job.pk), UploadJob.STATUS_FAILED)
+        self.refresh()
+        self.assertEqual(self.job.attempts, 2)
+        self.assertEqual(self.obj.status, StoredFile.STATUS_FAILED)
+
+    def test_value_error_fails_at_once(self):
+        staged = self.job.staged_file.name
+        with mock.patch('storage.pipeline.build_stego_content', side_effect=ValueError('bad cover')), \
+                self.assertLogs('storage.pipeline', 'ERROR'):
+            claim_jobs(1)
+            self.assertEqual(run_upload_job(self.job.pk), UploadJob.STATUS_FAILED)
+        self.refresh()
+        self.assertEqual(self.obj.status, StoredFile.STATUS_FAILED)
+        self.assertFalse(self.job.staged_file.storage.exists(staged))
+
+    def test_status_view(self):
+        url = f'/upload/{self.obj.pk}/status/'
+        response = self.client.get(url, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.json(), {'id': self.obj.pk, 'status': 'processing'})
+        self.assertEqual(self.client.get(url).status_code, 200)
+        StoredFile.objects.filter(pk=self.obj.pk).update(status=StoredFile.STATUS_READY)
+        self.assertRedirects(self.client.get(url), '/files/', fetch_redirect_response=False)
+        StoredFile.objects.filter(pk=self.obj.pk).update(status=StoredFile.STATUS_FAILED)
+        self.assertRedirects(self.client.get(url), '/upload/', fetch_redirect_response=False)
+
+    def test_status_api(self):
+        response = self.client.get(f'/api/storage/{self.obj.pk}/status/')
+        self.assertEqual(response.json(), {'id': self.obj.pk, 'original_name': 'data.bin', 'status': 'processing'})
+
+    def test_status_of_another_users_file(self):
+        other = User.objects.create_user('other', 'other@example.com', 'pw')
+        self.client.force_login(other)
+        self.assertEqual(self.client.get(f'/upload/{self.obj.pk}/status/').status_code, 404)
+        self.assertEqual(self.client.get(f'/api/storage/{self.obj.pk}/status/').status_code, 404)
+
+
+class ShardPlanTests(SimpleTestCase):
+
+    def test_covers_are_used_in_turn(self):
+        self.assertEqual(shard_plan(250, [100, 60]), [100, 60, 90])
+        self.assertEqual(shard_plan(100, [100]), [100])
+        self.assertEqual(shard_plan(0, [100]), [0])
+
+    def test_too_many_shards(self):
+        with self.assertRaises(ValueError):
+            shard_plan(301, [100], max_shards=3)
+
+    def test_split_payload_regroups_pieces(self):
+        pieces = [b'abc', b'', b'defghij', b'k']
+        self.assertEqual(list(split_payload(pieces, [4, 0, 5, 2])), [b'abcd', b'', b'efghi', b'jk'])
+        with self.assertRaises(ValueError):
+            list(split_payload([b'abc'], [2, 2]))
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), STORAGE_CHUNK_SIZE=64, STORAGE_MAX_SHARDS=8, STORAGE_SHARD_WORKERS=1)
+class ShardedFileTests(TestCase):
+    """Uploads split over several stego images of a 16x16 (92 byte) cover."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('sharded', 'sharded@example.com', 'pw')
+        cls.data = bytes(range(200)) + b'tail'
+        cover = SimpleUploadedFile('cover.png', png_bytes((16, 16)))
+        cls.obj = create_stored_file(cls.user, SimpleUploadedFile('data.bin', cls.data), cover)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def download(self, obj, **headers):
+        response = self.client.get(f'/file/{obj.pk}/download/', **headers)
+        return response, b''.join(response.streaming_content)
+
+    def test_round_trip(self):
+        self.assertGreater(self.obj.shard_count, 2)
+        self.assertEqual([s.length for s in self.obj.shards.all()], shard_plan(self.obj.data_length, [92]))
+        self.assertEqual(self.download(self.obj)[1], self.data)
+
+    def test_reader_spans_shard_boundaries(self):
+        ciphertext = b''.join(iter_shard_ciphertext(self.obj))
+        self.assertEqual(len(ciphertext), self.obj.data_length)
+        read = shard_reader(self.obj)
+        for offset, size in ((0, 10), (90, 4), (85, 100), (183, 1), (0, len(ciphertext))):
+            with self.subTest(offset=offset, size=size):
+                self.assertEqual(read(offset, size), ciphertext[offset:offset + size])
+
+    def test_range_download_across_shards(self):
+        response, body = self.download(self.obj, HTTP_RANGE='bytes=50-150')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(body, self.data[50:151])
+
+    @override_settings(STORAGE_SHARD_WORKERS=2)
+    def test_round_trip_on_the_process_pool(self):
+        obj = create_stored_file(self.user, SimpleUploadedFile('pool.bin', self.data[::-1]), SimpleUploadedFile('cover.png', png_bytes((16, 16))))
+        self.assertGreater(obj.shard_count, 2)
+        self.assertEqual(self.download(obj)[1], self.data[::-1])
+
+
+@override_settings(STORAGE_CHUNK_SIZE=64, STORAGE_MAX_SHARDS=1, STORAGE_BULK_UPLOAD_WORKERS=2, STORAGE_UPLOAD_MODE='sync')
+class BulkUploadAPITests(TestCase):
+    """POST /api/storage/bulk-upload/ with a 32x32 cover (380 bytes each)."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('bulk', 'bulk@example.com', 'pw')
+
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        media = override_settings(MEDIA_ROOT=self.media)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.client.force_login(self.user)
+
+    def post(self, files, covers):
+        return self.client.post('/api/storage/bulk-upload/', {
+            'files': [SimpleUploadedFile(name, data) for name, data in files],
+            'cover_images': [SimpleUploadedFile(f'cover{i}.png', data) for i, data in enumerate(covers)],
+        })
+
+    def stored_files(self):
+        return sorted(os.path.relpath(os.path.join(root, name), self.media) for root, _, names in os.walk(self.media) for name in names)
+
+    def download(self, pk):
+        return b''.join(self.client.get(f'/file/{pk}/download/').streaming_content)
+
+    def test_mixed_batch_returns_per_item_results(self):
+        files = [('a.pdf', b'first file'), ('big.zip', os.urandom(5000)), ('c.txt', b'third')]
+        response = self.post(files, [png_bytes((32, 32))])
+        self.assertEqual(response.status_code, 207)
+        results = response.json()['results']
+        self.assertEqual([r['index'] for r in results], [0, 1, 2])
+        self.assertEqual([r['original_name'] for r in results], ['a.pdf', 'big.zip', 'c.txt'])
+        self.assertIn('Data too large for cover image', results[1]['error'])
+        self.assertNotIn('id', results[1])
+        for result, (_, data) in zip((results[0], results[2]), (files[0], files[2])):
+            self.assertEqual(result['status'], StoredFile.STATUS_READY)
+            self.assertEqual(self.download(result['id']), data)
+        # the oversize item never took a reference on the shared cover
+        cover = CoverImage.objects.get()
+        self.assertEqual(cover.ref_count, 2)
+        self.assertEqual(StoredFile.objects.filter(cover=cover).count(), 2)
+
+    def test_all_stored_returns_201(self):
+        response = self.post([('a.txt', b'a'), ('b.txt', b'b')], [png_bytes((32, 32), color='red'), png_bytes((32, 32), color='blue')])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(CoverImage.objects.count(), 2)
+        self.assertEqual(set(CoverImage.objects.values_list('ref_count', flat=True)), {1})
+
+    def test_identical_covers_share_one_row(self):
+        cover = png_bytes((32, 32))
+        response = self.post([('a.txt', b'a'), ('b.txt', b'b'), ('c.txt', b'c')], [cover, cover, cover])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(CoverImage.objects.get().ref_count, 3)
+
+    def test_invalid_cover(self):
+        response = self.post([('a.txt', b'a'), ('b.txt', b'b')], [png_bytes((32, 32)), b'not an image'])
+        self.assertEqual(response.status_code, 207)
+        results = response.json()['results']
+        self.assertIn('id', results[0])
+        self.assertEqual(results[1]['error'], 'cover_image is not a valid image')
+
+    def test_failure_in_the_transaction_removes_everything(self):
+        files = [('a.pdf', b'first'), ('b.txt', b'second'), ('big.zip', os.urandom(5000))]
+        with mock.patch('storage.pipeline.FileTypeCount.adjust', side_effect=RuntimeError('db down')), \
+                self.captureOnCommitCallbacks(execute=True), self.assertRaises(RuntimeError):
+            self.post(files, [png_bytes((32, 32))])
+        self.assertFalse(StoredFile.objects.exists())
+        # the shared cover's references were all returned, so row and file are gone
+        self.assertFalse(CoverImage.objects.exists())
+        self.assertEqual(self.stored_files(), [])
+
+    @override_settings(STORAGE_BULK_UPLOAD_MAX_FILES=2)
+    def test_rejected_requests(self):
+        cover = png_bytes((32, 32))
+        self.assertEqual(self.post([('a', b'a'), ('b', b'b'), ('c', b'c')], [cover]).status_code, 400)
+        self.assertEqual(self.post([('a', b'a'), ('b', b'b')], [cover] * 3).status_code, 400)
+        self.assertEqual(self.post([], [cover]).status_code, 400)
+        self.assertFalse(CoverImage.objects.exists())
+
+
+class MemberNamesTests(SimpleTestCase):
+
+    def test_duplicates_get_suffixes(self):
+        names = ['a.pdf', 'A.pdf', 'a.pdf', 'a (2).pdf', 'docs/b.txt', '', 'noext', 'noext']
+        objs = [SimpleNamespace(pk=pk, original_name=name) for pk, name in enumerate(names, 1)]
+        self.assertEqual(member_names(objs), [
+            'a.pdf', 'A (2).pdf', 'a (3).pdf', 'a (2) (2).pdf', 'b.txt', 'file-6', 'noext', 'noext (2)',
+        ])
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), STORAGE_CHUNK_SIZE=64, STORAGE_MAX_SHARDS=8, STORAGE_SHARD_WORKERS=1)
+class BatchDownloadTests(TestCase):
+    """stream_zip and batch_download_view."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('zipper', 'zipper@example.com', 'pw')
+        cls.user.profile.face_image = 'faces/zipper.png'
+        cls.user.profile.save()
+        cls.contents = {
+            'report.pdf': b'first report',
+            'big.bin': bytes(range(256)) * 2,  # sharded over the 16x16 cover
+            'empty.txt': b'',
+        }
+        cover = png_bytes((16, 16))
+        cls.objs = [
+            create_stored_file(cls.user, SimpleUploadedFile(name, data), SimpleUploadedFile('cover.png', cover))
+            for name, data in cls.contents.items()
+        ]
+        cls.duplicate = create_stored_file(cls.user, SimpleUploadedFile('report.pdf', b'second report'), SimpleUploadedFile('cover.png', cover))
+        other = User.objects.create_user('other', 'other@example.com', 'pw')
+        cls.foreign = create_stored_file(other, SimpleUploadedFile('theirs.txt', b'x'), SimpleUploadedFile('cover.png', cover))
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def post(self, ids, face='data:image/png;base64,AAAA', match=True):
+        data = {'ids': [str(pk) for pk in ids]}
+        if face:
+            data['face_login_data'] = face
+        with mock.patch('storage.views.faces_match', return_value=match):
+            return self.client.post('/files/download/', data)
+
+    def open_zip(self, data):
+        archive = zipfile.ZipFile(io.BytesIO(data))
+        self.assertIsNone(archive.testzip())
+        return archive
+
+    def test_stream_zip(self):
+        self.assertGreater(self.objs[1].shard_count, 1)
+        # as in the view: prefetch threads must not query the shards themselves
+        pks = [*(obj.pk for obj in self.objs), self.duplicate.pk]
+        found = StoredFile.objects.prefetch_related('shards').in_bulk(pks)
+        objs = [found[pk] for pk in pks]
+        archive = self.open_zip(b''.join(stream_zip(self.user.id, objs, prefetch=1)))
+        self.assertEqual(archive.namelist(), ['report.pdf', 'big.bin', 'empty.txt', 'report (2).pdf'])
+        for name, data in self.contents.items():
+            self.assertEqual(archive.read(name), data)
+        self.assertEqual(archive.read('report (2).pdf'), b'second report')
+
+    def test_download(self):
+        response = self.post([self.duplicate.pk, self.objs[0].pk])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        archive = self.open_zip(b''.join(response.streaming_content))
+        self.assertEqual(archive.namelist(), ['report.pdf', 'report (2).pdf'])
+        self.assertEqual(archive.read('report.pdf'), b'second report')
+        self.assertEqual(archive.read('report (2).pdf'), b'first report')
+
+    def test_foreign_or_missing_ids(self):
+        self.assertEqual(self.post([self.objs[0].pk, self.foreign.pk]).status_code, 404)
+        self.assertEqual(self.post([self.objs[0].pk, 999999]).status_code, 404)
+
+    def test_bad_requests(self):
+        self.assertEqual(self.post(['nope']).status_code, 400)
+        self.assertRedirects(self.post([]), '/files/', fetch_redirect_response=False)
+
+    @override_settings(STORAGE_ZIP_MAX_FILES=2)
+    def test_max_files(self):
+        response = self.post([obj.pk for obj in self.objs])
+        self.assertRedirects(response, '/files/', fetch_redirect_response=False)
+        self.assertEqual(self.post([obj.pk for obj in self.objs[:2]]).status_code, 200)
+
+    def test_face_check(self):
+        ids = [self.objs[0].pk]
+        self.assertRedirects(self.post(ids, face=None), '/files/', fetch_redirect_response=False)
+        self.assertRedirects(self.post(ids, match=False), '/files/', fetch_redirect_response=False)
+        self.user.profile.face_image = None
+        self.user.profile.save()
+        self.assertRedirects(self.post(ids), '/files/', fetch_redirect_response=False)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'summary-tests'}})
+class DashboardSummaryTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('summary', 'summary@example.com', 'pw')
+
+    def setUp(self):
+        self.summary = DashboardSummary('default')
+        self.summary.cache.clear()
+        # the signal handlers patch the module's summary after commit
+        patcher = mock.patch('storage.summary.dashboard_summary', self.summary)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def add(self, name, data_length=100, status=StoredFile.STATUS_READY):
+        with self.captureOnCommitCallbacks(execute=True):
+            return StoredFile.objects.create(
+                user=self.user, original_name=name, nonce=b'', data_length=data_length, status=status,
+            )
+
+    def delete(self, obj):
+        with self.captureOnCommitCallbacks(execute=True):
+            obj.delete()
+
+    def fresh(self):
+        return self.summary._fresh(self.user.pk)
+
+    def test_totals_count_ready_files_only(self):
+        self.add('a', 100)
+        self.add('b', 50, status=StoredFile.STATUS_PROCESSING)
+        self.add('c', 70, status=StoredFile.STATUS_FAILED)
+        summary = self.summary.get(self.user.pk)
+        self.assertEqual((summary['total_files'], summary['total_bytes']), (1, 100))
+        self.assertEqual(len(summary['recent_ids']), 3)
+
+    def test_cached_summary_is_patched_in_place(self):
+        first = self.add('a', 100)
+        self.summary.get(self.user.pk)
+        second = self.add('b', 20)
+        queued = self.add('queued', 30, status=StoredFile.STATUS_PROCESSING)
+        with self.assertNumQueries(0):
+            summary = self.summary.get(self.user.pk)
+        self.assertEqual((summary['total_files'], summary['total_bytes']), (2, 120))
+        self.assertEqual(summary['recent_ids'], [queued.pk, second.pk, first.pk])
+        self.assertEqual(summary, {**self.summary.compute(self.user.pk), 'generation': summary['generation']})
+
+    def test_removing_an_older_file_is_patched(self):
+        old = self.add('old', 100)
+        for i in range(5):
+            self.add(f'new{i}', 10)
+        self.summary.get(self.user.pk)
+        self.delete(old)
+        self.assertEqual(self.fresh()['total_bytes'], 50)
+
+    def test_removing_a_recent_file_drops_the_summary(self):
+        self.add('a')
+        recent = self.add('b')
+        self.summary.get(self.user.pk)
+        self.delete(recent)
+        self.assertIsNone(self.fresh())
+        self.assertEqual(self.summary.get(self.user.pk)['total_files'], 1)
+
+    def test_status_change_drops_the_summary(self):
+        obj = self.add('job', 40, status=StoredFile.STATUS_PROCESSING)
+        self.summary.get(self.user.pk)
+        obj.status = StoredFile.STATUS_READY
+        with self.captureOnCommitCallbacks(execute=True):
+            obj.save(update_fields=['status'])
+        self.assertIsNone(self.fresh())
+        self.assertEqual(self.summary.get(self.user.pk)['total_bytes'], 40)
+
+    def test_change_during_rebuild_is_not_cached(self):
+        compute = self.summary.compute
+
+        def racing_compute(user_id):
+            result = compute(user_id)
+            self.add('raced')
+            return result
+
+        with mock.patch.object(self.summary, 'compute', racing_compute):
+            self.assertEqual(self.summary.get(self.user.pk)['total_files'], 0)
+        self.assertIsNone(self.fresh())
+        self.assertEqual(self.summary.get(self.user.pk)['total_files'], 1)
+
+    def test_waits_for_a_concurrent_rebuild(self):
+        self.add('a')
+        _, _, lock_key = self.summary._keys(self.user.pk)
+        self.summary.cache.add(lock_key, 1)
+        # the request holding the lock finishes while we wait
+        with mock.patch('storage.summary.time.sleep', side_effect=lambda _: self.summary.rebuild(self.user.pk)), \
+                mock.patch.object(self.summary, 'compute', wraps=self.summary.compute) as compute:
+            self.assertEqual(self.summary.get(self.user.pk)['total_files'], 1)
+        self.assertEqual(compute.call_count, 1)
+
+    def test_gives_up_waiting_and_computes_uncached(self):
+        self.add('a')
+        _, _, lock_key = self.summary._keys(self.user.pk)
+        self.summary.cache.add(lock_key, 1)
+        with mock.patch('storage.summary.time.sleep'), \
+                mock.patch('storage.summary.time.monotonic', side_effect=[0, 0.5, 2]):
+            self.assertEqual(self.summary.get(self.user.pk)['total_files'], 1)
+        self.assertIsNone(self.fresh())
+
+    def test_without_a_cache(self):
+        self.summary = DashboardSummary(None)
+        with mock.patch('storage.summary.dashboard_summary', self.summary):
+            self.add('a', 100)
+            self.assertEqual(self.summary.get(self.user.pk)['total_bytes'], 100)
+            self.add('b', 20)
+            self.assertEqual(self.summary.get(self.user.pk)['total_bytes'], 120)
+
+    @override_settings(DEBUG=False, STORAGE_DASHBOARD_CACHE=None)
+    def test_no_cache_passes_the_check(self):
+        self.assertEqual(check_dashboard_cache(None), [])
+
+
+class FileTypeCountTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('counts', 'counts@example.com', 'pw')
+
+    def add(self, name):
+        return StoredFile.objects.create(user=self.user, original_name=name, nonce=b'', data_length=1)
+
+    def counters(self):
+        return dict(FileTypeCount.objects.filter(user=self.user).values_list('file_type', 'count'))
+
+    def test_classify_file_type(self):
+        self.assertEqual(classify_file_type('Report.PDF'), 'PDF')
+        self.assertEqual(classify_file_type('photo.jpeg'), 'JPG')
+        self.assertEqual(classify_file_type('notes.md'), 'Other')
+        self.assertEqual(classify_file_type(''), 'Other')
+        # the first matching label in chart order wins
+        self.assertEqual(classify_file_type('scan.pdf.zip'), 'PDF')
+
+    def test_signals_keep_counters(self):
+        first = self.add('a.pdf')
+        self.add('b.pdf')
+        self.add('c.txt')
+        self.assertEqual(self.counters(), {'PDF': 2, 'TXT': 1})
+        first.delete()
+        self.assertEqual(self.counters(), {'PDF': 1, 'TXT': 1})
+
+    def test_counts_match_with_and_without_counters(self):
+        self.add('a.pdf')
+        self.add('b.zip')
+        self.add('c.bin')
+        expected = {label: 0 for label in ('PDF', 'ZIP', 'PPTX', 'DOCX', 'XLSX', 'TXT', 'PNG', 'JPG', 'Other')}
+        expected.update(PDF=1, ZIP=1, Other=1)
+        with override_settings(STORAGE_FILE_TYPE_COUNTERS=True), self.assertNumQueries(1):
+            self.assertEqual(file_type_counts(self.user), expected)
+        with override_settings(STORAGE_FILE_TYPE_COUNTERS=False):
+            self.assertEqual(file_type_counts(self.user), expected)
+
+    def test_command_repairs_drift(self):
+        self.add('a.pdf')
+        self.add('b.png')
+        other = User.objects.create_user('other', 'other@example.com', 'pw')
+        FileTypeCount.objects.filter(user=self.user, file_type='PDF').update(count=7)
+        FileTypeCount.objects.create(user=self.user, file_type='ZIP', count=3)
+        FileTypeCount.objects.create(user=other, file_type='TXT', count=2)
+        out = io.StringIO()
+        call_command('rebuild_file_type_counts', '--user', 'counts', stdout=out)
+        self.assertEqual(self.counters(), {'PDF': 1, 'PNG': 1})
+        self.assertIn('Rebuilt file type counts for 1 users', out.getvalue())
+        # users not named are left alone
+        self.assertEqual(FileTypeCount.objects.get(user=other).count, 2)
+        call_command('rebuild_file_type_counts', stdout=io.StringIO())
+        self.assertFalse(FileTypeCount.objects.filter(user=other).exists())
+
+
+class KeyCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        self.cache = KeyCache(maxsize=2, ttl=10)
+        self.built = []
+        clock = mock.patch('storage.keycache.time.monotonic', return_value=1000.0)
+        self.clock = clock.start()
+        self.addCleanup(clock.stop)
+
+    def factory(self, user_id):
+        self.built.append(user_id)
+        return f'key-{user_id}-{len(self.built)}'
+
+    def test_hit_until_ttl_expires(self):
+        first = self.cache.get(1, self.factory)
+        self.clock.return_value = 1009.0
+        self.assertEqual(self.cache.get(1, self.factory), first)
+        self.clock.return_value = 1010.0
+        self.assertNotEqual(self.cache.get(1, self.factory), first)
+        self.assertEqual(self.built, [1, 1])
+
+    def test_least_recently_used_is_evicted(self):
+        self.cache.get(1, self.factory)
+        self.cache.get(2, self.factory)
+        self.cache.get(1, self.factory)
+        self.cache.get(3, self.factory)
+        self.cache.get(1, self.factory)
+        self.cache.get(2, self.factory)
+        self.assertEqual(self.built, [1, 2, 3, 2])
+
+    def test_key_version_follows_secret_key(self):
+        with override_settings(SECRET_KEY='first'):
+            version = self.cache.key_version()
+            self.cache.get(1, self.factory)
+            self.assertEqual(self.cache.key_version(), version)
+        with override_settings(SECRET_KEY='second'):
+            self.assertNotEqual(self.cache.key_version(), version)
+            self.cache.get(1, self.factory)
+        self.assertEqual(self.built, [1, 1])
+
+    def test_rotating_secret_key_clears_the_shared_cache(self):
+        key_cache.get('rotate', self.factory)
+        with override_settings(SECRET_KEY='rotated'):
+            self.assertNotIn('rotate', [k[0] for k in key_cache._entries])
+
+    def test_invalidate(self):
+        self.cache.get(1, self.factory)
+        self.cache.get(2, self.factory)
+        self.cache.invalidate(1)
+        self.cache.get(1, self.factory)
+        self.cache.get(2, self.factory)
+        self.assertEqual(self.built, [1, 2, 1])
+        self.cache.invalidate()
+        self.assertEqual(self.cache.stats()['size'], 0)
+
+    def test_stats(self):
+        self.cache.get(1, self.factory)
+        self.cache.get(1, self.factory)
+        self.cache.get(2, self.factory)
+        self.cache.get(3, self.factory)
+        self.assertEqual(self.cache.stats(), {'hits': 1, 'misses': 3, 'evictions': 1, 'size': 2, 'maxsize': 2})
+
+
+class CiphertextCacheTests(SimpleTestCase):
+
+    def test_memory_backend_evicts_least_recently_used(self):
+        cache = MemoryBackend(max_bytes=10)
+        cache.set('a', b'aaaa')
+        cache.set('b', b'bbbb')
+        cache.get('a')
+        cache.set('c', b'cccc')
+        self.assertEqual([cache.get(k) for k in 'abc'], [b'aaaa', None, b'cccc'])
+        cache.set('a', b'aaaaaa')
+        self.assertEqual(cache._size, 10)
+        cache.set('big', b'x' * 11)
+        self.assertIsNone(cache.get('big'))
+        self.assertEqual(cache.get('a'), b'aaaaaa')
+
+    def test_disk_backend_evicts_oldest_files(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = DiskBackend(max_bytes=10, location=tmp)
+            cache.set('a', b'aaaa')
+            cache.set('b', b'bbbb')
+            # mtimes are the recency; pin them so the order is not left to the clock
+            past = time.time() - 100
+            os.utime(cache._path('a'), (past, past))
+            os.utime(cache._path('b'), (past + 1, past + 1))
+            self.assertEqual(cache.get('a'), b'aaaa')
+            cache.set('c', b'cccc')
+            self.assertEqual([cache.get(k) for k in 'abc'], [b'aaaa', None, b'cccc'])
+            cache.set('big', b'x' * 11)
+            self.assertIsNone(cache.get('big'))
+            self.assertEqual(sum(p.stat().st_size for p in cache.location.iterdir()), 8)
+
+    def test_hit_skips_image_decoding(self):
+        payload = os.urandom(300)
+        data, _ = PNGCodec().encode(hide_data_in_image(np.array(Image.new('RGB', (32, 32))), payload))
+        obj = SimpleNamespace(
+            pk=1, fingerprint='f', shard_count=0, data_length=len(payload), stego_image=ContentFile(data),
+        )
+        config = {'BACKEND': 'storage.ciphercache.MemoryBackend', 'MAX_BYTES': 4096}
+        with override_settings(STORAGE_CIPHERTEXT_CACHE=config), \
+                mock.patch('storage.ciphercache.extract_data_from_image', wraps=extract_data_from_image) as extract:
+            self.assertEqual(cached_ciphertext(obj), payload)
+            with mock.patch('PIL.Image.open') as image_open:
+                self.assertEqual(cached_ciphertext(obj), payload)
+            image_open.assert_not_called()
+            self.assertEqual(extract.call_count, 1)
+            obj.fingerprint = 'changed'
+            obj.stego_image = ContentFile(data)
+            self.assertEqual(cached_ciphertext(obj), payload)
+            self.assertEqual(extract.call_count, 2)
+
+    def test_disabled_cache(self):
+        with override_settings(STORAGE_CIPHERTEXT_CACHE=None):
+            self.assertIsNone(cached_ciphertext(SimpleNamespace()))
@@ -1,5 +1,5 @@
 from django.urls import path
-from .views import file_list_view, upload_view, download_view, landing_view, dashboard_view, history_view
+from .views import file_list_view, upload_view, download_view, batch_download_view, landing_view, dashboard_view, history_view, upload_status_view
 
 urlpatterns = [
     path('', landing_view, name='landing'),
@@ -7,5 +7,7 @@ urlpatterns = [
     path('files/', file_list_view, name='file_list'),
     path('history/', history_view, name='history'),
     path('upload/', upload_view, name='upload'),
+    path('upload/<int:pk>/status/', upload_status_view, name='upload_status'),
     path('file/<int:pk>/download/', download_view, name='download'),
+    path('files/download/', batch_download_view, name='batch_download'),
 ]
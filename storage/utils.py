@@ -3,7 +3,11 @@ from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 from cryptography.hazmat.primitives import hashes
 from PIL import Image
+from .codecs import open_stego_image
+from .keycache import key_cache
+import numpy as np
 import io
+import itertools
 import os
 
 def derive_key(user_id: int) -> bytes:
@@ -11,71 +15,245 @@ def derive_key(user_id: int) -> bytes:
     hkdf = HKDF(algorithm=hashes.SHA256(), length=32, salt=salt, info=b'securecloud')
     return hkdf.derive(settings.SECRET_KEY.encode())
 
+def get_aesgcm(user_id: int) -> AESGCM:
+    # HKDF runs once per user per cache TTL; see storage.keycache
+    return key_cache.get(user_id, lambda uid: AESGCM(derive_key(uid)))
+
 def aes_encrypt(user_id: int, data: bytes) -> tuple[bytes, bytes]:
-    key = derive_key(user_id)
-    aesgcm = AESGCM(key)
+    aesgcm = get_aesgcm(user_id)
     nonce = os.urandom(12)
     ct = aesgcm.encrypt(nonce, data, None)
     return ct, nonce
 
 def aes_decrypt(user_id: int, nonce: bytes, ciphertext: bytes) -> bytes:
-    key = derive_key(user_id)
-    aesgcm = AESGCM(key)
+    aesgcm = get_aesgcm(user_id)
     return aesgcm.decrypt(nonce, ciphertext, None)
 
-def hide_data_in_image(cover_image_path: str, data: bytes) -> Image.Image:
-    img = Image.open(cover_image_path).convert('RGB')
-    pixels = img.load()
-    bitstream = []
-    length = len(data)
+# Chunked format (cipher version 2):
+#   stream header: version (1 byte) | chunk size (4 bytes, big endian)
+#   per chunk:     flags+length (4 bytes) | AES-GCM ciphertext | tag (16 bytes)
+# The chunk header's top bit marks the final chunk; the remaining 31 bits are
+# the plaintext length. Each chunk's nonce is the record nonce with the chunk
+# index XORed into its last 4 bytes, and both headers are bound as AAD so
+# chunks cannot be reordered, dropped or truncated.
+CIPHER_LEGACY = 1
+CIPHER_CHUNKED = 2
+STREAM_HEADER_SIZE = 5
+CHUNK_HEADER_SIZE = 4
+TAG_SIZE = 16
+FINAL_CHUNK = 0x80000000
+
+def get_chunk_size() -> int:
+    return getattr(settings, 'STORAGE_CHUNK_SIZE', 64 * 1024)
+
+def encrypted_length(size: int, chunk_size: int | None = None) -> int:
+    chunk_size = chunk_size or get_chunk_size()
+    chunks = max(1, -(-size // chunk_size))
+    return STREAM_HEADER_SIZE + chunks * (CHUNK_HEADER_SIZE + TAG_SIZE) + size
+
+def _chunk_nonce(nonce: bytes, index: int) -> bytes:
+    counter = int.from_bytes(nonce[8:], 'big') ^ index
+    return nonce[:8] + counter.to_bytes(4, 'big')
+
+def _rechunk(chunks, chunk_size: int):
+    # yield (block, is_final) pairs of exactly chunk_size bytes except the last
+    buf = bytearray()
+    pending = None
+    for piece in chunks:
+        buf += piece
+        while len(buf) >= chunk_size:
+            if pending is not None:
+                yield pending, False
+            pending = bytes(buf[:chunk_size])
+            del buf[:chunk_size]
+    if pending is not None:
+        if not buf:
+            yield pending, True
+            return
+        yield pending, False
+    yield bytes(buf), True
+
+def aes_encrypt_stream(user_id: int, chunks, chunk_size: int | None = None):
+    """Encrypt an iterable of plaintext pieces (e.g. UploadedFile.chunks()).
+
+    Returns a generator of ciphertext pieces in the chunked format and the
+    record nonce to store on the StoredFile.
+    """
+    chunk_size = chunk_size or get_chunk_size()
+    aesgcm = get_aesgcm(user_id)
+    nonce = os.urandom(12)
+    stream_header = bytes([CIPHER_CHUNKED]) + chunk_size.to_bytes(4, 'big')
+
+    def generate():
+        yield stream_header
+        for index, (block, final) in enumerate(_rechunk(chunks, chunk_size)):
+            chunk_header = (len(block) | (FINAL_CHUNK if final else 0)).to_bytes(4, 'big')
+            yield chunk_header
+            yield aesgcm.encrypt(_chunk_nonce(nonce, index), block, stream_header + chunk_header)
+
+    return generate(), nonce
+
+def _decrypt_frame(aesgcm: AESGCM, nonce: bytes, stream_header: bytes, index: int, frame: bytes) -> bytes:
+    chunk_header = frame[:CHUNK_HEADER_SIZE]
+    return aesgcm.decrypt(_chunk_nonce(nonce, index), frame[CHUNK_HEADER_SIZE:], stream_header + chunk_header)
+
+def aes_decrypt_stream(user_id: int, nonce: bytes, ciphertext, version: int = CIPHER_CHUNKED):
+    """Yield plaintext chunks from ciphertext bytes or an iterable of pieces.
+
+    Legacy single-shot records (CIPHER_LEGACY) are decrypted in one go.
+    """
+    pieces = [ciphertext] if isinstance(ciphertext, (bytes, bytearray, memoryview)) else ciphertext
+    if version == CIPHER_LEGACY:
+        yield aes_decrypt(user_id, nonce, b''.join(bytes(p) for p in pieces))
+        return
+    aesgcm = get_aesgcm(user_id)
+    buf = bytearray()
+    stream_header = None
+    index = 0
+    for piece in pieces:
+        buf += piece
+        if stream_header is None:
+            if len(buf) < STREAM_HEADER_SIZE:
+                continue
+            stream_header = bytes(buf[:STREAM_HEADER_SIZE])
+            del buf[:STREAM_HEADER_SIZE]
+            if stream_header[0] != CIPHER_CHUNKED:
+                raise ValueError('Unsupported cipher stream version')
+        while len(buf) >= CHUNK_HEADER_SIZE:
+            flags = int.from_bytes(buf[:CHUNK_HEADER_SIZE], 'big')
+            frame = CHUNK_HEADER_SIZE + (flags & ~FINAL_CHUNK) + TAG_SIZE
+            if len(buf) < frame:
+                break
+            block = _decrypt_frame(aesgcm, nonce, stream_header, index, bytes(buf[:frame]))
+            del buf[:frame]
+            index += 1
+            yield block
+            if flags & FINAL_CHUNK:
+                return
+    raise ValueError('Truncated cipher stream')
+
+def aes_decrypt_range(user_id: int, nonce: bytes, read_ciphertext, ct_length: int, start: int, end: int):
+    """Yield plaintext bytes start..end (inclusive) of a chunked record.
+
+    read_ciphertext(offset, size) returns ciphertext bytes at a byte offset;
+    only the chunks that overlap the range are read and decrypted.
+    """
+    stream_header = read_ciphertext(0, STREAM_HEADER_SIZE)
+    if len(stream_header) < STREAM_HEADER_SIZE or stream_header[0] != CIPHER_CHUNKED:
+        raise ValueError('Unsupported cipher stream version')
+    chunk_size = int.from_bytes(stream_header[1:], 'big')
+    frame_size = CHUNK_HEADER_SIZE + chunk_size + TAG_SIZE
+    aesgcm = get_aesgcm(user_id)
+    for index in range(start // chunk_size, end // chunk_size + 1):
+        offset = STREAM_HEADER_SIZE + index * frame_size
+        frame = read_ciphertext(offset, min(frame_size, ct_length - offset))
+        block = _decrypt_frame(aesgcm, nonce, stream_header, index, frame)
+        base = index * chunk_size
+        yield block[max(start - base, 0):end - base + 1]
+
+def load_cover_pixels(cover) -> np.ndarray:
+    """Decode a cover (path or file) into an RGB uint8 pixel array."""
+    with Image.open(cover) as img:
+        return np.array(img.convert('RGB'), dtype=np.uint8)
+
+def hide_data_in_image(cover_image_path, data, length: int | None = None) -> Image.Image:
+    """Embed data (bytes, or an iterable of byte pieces totalling `length`).
+
+    The cover is a path, a file, or a pixel array from load_cover_pixels,
+    which is copied rather than modified.
+    """
+    if isinstance(data, (bytes, bytearray)):
+        length = len(data)
+        data = [data]
     header = length.to_bytes(4, 'big')
-    payload = header + data
-    for byte in payload:
-        for i in range(8):
-            bitstream.append((byte >> (7 - i)) & 1)
-    width, height = img.size
-    capacity = width * height * 3
-    if len(bitstream) > capacity:
+    if isinstance(cover_image_path, np.ndarray):
+        pixels = cover_image_path.copy()
+    else:
+        pixels = load_cover_pixels(cover_image_path)
+    channels = pixels.reshape(-1)
+    total_bits = (len(header) + length) * 8
+    if total_bits > channels.size:
         raise ValueError('Data too large for cover image')
-    idx = 0
-    for y in range(height):
-        for x in range(width):
-            if idx >= len(bitstream):
-                return img
-            r, g, b = pixels[x, y]
-            if idx < len(bitstream):
-                r = (r & ~1) | bitstream[idx]; idx += 1
-            if idx < len(bitstream):
-                g = (g & ~1) | bitstream[idx]; idx += 1
-            if idx < len(bitstream):
-                b = (b & ~1) | bitstream[idx]; idx += 1
-            pixels[x, y] = (r, g, b)
-    return img
-
-def extract_data_from_image(stego_image_path: str) -> bytes:
-    img = Image.open(stego_image_path).convert('RGB')
-    pixels = img.load()
+    # one bit per channel, MSB first, in row-major R,G,B order
+    offset = 0
+    for piece in itertools.chain([header], data):
+        bits = np.unpackbits(np.frombuffer(piece, dtype=np.uint8))
+        if offset + bits.size > total_bits:
+            raise ValueError('Embedded data does not match declared length')
+        target = channels[offset:offset + bits.size]
+        np.bitwise_and(target, 0xFE, out=target)
+        np.bitwise_or(target, bits, out=target)
+        offset += bits.size
+    if offset != total_bits:
+        raise ValueError('Embedded data does not match declared length')
+    return Image.fromarray(pixels, 'RGB')
+
+HEADER_BITS = 32
+
+def embed_capacity(width: int, height: int) -> int:
+    """Largest payload in bytes that hide_data_in_image fits in a cover."""
+    return max(0, (width * height * 3 - HEADER_BITS) // 8)
+
+def _read_lsb_bytes(img: Image.Image, start_bit: int, nbytes: int) -> bytes:
+    # only crop and convert the rows that hold the requested bit range
     width, height = img.size
-    bits = []
-    for y in range(height):
-        for x in range(width):
-            r, g, b = pixels[x, y]
-            bits.append(r & 1)
-            bits.append(g & 1)
-            bits.append(b & 1)
-    def bits_to_bytes(bits_list):
-        out = bytearray()
-        for i in range(0, len(bits_list), 8):
-            byte_bits = bits_list[i:i+8]
-            if len(byte_bits) < 8:
-                break
-            val = 0
-            for j, bit in enumerate(byte_bits):
-                val |= (bit << (7 - j))
-            out.append(val)
-        return bytes(out)
-    raw = bits_to_bytes(bits)
-    if len(raw) < 4:
+    row_bits = width * 3
+    end_bit = start_bit + nbytes * 8
+    first_row = start_bit // row_bits
+    last_row = min(height, -(-end_bit // row_bits))
+    region = img.crop((0, first_row, width, last_row)).convert('RGB')
+    channels = np.asarray(region, dtype=np.uint8).reshape(-1)
+    offset = start_bit - first_row * row_bits
+    bits = channels[offset:offset + nbytes * 8] & 1
+    return np.packbits(bits).tobytes()
+
+def _payload_length(img: Image.Image, data_length: int | None) -> int:
+    width, height = img.size
+    capacity = width * height * 3
+    if capacity < HEADER_BITS:
+        return 0
+    if data_length is None:
+        data_length = int.from_bytes(_read_lsb_bytes(img, 0, 4), 'big')
+    return min(data_length, (capacity - HEADER_BITS) // 8)
+
+def extract_data_from_image(stego_image_path: str, data_length: int | None = None) -> bytes:
+    img = open_stego_image(stego_image_path)
+    data_length = _payload_length(img, data_length)
+    if not data_length:
         return b''
-    length = int.from_bytes(raw[:4], 'big')
-    return raw[4:4+length]
+    return _read_lsb_bytes(img, HEADER_BITS, data_length)
+
+def ciphertext_reader(stego_image_path, data_length: int | None = None):
+    """Return a read(offset, size) callable for random access to the payload."""
+    img = open_stego_image(stego_image_path)
+    data_length = _payload_length(img, data_length)
+
+    def read(offset: int, size: int) -> bytes:
+        size = max(0, min(size, data_length - offset))
+        return _read_lsb_bytes(img, HEADER_BITS + offset * 8, size)
+
+    return read
+
+def decrypted_length(ct_length: int, version: int, stream_header: bytes = b'') -> int:
+    """Plaintext size for a stored ciphertext of ct_length bytes."""
+    if version == CIPHER_LEGACY:
+        return ct_length - TAG_SIZE
+    chunk_size = int.from_bytes(stream_header[1:STREAM_HEADER_SIZE], 'big')
+    frames = -(-(ct_length - STREAM_HEADER_SIZE) // (CHUNK_HEADER_SIZE + chunk_size + TAG_SIZE))
+    return ct_length - STREAM_HEADER_SIZE - frames * (CHUNK_HEADER_SIZE + TAG_SIZE)
+
+def open_decrypt_stream(user_id: int, nonce: bytes, ct_pieces, ct_length: int, version: int = CIPHER_CHUNKED):
+    """Return (plaintext length, plaintext chunk iterator) for streamed ciphertext.
+
+    The stream header is peeked from the first piece so the length is known
+    before any chunk is decrypted.
+    """
+    ct_pieces = iter(ct_pieces)
+    head = b''
+    if version != CIPHER_LEGACY:
+        for piece in ct_pieces:
+            head += piece
+            if len(head) >= STREAM_HEADER_SIZE:
+                break
+        ct_pieces = itertools.chain([head], ct_pieces)
+    return decrypted_length(ct_length, version, head), aes_decrypt_stream(user_id, nonce, ct_pieces, version)
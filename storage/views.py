@@ -1,13 +1,24 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
-from django.http import HttpResponse
+from django.conf import settings
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import require_POST
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
 from .forms import UploadForm
 from .models import StoredFile
-from .utils import aes_encrypt, aes_decrypt, hide_data_in_image, extract_data_from_image
-from django.core.files.base import ContentFile
+from .pagination import paginate_files
+from .summary import dashboard_summary
+from .pipeline import create_stored_file, enqueue_upload, use_upload_jobs
+from .utils import (
+    aes_decrypt_range, ciphertext_reader, decrypted_length, get_chunk_size,
+    open_decrypt_stream, CIPHER_CHUNKED, STREAM_HEADER_SIZE,
+)
+from .archive import stream_zip
+from .ciphercache import cached_ciphertext
+from .shards import iter_shard_ciphertext, shard_reader
 from django.contrib import messages
 from accounts.views import faces_match
-import io
 
 def landing_view(request):
     if request.user.is_authenticated:
@@ -16,26 +27,28 @@ def landing_view(request):
 
 @login_required
 def dashboard_view(request):
-    files = StoredFile.objects.filter(user=request.user).order_by('-created_at')
-    recent_files = list(files[:5])
-    total_files = files.count()
-    last_login = request.user.last_login
+    summary = dashboard_summary.get(request.user.pk)
+    recent = StoredFile.objects.in_bulk(summary['recent_ids'])
     ctx = {
-        'recent_files': recent_files,
-        'total_files': total_files,
-        'last_login': last_login,
+        'recent_files': [recent[pk] for pk in summary['recent_ids'] if pk in recent],
+        'total_files': summary['total_files'],
+        'total_bytes': summary['total_bytes'],
+        'last_upload': summary['last_upload'],
+        'last_login': request.user.last_login,
     }
     return render(request, 'storage/dashboard.html', ctx)
 
 @login_required
 def file_list_view(request):
-    files = StoredFile.objects.filter(user=request.user).order_by('-created_at')
-    return render(request, 'storage/file_list.html', {'files': files})
+    files = StoredFile.objects.filter(user=request.user).order_by('-created_at', '-id')
+    page = paginate_files(request, files)
+    return render(request, 'storage/file_list.html', {'files': page, 'page_obj': page})
 
 @login_required
 def history_view(request):
-    files = StoredFile.objects.filter(user=request.user).order_by('-created_at')
-    return render(request, 'storage/history.html', {'files': files})
+    files = StoredFile.objects.filter(user=request.user).order_by('-created_at', '-id')
+    page = paginate_files(request, files)
+    return render(request, 'storage/history.html', {'files': page, 'page_obj': page})
 
 @login_required
 def upload_view(request):
@@ -44,57 +57,163 @@ def upload_view(request):
         if form.is_valid():
             up_file = form.cleaned_data['file']
             cover = form.cleaned_data['cover_image']
-            data = up_file.read()
-            ct, nonce = aes_encrypt(request.user.id, data)
-            # ensure cover content is available for both PIL and model save
-            if hasattr(cover, 'temporary_file_path'):
-                cover_path = cover.temporary_file_path()
-            else:
-                cover.seek(0)
-                cover_buf = io.BytesIO(cover.read())
-                cover_path = cover_buf
-                cover.seek(0)
-            stego_img = hide_data_in_image(cover_path, ct)
-            output = io.BytesIO()
-            stego_img.save(output, format='PNG')
-            output.seek(0)
-            stego_content = ContentFile(output.read(), name=f"{up_file.name}.png")
-            obj = StoredFile.objects.create(
-                user=request.user,
-                original_name=up_file.name,
-                cover_image=cover,
-                stego_image=stego_content,
-                nonce=nonce,
-                data_length=len(ct),
-            )
+            if use_upload_jobs():
+                obj = enqueue_upload(request.user, up_file, cover)
+                messages.info(request, f'Your file "{up_file.name}" is being encrypted.')
+                return redirect('upload_status', pk=obj.pk)
+            create_stored_file(request.user, up_file, cover)
             messages.success(request, f'Your file "{up_file.name}" was uploaded successfully.')
             request.session['last_uploaded_filename'] = up_file.name
             return redirect('upload')
+        status = 413 if form.has_error('file', 'cover_too_small') else 400
     else:
         form = UploadForm()
+        status = 200
     last_uploaded = request.session.pop('last_uploaded_filename', None)
-    return render(request, 'storage/upload.html', {'form': form, 'last_uploaded_filename': last_uploaded})
+    return render(request, 'storage/upload.html', {'form': form, 'last_uploaded_filename': last_uploaded}, status=status)
 
 @login_required
-def download_view(request, pk: int):
+def upload_status_view(request, pk: int):
     obj = get_object_or_404(StoredFile, pk=pk, user=request.user)
+    if request.headers.get('Accept', '').startswith('application/json'):
+        return JsonResponse({'id': obj.pk, 'status': obj.status})
+    if obj.status == StoredFile.STATUS_READY:
+        messages.success(request, f'Your file "{obj.original_name}" was uploaded successfully.')
+        return redirect('file_list')
+    if obj.status == StoredFile.STATUS_FAILED:
+        messages.error(request, f'Your file "{obj.original_name}" could not be processed.')
+        return redirect('upload')
+    return render(request, 'storage/upload_status.html', {'file': obj})
+
+def _parse_range(header: str, length: int):
+    """Return (start, end) for a single satisfiable byte range, None to ignore
+    the header, or False when the range cannot be satisfied."""
+    units, _, spec = header.partition('=')
+    if units.strip() != 'bytes' or ',' in spec:
+        return None
+    first, _, last = spec.strip().partition('-')
+    try:
+        if first:
+            start = int(first)
+            end = int(last) if last else length - 1
+        else:
+            start = max(length - int(last), 0)
+            end = length - 1
+    except ValueError:
+        return None
+    if start >= length:
+        return False
+    if start > end:
+        return None
+    return start, min(end, length - 1)
+
+def _if_range_matches(request, etag: str, last_modified: int) -> bool:
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if not if_range:
+        return True
+    if if_range.startswith('"'):
+        return if_range == etag
+    return parse_http_date_safe(if_range) == last_modified
+
+def _check_face(request, missing_message):
+    """Return a redirect if the POSTed face capture does not match, else None."""
+    if not hasattr(request.user, 'profile') or not request.user.profile.face_image:
+        messages.error(request, 'No registered face found for this account.')
+        return redirect('file_list')
+    face_data = request.POST.get('face_login_data') or ''
+    if not face_data:
+        messages.error(request, missing_message)
+        return redirect('file_list')
+    if not faces_match(request.user.profile, face_data):
+        messages.error(request, 'Face not recognized. Download blocked.')
+        return redirect('file_list')
+    return None
+
+@login_required
+def download_view(request, pk: int):
+    obj = get_object_or_404(StoredFile, pk=pk, user=request.user, status=StoredFile.STATUS_READY)
+    etag = quote_etag(obj.fingerprint)
+    last_modified = int(obj.created_at.timestamp())
+    if request.method in ('GET', 'HEAD'):
+        not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if not_modified is not None:
+            return not_modified
     if request.method == 'POST':
-        if not hasattr(request.user, 'profile') or not request.user.profile.face_image:
-            messages.error(request, 'No registered face found for this account.')
-            return redirect('file_list')
-        face_data = request.POST.get('face_login_data') or ''
-        if not face_data:
-            messages.error(request, 'Face capture is required to download this file.')
-            return redirect('file_list')
-        if not faces_match(request.user.profile.face_image, face_data):
-            messages.error(request, 'Face not recognized. Download blocked.')
-            return redirect('file_list')
-    obj.stego_image.open()
-    buf = io.BytesIO(obj.stego_image.read())
-    ct = extract_data_from_image(buf)
-    data = aes_decrypt(request.user.id, bytes(obj.nonce), ct)
-    resp = HttpResponse(data, content_type='application/octet-stream')
+        face_error = _check_face(request, 'Face capture is required to download this file.')
+        if face_error is not None:
+            return face_error
+    nonce = bytes(obj.nonce)
+    ct = cached_ciphertext(obj)
+    if ct is not None:
+        read_ct = lambda offset, size: ct[offset:offset + size]
+    elif obj.shard_count:
+        read_ct = shard_reader(obj)
+    else:
+        obj.stego_image.open('rb')
+        read_ct = ciphertext_reader(obj.stego_image, obj.data_length)
+    byte_range = None
+    if obj.cipher_version == CIPHER_CHUNKED and 'HTTP_RANGE' in request.META and _if_range_matches(request, etag, last_modified):
+        length = decrypted_length(obj.data_length, obj.cipher_version, read_ct(0, STREAM_HEADER_SIZE))
+        byte_range = _parse_range(request.META['HTTP_RANGE'], length)
+        if byte_range is False:
+            obj.stego_image.close()
+            resp = HttpResponse(status=416)
+            resp['Content-Range'] = f'bytes */{length}'
+            return resp
+    if byte_range:
+        start, end = byte_range
+        chunks = aes_decrypt_range(request.user.id, nonce, read_ct, obj.data_length, start, end)
+    else:
+        piece = get_chunk_size()
+        if ct is None and obj.shard_count:
+            # extract upcoming shards in parallel rather than reading LSBs in order
+            ct_pieces = iter_shard_ciphertext(obj)
+        else:
+            ct_pieces = (read_ct(offset, piece) for offset in range(0, obj.data_length, piece))
+        length, chunks = open_decrypt_stream(request.user.id, nonce, ct_pieces, obj.data_length, obj.cipher_version)
+
+    def stream():
+        try:
+            yield from chunks
+        finally:
+            obj.stego_image.close()
+
+    resp = StreamingHttpResponse(stream(), content_type='application/octet-stream')
+    if byte_range:
+        resp.status_code = 206
+        resp['Content-Range'] = f'bytes {start}-{end}/{length}'
+        resp['Content-Length'] = str(end - start + 1)
+    else:
+        resp['Content-Length'] = str(length)
+    if obj.cipher_version == CIPHER_CHUNKED:
+        resp['Accept-Ranges'] = 'bytes'
+    resp['ETag'] = etag
+    resp['Last-Modified'] = http_date(last_modified)
     resp['Content-Disposition'] = f'attachment; filename="{obj.original_name}"'
     return resp
 
+@login_required
+@require_POST
+def batch_download_view(request):
+    try:
+        ids = list(dict.fromkeys(int(pk) for pk in request.POST.getlist('ids')))
+    except ValueError:
+        return HttpResponse(status=400)
+    if not ids:
+        messages.error(request, 'Select at least one file to download.')
+        return redirect('file_list')
+    max_files = getattr(settings, 'STORAGE_ZIP_MAX_FILES', 100)
+    if len(ids) > max_files:
+        messages.error(request, f'You can download at most {max_files} files at once.')
+        return redirect('file_list')
+    found = StoredFile.objects.filter(user=request.user, status=StoredFile.STATUS_READY).prefetch_related('shards').in_bulk(ids)
+    if len(found) != len(ids):
+        raise Http404('No StoredFile matches the given query.')
+    face_error = _check_face(request, 'Face capture is required to download these files.')
+    if face_error is not None:
+        return face_error
+    resp = StreamingHttpResponse(stream_zip(request.user.id, [found[pk] for pk in ids]), content_type='application/zip')
+    resp['Content-Disposition'] = 'attachment; filename="securecloud-files.zip"'
+    return resp
+
 # Create your views here.